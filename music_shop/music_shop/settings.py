@@ -43,12 +43,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the session, auth and cart queries are counted too.
+    "shop_main.instrumentation.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "shop_main.cart.CartMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
@@ -90,9 +93,84 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Take the write lock when a transaction starts so concurrent
+        # checkouts queue up instead of failing with "database is locked".
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Catalog and product page data are cached with per-model version counters
+# (see shop_main/cache.py). Any backend works; in production point "default"
+# at a shared one such as Redis or Memcached so versions are shared between
+# workers, or use FileBasedCache for a single host.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "music-shop",
     }
 }
 
+SHOP_CACHE_ALIAS = "default"
+SHOP_CACHE_TIMEOUT = 60 * 60
+
+# Cart storage for signed-in and anonymous shoppers. Alternatives:
+# "shop_main.cart.CacheCartBackend" (either) and
+# "shop_main.cart.SignedCookieCartBackend" (anonymous only).
+SHOP_CART_BACKEND = "shop_main.cart.DatabaseCartBackend"
+SHOP_CART_ANONYMOUS_BACKEND = "shop_main.cart.SignedCookieCartBackend"
+SHOP_CART_CACHE_ALIAS = "default"
+
+# How long units added to a cart stay held for the shopper, in seconds.
+# Expired holds are released by "manage.py sweep_reservations".
+SHOP_RESERVATION_TTL = 15 * 60
+
+# Where table row counts (database overview, admin, API pages) come from:
+# "exact" (COUNT(*), batched), "estimated" (planner statistics) or
+# "counter" (RowCount rows kept by signals; "manage.py refresh_row_counts").
+SHOP_ROW_COUNT_MODE = "exact"
+
+# Largest page the REST API serves for ?page_size=.
+SHOP_API_MAX_PAGE_SIZE = 500
+# Most rows one request to a bulk endpoint (/api/<model>/bulk/) may carry.
+SHOP_BULK_MAX_ROWS = 1000
+# Rows fetched per database round trip by the streaming exports.
+SHOP_EXPORT_CHUNK_SIZE = 2000
+
+# Resized copies of product pictures (shop_main.images): widths in pixels
+# and the formats offered before the JPEG/PNG fallback. Formats the
+# installed Pillow cannot encode are skipped.
+SHOP_IMAGE_WIDTHS = (280, 420, 560, 840)
+SHOP_IMAGE_FORMATS = ("avif", "webp")
+# Of those, the formats encoded in the request that uploads a picture; the
+# rest are added by the build_image_variants command.
+SHOP_IMAGE_INLINE_FORMATS = ()
+
+# Per-request SQL numbers (shop_main.instrumentation): a Server-Timing
+# header on every response and a JSON line on the "shop_main.sql" logger
+# for a sample of requests plus every request over one of its view's
+# thresholds ("*" applies to all views; keys are URL names).
+SHOP_SQL_SERVER_TIMING = True
+SHOP_SQL_LOG_SAMPLE_RATE = 0.01
+SHOP_SQL_LOG_THRESHOLDS = {
+    "*": {"queries": 50, "sql_ms": 250, "repeats": 10},
+    "overview": {"queries": 20},
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "shop_main.sql": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -135,6 +213,11 @@ STATICFILES_DIRS = [
 # Media files
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# Product pictures are stored under a hash of their content
+# (shop_main.storage). The web server serving MEDIA_URL should send
+# "Cache-Control: public, max-age=31536000, immutable" for
+# products/images/<xx>/<sha256>.* and products/derived/, as the
+# development server does.
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -149,7 +232,7 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.BasicAuthentication",
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "shop_main.pagination.ShopApiPagination",
     "PAGE_SIZE": 10,
     "DEFAULT_FILTER_BACKENDS": [
         "rest_framework.filters.SearchFilter",
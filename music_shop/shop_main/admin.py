@@ -9,16 +9,20 @@ from .models import (
     ShippingAddress,
     Coupon
 )
+from .pagination import CountingPaginator
 
 
 # Register your models here.
-@admin.register(Artist, Genre, OrderItem, Order, Review, Coupon, ShippingAddress)
+@admin.register(Artist, Genre, OrderItem, Review, Coupon, ShippingAddress)
 class ShopAdmin(admin.ModelAdmin):
-    pass
+    paginator = CountingPaginator
+    show_full_result_count = False
 
 
 class ProductAdmin(admin.ModelAdmin):
     model = Product
+    paginator = CountingPaginator
+    show_full_result_count = False
     list_display = [
         "product_name",
         "price",
@@ -30,3 +34,16 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Product, ProductAdmin)
+
+
+class OrderAdmin(admin.ModelAdmin):
+    model = Order
+    paginator = CountingPaginator
+    show_full_result_count = False
+    list_display = ["id", "user", "status", "date_order", "item_count", "total"]
+    list_filter = ["status"]
+    list_select_related = ["user"]
+    readonly_fields = ["subtotal", "discount", "total", "item_count"]
+
+
+admin.site.register(Order, OrderAdmin)
@@ -1,8 +1,23 @@
-from rest_framework import viewsets
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.routers import DefaultRouter
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.permissions import IsAdminUser
 
+from .bulk import CREATE, INVALID, UPDATE, UPSERT
+from .conditional import (
+    add_validators,
+    fingerprint,
+    make_etag,
+    not_modified,
+    viewer_parts,
+)
+
+from .filters import ProductSearchFilter
 from .models import (
     Genre,
     Artist,
@@ -24,49 +39,172 @@ from .serializers import (
     CouponSerializer,
 )
 
+# Query parameters that pick a page rather than the rows being paged.
+PAGE_PARAMS = ("cursor", "page", "page_size", "count")
+
+
+class ConditionalMixin:
+    """ETag validators on list and detail reads, so unchanged payloads are
+    answered with 304 before any serialization.
+
+    The ETag comes from the cache versions named in ``cache_dependencies``,
+    which every write path bumps. Models with ``updated_at`` also fold a
+    cached count/max(updated_at) fingerprint into it, and their detail
+    responses carry Last-Modified.
+    """
+
+    cache_dependencies = ()
+
+    def has_updated_at(self):
+        return any(
+            field.name == "updated_at" for field in self.queryset.model._meta.fields
+        )
+
+    def get_validators(self, request, queryset, parts):
+        summary = None
+        if self.has_updated_at():
+            summary = fingerprint(queryset, parts, self.cache_dependencies)
+        etag = make_etag(
+            f"api:{self.basename}",
+            {
+                **parts,
+                "query": request.query_params.urlencode(),
+                "format": request.accepted_renderer.format,
+                **viewer_parts(request),
+                "fingerprint": summary,
+            },
+            self.cache_dependencies,
+        )
+        return etag, summary
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        filters = sorted(
+            (key, request.query_params.getlist(key))
+            for key in request.query_params
+            if key not in PAGE_PARAMS
+        )
+        etag, _ = self.get_validators(request, queryset, {"filters": filters})
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return add_validators(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not str(pk).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).filter(pk=pk)
+        etag, summary = self.get_validators(request, queryset, {"pk": str(pk)})
+        last_modified = summary["last_modified"] if summary else None
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified)
 
-class GenreViewSet(viewsets.ModelViewSet):
+
+class BulkWriteMixin:
+    """Batch writes on ``<list url>/bulk/``, one transaction per request.
+
+    ``POST`` creates every row, ``PATCH`` partially updates rows by ``id``
+    and ``PUT`` upserts on ``bulk_upsert_key``: rows matching an existing
+    object replace its fields, the rest are created. The response has one
+    ``{"status", "id"}`` or ``{"status": "invalid", "errors"}`` entry per
+    input row; invalid rows are skipped and the rest are still written.
+    """
+
+    bulk_upsert_key = ("id",)
+    bulk_modes = {"POST": CREATE, "PATCH": UPDATE, "PUT": UPSERT}
+
+    @action(detail=False, methods=["post", "patch", "put"])
+    def bulk(self, request):
+        mode = self.bulk_modes[request.method]
+        serializer = self.get_serializer(
+            data=request.data, many=True, partial=mode == UPDATE
+        )
+        results = serializer.bulk_write(mode, self.bulk_upsert_key)
+        summary = {}
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+        if not summary.get(INVALID):
+            code = status.HTTP_200_OK
+        elif summary[INVALID] == len(results):
+            code = status.HTTP_400_BAD_REQUEST
+        else:
+            code = status.HTTP_207_MULTI_STATUS
+        return Response({"summary": summary, "results": results}, status=code)
+
+
+class GenreViewSet(ConditionalMixin, BulkWriteMixin, viewsets.ModelViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("genre",)
     filter_backends = [SearchFilter]
     search_fields = ["genre_name"]
 
 
-class ArtistViewSet(viewsets.ModelViewSet):
+class ArtistViewSet(ConditionalMixin, BulkWriteMixin, viewsets.ModelViewSet):
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("artist",)
     filter_backends = [SearchFilter]
     search_fields = ["artist_name"]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalMixin, BulkWriteMixin, viewsets.ModelViewSet):
     queryset = Product.objects.select_related("genre", "artist").all()
     serializer_class = ProductSerializer
     permission_classes = [IsAdminUser]
-    filter_backends = [SearchFilter]
-    search_fields = ["product_name"]
+    cache_dependencies = ("product",)
+    filter_backends = [ProductSearchFilter, OrderingFilter]
+    ordering_fields = ["price", "created_at", "product_name", "rating_avg"]
+    bulk_upsert_key = ("product_name", "artist")
+
+    def get_queryset(self):
+        queryset = self.queryset
+        value = self.request.query_params.get("min_rating")
+        if value:
+            try:
+                queryset = queryset.filter(rating_avg__gte=float(value))
+            except ValueError:
+                raise ValidationError({"min_rating": "Введите число."})
+        return queryset
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Order.objects.select_related("user", "shipping_address", "coupon").all()
     serializer_class = OrderSerializer
     permission_classes = [IsAdminUser]
-    filter_backends = [SearchFilter]
+    # Deleting a coupon or an address nulls the link with a plain UPDATE.
+    cache_dependencies = ("order", "coupon", "shippingaddress")
+    filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ["status"]
+    ordering_fields = ["date_order", "total", "item_count"]
+    ordering = ["-date_order", "-id"]
 
     def get_queryset(self):
-        return self.queryset
+        queryset = self.queryset
+        for param, lookup in (("min_total", "total__gte"), ("max_total", "total__lte")):
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: Decimal(value)})
+                except InvalidOperation:
+                    raise ValidationError({param: "Введите число."})
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save()
 
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderItemViewSet(ConditionalMixin, BulkWriteMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.select_related("order", "product").all()
     serializer_class = OrderItemSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("orderitem",)
     filter_backends = [SearchFilter]
     search_fields = ["product__product_name"]
 
@@ -74,10 +212,11 @@ class OrderItemViewSet(viewsets.ModelViewSet):
         return self.queryset
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Review.objects.select_related("user", "product").all()
     serializer_class = ReviewSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("review",)
     filter_backends = [SearchFilter]
     search_fields = ["text"]
 
@@ -88,10 +227,11 @@ class ReviewViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 
-class ShippingAddressViewSet(viewsets.ModelViewSet):
+class ShippingAddressViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = ShippingAddress.objects.select_related("user").all()
     serializer_class = ShippingAddressSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("shippingaddress",)
     filter_backends = [SearchFilter]
     search_fields = ["city"]
 
@@ -102,10 +242,11 @@ class ShippingAddressViewSet(viewsets.ModelViewSet):
         serializer.save()
 
 
-class CouponViewSet(viewsets.ModelViewSet):
+class CouponViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
     permission_classes = [IsAdminUser]
+    cache_dependencies = ("coupon", "coupon_redemptions")
     filter_backends = [SearchFilter]
     search_fields = ["code"]
 
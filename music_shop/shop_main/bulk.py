@@ -0,0 +1,269 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueTogetherValidator
+
+CREATE = "create"
+UPDATE = "update"
+UPSERT = "upsert"
+
+CREATED = "created"
+UPDATED = "updated"
+INVALID = "invalid"
+
+# Sent once per bulk write with the saved instances, since bulk_create and
+# bulk_update send no post_save. ``previous`` maps the pk of every updated
+# instance to the old values ({attname: value}) of the fields it changed.
+bulk_saved = Signal()
+
+
+def get_max_rows():
+    return getattr(settings, "SHOP_BULK_MAX_ROWS", 1000)
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field that resolves ids from the objects a bulk write has
+    loaded up front (``context["related"]``), not with one query per row."""
+
+    def to_internal_value(self, data):
+        loaded = self.context.get("related", {}).get(self.field_name)
+        if loaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if pk not in loaded:
+            self.fail("does_not_exist", pk_value=data)
+        return loaded[pk]
+
+
+def _to_pk(model, value):
+    if value is None or isinstance(value, (bool, dict, list)):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except (TypeError, ValueError, DjangoValidationError):
+        return None
+
+
+def _field_value(model, name, data, instance=None):
+    field = model._meta.get_field(name)
+    if name in data:
+        value = data[name]
+        return value.pk if field.is_relation and value is not None else value
+    if instance is not None:
+        return getattr(instance, field.attname)
+    return None
+
+
+def _lock_by_values(model, fields, keys):
+    """Rows of ``model`` whose ``fields`` match one of ``keys``, locked, from
+    one query that filters each field by IN and matches tuples here."""
+    if not keys:
+        return {}
+    attnames = [model._meta.get_field(name).attname for name in fields]
+    lookups = {
+        f"{attname}__in": {key[i] for key in keys} for i, attname in enumerate(attnames)
+    }
+    rows = {}
+    for obj in model.objects.select_for_update().filter(**lookups):
+        key = tuple(getattr(obj, attname) for attname in attnames)
+        if key in keys:
+            rows[key] = obj
+    return rows
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """``many=True`` serializer that writes a batch with ``bulk_create`` and
+    ``bulk_update`` in one transaction.
+
+    Unlike the stock list serializer it does not reject the whole batch on
+    the first invalid row: every row is validated on its own, the valid rows
+    are written and ``bulk_write`` reports a result for each input row.
+    Related ids and existing rows are loaded with one query per field, and
+    unique_together sets are checked per batch instead of per row.
+    """
+
+    def bulk_write(self, mode, key=("id",)):
+        rows = self.initial_data
+        if not isinstance(rows, list):
+            raise ValidationError({"non_field_errors": ["Ожидается список объектов."]})
+        if len(rows) > get_max_rows():
+            raise ValidationError(
+                {"non_field_errors": [f"Не больше {get_max_rows()} объектов за раз."]}
+            )
+        model = self.child.Meta.model
+        self.child.validators = [
+            validator
+            for validator in self.child.validators
+            if not isinstance(validator, UniqueTogetherValidator)
+        ]
+        self.results = [None] * len(rows)
+        with transaction.atomic():
+            self.context["related"] = self.load_related(rows)
+            valid = self.validate_rows(rows)
+            targets = self.match_existing(model, mode, key, valid)
+            self.check_unique_together(model, targets)
+            created, updated, previous = self.save_rows(model, targets)
+            bulk_saved.send(
+                sender=model, created=created, updated=updated, previous=previous
+            )
+        return self.results
+
+    def fail_row(self, index, errors):
+        self.results[index] = {"status": INVALID, "errors": errors}
+
+    def load_related(self, rows):
+        related = {}
+        for name, field in self.child.fields.items():
+            if field.read_only or not isinstance(
+                field, PrefetchedPrimaryKeyRelatedField
+            ):
+                continue
+            queryset = field.get_queryset()
+            ids = {
+                _to_pk(queryset.model, row.get(name))
+                for row in rows
+                if isinstance(row, dict)
+            }
+            ids.discard(None)
+            related[name] = queryset.in_bulk(ids)
+        return related
+
+    def validate_rows(self, rows):
+        valid = []
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                self.fail_row(index, {"non_field_errors": ["Ожидается объект."]})
+                continue
+            try:
+                data = self.child.run_validation(row)
+            except ValidationError as exc:
+                self.fail_row(index, exc.detail)
+                continue
+            valid.append((index, row.get("id"), data))
+        return valid
+
+    def match_existing(self, model, mode, key, valid):
+        """[(index, instance or None, data)] for the valid rows; None means
+        the row is created."""
+        by_id = mode == UPDATE or (mode == UPSERT and key == ("id",))
+        if by_id:
+            ids = {_to_pk(model, row_id) for _, row_id, _ in valid}
+            ids.discard(None)
+            existing = {
+                obj.pk: obj
+                for obj in model.objects.select_for_update().filter(pk__in=ids)
+            }
+        elif mode == UPSERT:
+            keys = {
+                tuple(_field_value(model, name, data) for name in key)
+                for _, _, data in valid
+            }
+            existing = _lock_by_values(model, key, keys)
+        targets = []
+        seen = set()
+        for index, row_id, data in valid:
+            instance = None
+            if by_id:
+                pk = _to_pk(model, row_id)
+                if pk is None and mode == UPDATE:
+                    self.fail_row(index, {"id": ["Обязательное поле."]})
+                    continue
+                if pk is not None:
+                    instance = existing.get(pk)
+                    if instance is None:
+                        self.fail_row(index, {"id": ["Объект не найден."]})
+                        continue
+                identity = pk
+            elif mode == UPSERT:
+                identity = tuple(_field_value(model, name, data) for name in key)
+                instance = existing.get(identity)
+            else:
+                identity = None
+            if identity is not None:
+                if identity in seen:
+                    self.fail_row(
+                        index, {"non_field_errors": ["Объект повторяется в пакете."]}
+                    )
+                    continue
+                seen.add(identity)
+            targets.append((index, instance, data))
+        return targets
+
+    def check_unique_together(self, model, targets):
+        for fields in model._meta.unique_together:
+            keys = {}
+            for index, instance, data in targets:
+                if self.results[index] is not None:
+                    continue
+                value = tuple(
+                    _field_value(model, name, data, instance) for name in fields
+                )
+                if value in keys:
+                    self.fail_row(
+                        index, {"non_field_errors": [self.unique_message(fields)]}
+                    )
+                else:
+                    keys[value] = instance.pk if instance else None
+            taken = _lock_by_values(model, fields, set(keys))
+            for index, instance, data in targets:
+                if self.results[index] is not None:
+                    continue
+                value = tuple(
+                    _field_value(model, name, data, instance) for name in fields
+                )
+                other = taken.get(value)
+                if other is not None and (instance is None or other.pk != instance.pk):
+                    self.fail_row(
+                        index, {"non_field_errors": [self.unique_message(fields)]}
+                    )
+
+    def unique_message(self, fields):
+        return f"Поля {', '.join(fields)} должны образовывать уникальный набор."
+
+    def save_rows(self, model, targets):
+        targets = [target for target in targets if self.results[target[0]] is None]
+        now = timezone.now()
+        auto_now = [
+            field.name
+            for field in model._meta.concrete_fields
+            if getattr(field, "auto_now", False)
+        ]
+        created = []
+        updated = []
+        previous = {}
+        update_fields = set(auto_now)
+        for index, instance, data in targets:
+            if instance is None:
+                instance = model(**data)
+                created.append((index, instance))
+                continue
+            old = {}
+            for name, value in data.items():
+                attname = model._meta.get_field(name).attname
+                before = getattr(instance, attname)
+                setattr(instance, name, value)
+                if getattr(instance, attname) != before:
+                    old[attname] = before
+                update_fields.add(name)
+            for name in auto_now:
+                setattr(instance, name, now)
+            previous[instance.pk] = old
+            updated.append((index, instance))
+        model.objects.bulk_create([obj for _, obj in created])
+        if updated:
+            model.objects.bulk_update(
+                [obj for _, obj in updated], sorted(update_fields), batch_size=500
+            )
+        for status, saved in ((CREATED, created), (UPDATED, updated)):
+            for index, obj in saved:
+                self.results[index] = {"status": status, "id": obj.pk}
+        return [obj for _, obj in created], [obj for _, obj in updated], previous
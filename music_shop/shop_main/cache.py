@@ -0,0 +1,136 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = "shop"
+NAMESPACES = (
+    "catalog",
+    "catalog_facets",
+    "genre_ids",
+    "product",
+    "product_reviews",
+)
+
+
+def get_cache():
+    return caches[getattr(settings, "SHOP_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "SHOP_CACHE_TIMEOUT", 60 * 60)
+
+
+def _version_key(name):
+    return f"{KEY_PREFIX}:version:{name}"
+
+
+def _stat_key(namespace, outcome):
+    return f"{KEY_PREFIX}:stats:{namespace}:{outcome}"
+
+
+def get_versions(names):
+    """Current version of every dependency in ``names``.
+
+    A missing counter (never bumped, or evicted) is seeded with the current
+    time in nanoseconds rather than 1 so a recreated counter can never
+    collide with a version that entries were stored under before eviction.
+    """
+    cache = get_cache()
+    keys = {name: _version_key(name) for name in names}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for name, key in keys.items():
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def _bump(names):
+    cache = get_cache()
+    for name in names:
+        key = _version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def bump_version(*names):
+    """Invalidate every entry depending on ``names`` once the current
+    transaction commits, so a concurrent reader cannot re-cache rows that
+    are about to be rolled back or are not yet visible."""
+    transaction.on_commit(lambda: _bump(names))
+
+
+def _record(namespace, outcome):
+    cache = get_cache()
+    key = _stat_key(namespace, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def make_key(namespace, parts, depends_on):
+    versions = get_versions(depends_on)
+    raw = json.dumps([parts, versions], sort_keys=True, default=str)
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f"{KEY_PREFIX}:{namespace}:{digest}"
+
+
+def get_or_set(namespace, parts, depends_on, producer, timeout=None):
+    """Return the cached value for ``parts`` or build it with ``producer``.
+
+    The key embeds the current version of every name in ``depends_on``;
+    ``bump_version`` on any of them makes old entries unreachable, and the
+    backend evicts them on its own schedule.
+    """
+    cache = get_cache()
+    key = make_key(namespace, parts, depends_on)
+    value = cache.get(key)
+    if value is not None:
+        _record(namespace, "hits")
+        return value
+    _record(namespace, "misses")
+    value = producer()
+    if value is not None:
+        cache.set(key, value, timeout or get_timeout())
+    return value
+
+
+def stats(namespaces):
+    cache = get_cache()
+    keys = [
+        _stat_key(namespace, outcome)
+        for namespace in namespaces
+        for outcome in ("hits", "misses")
+    ]
+    values = cache.get_many(keys)
+    report = {}
+    for namespace in namespaces:
+        hits = values.get(_stat_key(namespace, "hits"), 0)
+        misses = values.get(_stat_key(namespace, "misses"), 0)
+        total = hits + misses
+        report[namespace] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else None,
+        }
+    return report
+
+
+def reset_stats(namespaces):
+    get_cache().delete_many(
+        [
+            _stat_key(namespace, outcome)
+            for namespace in namespaces
+            for outcome in ("hits", "misses")
+        ]
+    )
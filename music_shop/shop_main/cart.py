@@ -0,0 +1,380 @@
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+from .models import CartItem, Product
+from .reservations import reserve
+
+MAX_QUANTITY = 99
+MAX_LINES = 100
+COOKIE_NAME = "cart"
+COOKIE_SALT = "shop_main.cart"
+COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+
+PRICED_FIELDS = ("product_name", "price", "stock_quantity")
+
+
+def _clamp(quantity):
+    return max(0, min(int(quantity), MAX_QUANTITY))
+
+
+class CartBackend:
+    """Storage for one shopper's cart: a mapping of product id to quantity.
+
+    Backends register themselves on the request so ``CartMiddleware`` can
+    call ``persist`` with the outgoing response. ``keyed_by_user`` backends
+    store anonymous and signed-in carts separately and get merged on login.
+    """
+
+    keyed_by_user = True
+
+    def __init__(self, request, anonymous=None):
+        self.request = request
+        if anonymous is None:
+            anonymous = not request.user.is_authenticated
+        self.anonymous = anonymous
+        if not hasattr(request, "_cart_backends"):
+            request._cart_backends = []
+        request._cart_backends.append(self)
+
+    def lines(self):
+        raise NotImplementedError
+
+    def add(self, product_id, quantity=1):
+        raise NotImplementedError
+
+    def accepts(self, product_id, quantity=1):
+        """How many of ``quantity`` units ``add`` would store: a line is
+        capped at ``MAX_QUANTITY``."""
+        current = self.lines().get(product_id, 0)
+        return max(0, min(quantity, MAX_QUANTITY - current))
+
+    def decrement(self, product_id, quantity=1):
+        raise NotImplementedError
+
+    def remove(self, product_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def persist(self, response):
+        pass
+
+    def priced_lines(self):
+        lines = self.lines()
+        products = Product.objects.filter(pk__in=lines).only(*PRICED_FIELDS)
+        return [(product, lines[product.pk]) for product in products]
+
+
+class MappingCartBackend(CartBackend):
+    """Base for backends that load and store the whole cart as one value."""
+
+    def __init__(self, request, anonymous=None):
+        super().__init__(request, anonymous)
+        self._lines = None
+        self.modified = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def store(self, lines):
+        raise NotImplementedError
+
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.load()
+        return dict(self._lines)
+
+    def _write(self, lines):
+        self._lines = lines
+        self.modified = True
+        self.store(lines)
+
+    def add(self, product_id, quantity=1):
+        lines = self.lines()
+        if product_id not in lines and len(lines) >= MAX_LINES:
+            return
+        lines[product_id] = _clamp(lines.get(product_id, 0) + quantity)
+        if not lines[product_id]:
+            del lines[product_id]
+        self._write(lines)
+
+    def accepts(self, product_id, quantity=1):
+        """As for any backend, and nothing for a new line once the cart has
+        ``MAX_LINES`` of them."""
+        lines = self.lines()
+        if product_id not in lines and len(lines) >= MAX_LINES:
+            return 0
+        return super().accepts(product_id, quantity)
+
+    def decrement(self, product_id, quantity=1):
+        self.add(product_id, -quantity)
+
+    def remove(self, product_id):
+        lines = self.lines()
+        if lines.pop(product_id, None) is not None:
+            self._write(lines)
+
+    def clear(self):
+        self._write({})
+
+
+class SignedCookieCartBackend(MappingCartBackend):
+    """Anonymous cart kept client-side as a signed ``id:qty,id:qty`` string."""
+
+    keyed_by_user = False
+
+    def load(self):
+        value = self.request.COOKIES.get(COOKIE_NAME)
+        if not value:
+            return {}
+        try:
+            raw = signing.Signer(salt=COOKIE_SALT).unsign(value)
+        except signing.BadSignature:
+            return {}
+        lines = {}
+        for part in raw.split(",")[:MAX_LINES]:
+            product_id, _, quantity = part.partition(":")
+            try:
+                quantity = _clamp(quantity)
+                if quantity:
+                    lines[int(product_id)] = quantity
+            except ValueError:
+                continue
+        return lines
+
+    def store(self, lines):
+        pass
+
+    def persist(self, response):
+        if not self.modified:
+            return
+        if not self._lines:
+            response.delete_cookie(COOKIE_NAME, samesite="Lax")
+            return
+        raw = ",".join(f"{pid}:{qty}" for pid, qty in self._lines.items())
+        response.set_cookie(
+            COOKIE_NAME,
+            signing.Signer(salt=COOKIE_SALT).sign(raw),
+            max_age=COOKIE_MAX_AGE,
+            samesite="Lax",
+            httponly=True,
+        )
+
+
+class CacheCartBackend(MappingCartBackend):
+    """Cart stored in a Django cache under the user id, or for anonymous
+    shoppers under a random id kept in the session (the session key itself
+    is rotated on login)."""
+
+    timeout = COOKIE_MAX_AGE
+
+    def get_cache(self):
+        return caches[getattr(settings, "SHOP_CART_CACHE_ALIAS", "default")]
+
+    def get_key(self):
+        if not self.anonymous:
+            return f"shop:cart:user:{self.request.user.pk}"
+        session = self.request.session
+        if "cart_id" not in session:
+            session["cart_id"] = uuid.uuid4().hex
+        return f"shop:cart:anonymous:{session['cart_id']}"
+
+    def load(self):
+        return self.get_cache().get(self.get_key(), {})
+
+    def store(self, lines):
+        self.get_cache().set(self.get_key(), lines, self.timeout)
+
+
+class DatabaseCartBackend(CartBackend):
+    """Cart rows in ``CartItem``, one per (user, product).
+
+    ``add`` is a single ``INSERT ... ON CONFLICT DO UPDATE`` statement, so
+    adding to a cart never reads it first and concurrent adds do not lose
+    increments.
+    """
+
+    def __init__(self, request, anonymous=None):
+        super().__init__(request, anonymous)
+        self.user = request.user
+
+    def queryset(self):
+        return CartItem.objects.filter(user=self.user)
+
+    def lines(self):
+        return dict(self.queryset().values_list("product_id", "quantity"))
+
+    def add(self, product_id, quantity=1):
+        if quantity < 0:
+            return self.decrement(product_id, -quantity)
+        table = CartItem._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (user_id, product_id, quantity, updated_at) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (user_id, product_id) DO UPDATE SET "
+                f"quantity = CASE WHEN {table}.quantity + excluded.quantity > %s "
+                f"THEN %s ELSE {table}.quantity + excluded.quantity END, "
+                "updated_at = excluded.updated_at",
+                [
+                    self.user.pk,
+                    product_id,
+                    _clamp(quantity),
+                    connection.ops.adapt_datetimefield_value(timezone.now()),
+                    MAX_QUANTITY,
+                    MAX_QUANTITY,
+                ],
+            )
+
+    def accepts(self, product_id, quantity=1):
+        current = (
+            self.queryset()
+            .filter(product_id=product_id)
+            .values_list("quantity", flat=True)
+            .first()
+        )
+        return max(0, min(quantity, MAX_QUANTITY - (current or 0)))
+
+    def decrement(self, product_id, quantity=1):
+        items = self.queryset().filter(product_id=product_id)
+        if not items.filter(quantity__gt=quantity).update(
+            quantity=F("quantity") - quantity, updated_at=timezone.now()
+        ):
+            items.delete()
+
+    def remove(self, product_id):
+        self.queryset().filter(product_id=product_id).delete()
+
+    def clear(self):
+        self.queryset().delete()
+
+    def priced_lines(self):
+        items = (
+            self.queryset()
+            .select_related("product")
+            .only("quantity", *(f"product__{name}" for name in PRICED_FIELDS))
+            .order_by("pk")
+        )
+        return [(item.product, item.quantity) for item in items]
+
+
+def get_backend_class(authenticated):
+    if authenticated:
+        path = getattr(
+            settings, "SHOP_CART_BACKEND", "shop_main.cart.DatabaseCartBackend"
+        )
+    else:
+        path = getattr(
+            settings,
+            "SHOP_CART_ANONYMOUS_BACKEND",
+            "shop_main.cart.SignedCookieCartBackend",
+        )
+    return import_string(path)
+
+
+class Cart:
+    def __init__(self, request):
+        self.request = request
+        self.backend = get_backend_class(request.user.is_authenticated)(request)
+
+    def __len__(self):
+        return sum(self.backend.lines().values())
+
+    def lines(self):
+        return self.backend.lines()
+
+    def add(self, product_id, quantity=1):
+        self.backend.add(int(product_id), quantity)
+
+    def reserve_and_add(self, product_id, quantity=1):
+        """Hold stock for and add up to ``quantity`` units, cut to what the
+        cart will store so no held unit is left outside it. Returns the
+        units added: none when the stock or the cart has no room."""
+        product_id = int(product_id)
+        quantity = self.backend.accepts(product_id, quantity)
+        if quantity <= 0 or not reserve(self.request.user, product_id, quantity):
+            return 0
+        self.backend.add(product_id, quantity)
+        return quantity
+
+    def decrement(self, product_id, quantity=1):
+        self.backend.decrement(int(product_id), quantity)
+
+    def remove(self, product_id):
+        self.backend.remove(int(product_id))
+
+    def clear(self):
+        self.backend.clear()
+
+    def priced(self):
+        """Cart lines with current prices, read in one query."""
+        items = []
+        total = Decimal("0")
+        for product, quantity in self.backend.priced_lines():
+            subtotal = product.price * quantity
+            total += subtotal
+            items.append(
+                {
+                    "id": product.pk,
+                    "product": product,
+                    "quantity": quantity,
+                    "price": product.price,
+                    "subtotal": subtotal,
+                }
+            )
+        return items, total
+
+
+def merge_on_login(request, user):
+    """Fold the anonymous cart into the signed-in user's stored cart.
+
+    Lines of products that no longer exist are dropped, and the merged units
+    are reserved like any other add to the cart: a line is cut to the stock
+    still available and to ``MAX_QUANTITY``.
+    """
+    anonymous_class = get_backend_class(False)
+    user_class = get_backend_class(True)
+    if anonymous_class is user_class and not user_class.keyed_by_user:
+        return
+    anonymous = anonymous_class(request, anonymous=True)
+    lines = anonymous.lines()
+    if not lines:
+        return
+    stored = user_class(request, anonymous=False)
+    current = stored.lines()
+    products = (
+        Product.objects.filter(pk__in=lines)
+        .only("stock_quantity", "reserved_quantity")
+        .order_by("pk")
+    )
+    for product in products:
+        quantity = min(
+            lines[product.pk],
+            product.available_quantity,
+            MAX_QUANTITY - current.get(product.pk, 0),
+        )
+        if quantity > 0 and reserve(user, product.pk, quantity):
+            stored.add(product.pk, quantity)
+    anonymous.clear()
+
+
+class CartMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = SimpleLazyObject(lambda: Cart(request))
+        response = self.get_response(request)
+        for backend in getattr(request, "_cart_backends", ()):
+            backend.persist(response)
+        return response
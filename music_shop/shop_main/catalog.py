@@ -0,0 +1,165 @@
+from decimal import Decimal, InvalidOperation
+
+from . import cache as shop_cache
+from .models import Genre, Product
+from .pagination import KeysetPaginator
+from .search import search_products, tokenize
+
+SORT_OPTIONS = (
+    "created_at",
+    "-created_at",
+    "price",
+    "-price",
+    "product_name",
+    "-product_name",
+    "rating_avg",
+    "-rating_avg",
+    "relevance",
+)
+DEFAULT_SORT = "created_at"
+PAGE_SIZE = 24
+RATING_CHOICES = (4, 3, 2, 1)
+
+# Columns read by the product card in catalog.html.
+CARD_FIELDS = (
+    "product_name",
+    "price",
+    "stock_quantity",
+    "reserved_quantity",
+    "picture",
+    "picture_variants",
+    "created_at",
+    "review_count",
+    "rating_avg",
+    "artist__artist_name",
+    "genre__genre_name",
+)
+
+
+def _parse_price(value):
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    if not price.is_finite() or price < 0:
+        return None
+    return price
+
+
+def _parse_rating(value):
+    try:
+        rating = float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+    if rating is None or not 0 < rating <= 5:
+        return None
+    return rating
+
+
+def _parse_id(value):
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def genre_ids(name):
+    """Ids of the genres stored as ``name``. Filtering products on their own
+    ``genre_id`` instead of joining on the name lets the (genre, sort key)
+    indexes return a page already in order."""
+    return shop_cache.get_or_set(
+        "genre_ids",
+        {"name": name},
+        ("genre",),
+        lambda: list(
+            Genre.objects.filter(genre_name=name).values_list("pk", flat=True)
+        ),
+    )
+
+
+class CatalogQuery:
+    """Normalized catalog request: filters, sort key and keyset cursor."""
+
+    def __init__(
+        self,
+        genre=None,
+        artist=None,
+        min_price=None,
+        max_price=None,
+        min_rating=None,
+        search=None,
+        sort=DEFAULT_SORT,
+        cursor=None,
+    ):
+        self.genre = genre or None
+        self.artist = artist
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_rating = min_rating
+        self.search = search if tokenize(search) else None
+        if sort not in SORT_OPTIONS or (sort == "relevance" and not self.search):
+            sort = DEFAULT_SORT
+        self.sort = sort
+        self.cursor = cursor or None
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(
+            genre=(params.get("genre") or "").strip(),
+            artist=_parse_id(params.get("artist")),
+            min_price=_parse_price(params.get("min_price")),
+            max_price=_parse_price(params.get("max_price")),
+            min_rating=_parse_rating(params.get("min_rating")),
+            search=(params.get("search") or "").strip(),
+            sort=params.get("sort") or ("relevance" if params.get("search") else None),
+            cursor=params.get("cursor"),
+        )
+
+    def params(self, cursor=True):
+        values = {
+            "genre": self.genre,
+            "artist": self.artist,
+            "min_price": self.min_price,
+            "max_price": self.max_price,
+            "min_rating": self.min_rating,
+            "search": self.search,
+            "sort": self.sort,
+        }
+        if cursor:
+            values["cursor"] = self.cursor
+        return {key: str(value) for key, value in values.items() if value is not None}
+
+    def filter(self, queryset=None, exclude=()):
+        if queryset is None:
+            queryset = Product.objects.all()
+        if self.genre and "genre" not in exclude:
+            ids = genre_ids(self.genre)
+            if len(ids) == 1:
+                queryset = queryset.filter(genre_id=ids[0])
+            else:
+                queryset = queryset.filter(genre_id__in=ids)
+        if self.artist is not None and "artist" not in exclude:
+            queryset = queryset.filter(artist_id=self.artist)
+        if "price" not in exclude:
+            if self.min_price is not None:
+                queryset = queryset.filter(price__gte=self.min_price)
+            if self.max_price is not None:
+                queryset = queryset.filter(price__lte=self.max_price)
+        if self.min_rating is not None and "rating" not in exclude:
+            queryset = queryset.filter(rating_avg__gte=self.min_rating)
+        if self.search and "search" not in exclude:
+            queryset = search_products(queryset, self.search, ranked=False)
+        return queryset
+
+    def queryset(self):
+        queryset = self.filter().select_related("artist", "genre").only(*CARD_FIELDS)
+        if self.sort == "relevance":
+            queryset = search_products(queryset, self.search)
+        return queryset
+
+    def page(self, page_size=PAGE_SIZE):
+        ordering = "-search_rank" if self.sort == "relevance" else self.sort
+        paginator = KeysetPaginator(self.queryset(), ordering, page_size)
+        return paginator.page(self.cursor)
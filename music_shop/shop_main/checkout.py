@@ -0,0 +1,135 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .cache import bump_version
+from .coupons import redeem as redeem_coupon
+from .counts import adjust as adjust_row_count
+from .models import Order, OrderItem, Product
+from .reservations import consume as consume_reservations
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class CheckoutResult:
+    def __init__(self, order, placed, rejected):
+        self.order = order
+        # product id -> quantity ordered
+        self.placed = placed
+        # product id -> (requested, available)
+        self.rejected = rejected
+
+    @property
+    def trimmed(self):
+        return bool(self.rejected)
+
+
+def place_order(user, lines, shipping_address=None, coupon=None, partial=True):
+    """Turn cart ``lines`` ({product_id: quantity}) into a placed order.
+
+    Everything runs in one transaction: the products are locked in id order
+    (so two checkouts touching the same products cannot deadlock), the
+    shopper's stock reservations are converted, stock is decremented by one
+    conditional UPDATE for all lines and the order items are written with
+    one INSERT. With ``partial`` a line larger than the
+    stock is trimmed to what is left; otherwise it is rejected and nothing
+    is written. A ``coupon`` is redeemed in the same transaction. Raises
+    ``CheckoutError`` if no line can be placed or the coupon is used up.
+    """
+    lines = {int(pid): int(qty) for pid, qty in lines.items() if int(qty) > 0}
+    if not lines:
+        raise CheckoutError("Корзина пуста.")
+
+    with transaction.atomic():
+        products = list(
+            Product.objects.select_for_update()
+            .filter(pk__in=lines)
+            .only("price", "stock_quantity", "reserved_quantity")
+            .order_by("pk")
+        )
+        # Units this shopper already holds count as available to them.
+        held = consume_reservations(user, lines)
+        placed = {}
+        rejected = {}
+        for product in products:
+            requested = lines[product.pk]
+            available = product.available_quantity + held.get(product.pk, 0)
+            quantity = min(requested, max(available, 0))
+            if quantity < requested:
+                rejected[product.pk] = (requested, available)
+            if quantity > 0:
+                placed[product.pk] = quantity
+        for pid in lines.keys() - {p.pk for p in products}:
+            rejected[pid] = (lines[pid], 0)
+        if rejected and not partial:
+            raise CheckoutError("Недостаточно товара на складе.")
+        if not placed:
+            raise CheckoutError("Товаров из корзины нет в наличии.")
+
+        quantity = Case(
+            *(When(pk=pid, then=Value(qty)) for pid, qty in placed.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        released = Case(
+            *(When(pk=pid, then=Value(qty)) for pid, qty in held.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        targets = placed.keys() | held.keys()
+        # The stock guard is redundant where SELECT ... FOR UPDATE holds row
+        # locks, but keeps the update correct on backends without them.
+        updated = (
+            Product.objects.filter(pk__in=targets)
+            .filter(
+                Q(stock_quantity__gte=F("reserved_quantity") - released + quantity)
+                | ~Q(pk__in=placed)
+            )
+            .update(
+                stock_quantity=F("stock_quantity") - quantity,
+                reserved_quantity=F("reserved_quantity") - released,
+                updated_at=timezone.now(),
+            )
+        )
+        if updated != len(targets):
+            raise CheckoutError("Остатки изменились, попробуйте ещё раз.")
+
+        if coupon is not None and not redeem_coupon(coupon):
+            raise CheckoutError("Промокод больше не действует.")
+
+        if shipping_address is not None and shipping_address.pk is None:
+            shipping_address.user = user
+            shipping_address.save()
+
+        order, _ = Order.objects.get_or_create(user=user, status="Pending")
+        OrderItem.objects.filter(order=order).delete()
+        prices = {product.pk: product.price for product in products}
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product_id=pid,
+                    quantity=qty,
+                    price_at_order=prices[pid],
+                )
+                for pid, qty in placed.items()
+            ]
+        )
+        adjust_row_count(OrderItem, len(placed))
+        bump_version("orderitem")
+        order.shipping_address = shipping_address
+        if coupon is not None:
+            order.coupon = coupon
+        applied = order.coupon if order.coupon_id else None
+        order.set_totals(
+            sum(prices[pid] * qty for pid, qty in placed.items()),
+            sum(placed.values()),
+            applied.discount_percent if applied else None,
+        )
+        order.status = "Placed"
+        order.save()
+        bump_version("product", *(f"product:{pid}" for pid in targets))
+
+    return CheckoutResult(order, placed, rejected)
@@ -0,0 +1,82 @@
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from . import cache as shop_cache
+
+
+def make_etag(namespace, parts, depends_on):
+    """Validator for a response built from ``parts`` and the data behind
+    ``depends_on``. It changes whenever ``bump_version`` moves one of those
+    names, and computing it costs cache lookups only."""
+    key = shop_cache.make_key(f"etag:{namespace}", parts, depends_on)
+    return quote_etag(key.rsplit(":", 1)[1])
+
+
+def viewer_parts(request):
+    # HTML pages embed the viewer's own data and a CSRF token derived from
+    # the secret in their cookie, so both are part of the page's identity.
+    return {"user": request.user.pk, "csrf": request.META.get("CSRF_COOKIE")}
+
+
+def fingerprint(queryset, parts, depends_on):
+    """{"count", "last_modified"} of ``queryset`` (row count and
+    max(updated_at)), cached under the versions of ``depends_on``."""
+    return shop_cache.get_or_set(
+        "fingerprint",
+        {"model": queryset.model._meta.label_lower, **parts},
+        depends_on,
+        lambda: queryset.order_by().aggregate(
+            count=Count("pk"), last_modified=Max("updated_at")
+        ),
+    )
+
+
+def not_modified(request, etag, last_modified=None):
+    """The 304 (or 412) response the request's preconditions call for, or
+    None when the view has to build the response."""
+    if request.method not in ("GET", "HEAD"):
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def add_validators(response, etag, last_modified=None):
+    if response.status_code != 200:
+        return response
+    if etag and not response.has_header("ETag"):
+        response["ETag"] = etag
+    if last_modified and not response.has_header("Last-Modified"):
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+def conditional(get_validators):
+    """Decorator for views answering GET with ``get_validators(request,
+    *args, **kwargs)`` -> ``(etag, last_modified)``: a matching
+    If-None-Match/If-Modified-Since is answered with 304 before the view
+    runs, otherwise the validators are added to the view's response.
+
+    A page with flash messages waiting is always rendered, without
+    validators, since the messages are shown (and consumed) only once."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if len(get_messages(request)):
+                return view(request, *args, **kwargs)
+            etag, last_modified = get_validators(request, *args, **kwargs)
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                add_validators(response, etag, last_modified)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,216 @@
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django.db.models import F
+
+from .models import (
+    Artist,
+    Coupon,
+    Genre,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+    RowCount,
+    ShippingAddress,
+)
+
+EXACT = "exact"
+ESTIMATED = "estimated"
+COUNTER = "counter"
+MODES = (EXACT, ESTIMATED, COUNTER)
+MODE_LABELS = {
+    EXACT: "точное значение",
+    ESTIMATED: "оценка по статистике СУБД",
+    COUNTER: "счётчик",
+}
+
+# Models whose counts the overview page, admin and API ask for; in the
+# counter mode these get their RowCount rows maintained by signals.
+COUNTED_MODELS = (
+    Genre,
+    Artist,
+    Product,
+    Order,
+    OrderItem,
+    Review,
+    ShippingAddress,
+    Coupon,
+)
+
+
+class TableCount:
+    def __init__(self, rows, mode):
+        self.rows = rows
+        self.mode = mode
+
+    @property
+    def mode_label(self):
+        return MODE_LABELS[self.mode]
+
+    def __int__(self):
+        return self.rows
+
+
+def get_mode():
+    mode = getattr(settings, "SHOP_ROW_COUNT_MODE", EXACT)
+    if mode not in MODES:
+        raise ValueError(f"Unknown SHOP_ROW_COUNT_MODE {mode!r}")
+    return mode
+
+
+def _connection(models):
+    return connections[router.db_for_read(models[0])]
+
+
+def exact_counts(models):
+    """Exact row counts of ``models`` from one SELECT with a COUNT(*)
+    subquery per table."""
+    if not models:
+        return {}
+    connection = _connection(models)
+    qn = connection.ops.quote_name
+    columns = ", ".join(
+        f"(SELECT COUNT(*) FROM {qn(model._meta.db_table)})" for model in models
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {columns}")
+        row = cursor.fetchone()
+    return dict(zip(models, row))
+
+
+def estimated_counts(models):
+    """Row counts from the planner statistics; models without statistics
+    (never analyzed, or an unsupported database) are left out."""
+    if not models:
+        return {}
+    connection = _connection(models)
+    tables = {model._meta.db_table: model for model in models}
+    placeholders = ", ".join(["%s"] * len(tables))
+    if connection.vendor == "postgresql":
+        sql = (
+            "SELECT c.relname, c.reltuples FROM pg_class c "
+            f"WHERE c.relname IN ({placeholders}) AND c.relkind = 'r' "
+            "AND pg_table_is_visible(c.oid)"
+        )
+    elif connection.vendor == "sqlite":
+        # The first number of sqlite_stat1.stat is the table's row count.
+        sql = f"SELECT tbl, stat FROM sqlite_stat1 WHERE tbl IN ({placeholders})"
+    else:
+        return {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, list(tables))
+            rows = cursor.fetchall()
+    except DatabaseError:
+        # sqlite_stat1 only exists once ANALYZE has run.
+        return {}
+    counts = {}
+    for table, value in rows:
+        if isinstance(value, str):
+            value = value.split(" ", 1)[0]
+        value = int(float(value))
+        # PostgreSQL reports -1 for tables that were never vacuumed/analyzed.
+        if value >= 0:
+            model = tables[table]
+            counts[model] = max(counts.get(model, 0), value)
+    return counts
+
+
+def counter_counts(models):
+    """Counts from RowCount rows. Missing rows are seeded from an exact
+    count; a write racing with the seeding can be missed, which
+    ``refresh_counters`` corrects."""
+    labels = {model._meta.label_lower: model for model in models}
+    stored = dict(
+        RowCount.objects.filter(label__in=labels).values_list("label", "rows")
+    )
+    counts = {labels[label]: rows for label, rows in stored.items()}
+    missing = [model for label, model in labels.items() if label not in stored]
+    if missing:
+        seeded = exact_counts(missing)
+        RowCount.objects.bulk_create(
+            [
+                RowCount(label=model._meta.label_lower, rows=rows)
+                for model, rows in seeded.items()
+            ],
+            ignore_conflicts=True,
+        )
+        counts.update(seeded)
+    return counts
+
+
+def table_counts(models, mode=None):
+    """{model: TableCount} for ``models`` in ``mode`` (SHOP_ROW_COUNT_MODE by
+    default). Models the mode has no number for are counted exactly, and
+    their TableCount says so."""
+    models = list(models)
+    mode = mode or get_mode()
+    if mode == ESTIMATED:
+        counts = estimated_counts(models)
+    elif mode == COUNTER:
+        counts = counter_counts([m for m in models if m in COUNTED_MODELS])
+    else:
+        counts = {}
+    result = {model: TableCount(counts[model], mode) for model in counts}
+    rest = [model for model in models if model not in counts]
+    for model, rows in exact_counts(rest).items():
+        result[model] = TableCount(rows, EXACT)
+    return result
+
+
+def count_rows(model, mode=None):
+    return table_counts([model], mode)[model]
+
+
+def _is_unfiltered(queryset):
+    query = queryset.query
+    return not (query.where or query.distinct or query.combinator)
+
+
+def estimate_query_rows(queryset):
+    """Planner estimate of the rows ``queryset`` returns, or None where the
+    database has no cheap estimate (anything but PostgreSQL)."""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_queryset(queryset, mode=None):
+    """TableCount for ``queryset``: the table count when it is unfiltered,
+    otherwise a planner estimate (``ESTIMATED``) or COUNT(*)."""
+    mode = mode or get_mode()
+    if _is_unfiltered(queryset):
+        return count_rows(queryset.model, mode)
+    if mode == ESTIMATED:
+        rows = estimate_query_rows(queryset)
+        if rows is not None:
+            return TableCount(rows, ESTIMATED)
+    return TableCount(queryset.count(), EXACT)
+
+
+def adjust(model, delta):
+    """Move the stored count of ``model`` by ``delta``; for writes that do
+    not send signals (bulk_create, raw SQL). Does nothing outside the
+    counter mode or before the count was first seeded."""
+    if delta and get_mode() == COUNTER:
+        RowCount.objects.filter(label=model._meta.label_lower).update(
+            rows=F("rows") + delta
+        )
+
+
+def refresh_counters(models=COUNTED_MODELS):
+    counts = exact_counts(list(models))
+    for model, rows in counts.items():
+        RowCount.objects.update_or_create(
+            label=model._meta.label_lower, defaults={"rows": rows}
+        )
+    return counts
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import bump_version, get_versions
+from .models import Coupon
+
+VERSION = "coupon"
+# Bumped by ``redeem``: redemption counts are not part of the cached
+# coupons, so using one must not empty every process's LRU.
+REDEMPTIONS_VERSION = "coupon_redemptions"
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_MISSING = object()
+
+
+def get_cache_size():
+    return getattr(settings, "SHOP_COUPON_CACHE_SIZE", 256)
+
+
+def _load(normalized_code):
+    return (
+        Coupon.objects.filter(normalized_code=normalized_code, active=True)
+        .only(
+            "code",
+            "normalized_code",
+            "discount_percent",
+            "active",
+            "valid_from",
+            "valid_to",
+            "max_redemptions",
+        )
+        .first()
+    )
+
+
+def _lookup(normalized_code):
+    """Active coupon for ``normalized_code`` (or None), from the in-process
+    LRU while the shared "coupon" version has not moved.
+
+    Every process keeps its own LRU; the version counter in the shop cache is
+    what tells them all that a coupon was saved or deleted somewhere. Unknown
+    codes are remembered too, so guessing codes does not reach the database.
+    """
+    version = get_versions([VERSION])[VERSION]
+    with _lock:
+        entry = _entries.get(normalized_code, _MISSING)
+        if entry is not _MISSING and entry[0] == version:
+            _entries.move_to_end(normalized_code)
+            return entry[1]
+    coupon = _load(normalized_code)
+    with _lock:
+        _entries[normalized_code] = (version, coupon)
+        _entries.move_to_end(normalized_code)
+        while len(_entries) > get_cache_size():
+            _entries.popitem(last=False)
+    return coupon
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def resolve(code, now=None):
+    """Coupon a shopper may apply right now for ``code``, or None.
+
+    The validity window is checked on every call against the cached row, so
+    a coupon starts and stops working on time without being re-read.
+    Redemption limits are only enforced by ``redeem`` at checkout.
+    """
+    normalized = Coupon.normalize_code(code)
+    if not normalized:
+        return None
+    coupon = _lookup(normalized)
+    if coupon is None or not coupon.is_valid_at(now or timezone.now()):
+        return None
+    return coupon
+
+
+def redeem(coupon, now=None):
+    """Count one use of ``coupon``; False if it is no longer valid or its
+    ``max_redemptions`` are used up.
+
+    The limit is checked and the counter incremented by one conditional
+    UPDATE, so concurrent checkouts can never redeem a coupon more often
+    than allowed. Call inside the checkout transaction.
+    """
+    now = now or timezone.now()
+    redeemed = bool(
+        Coupon.objects.filter(pk=coupon.pk, active=True)
+        .filter(Q(valid_from__isnull=True) | Q(valid_from__lte=now))
+        .filter(Q(valid_to__isnull=True) | Q(valid_to__gte=now))
+        .filter(
+            Q(max_redemptions__isnull=True) | Q(times_redeemed__lt=F("max_redemptions"))
+        )
+        .update(times_redeemed=F("times_redeemed") + 1)
+    )
+    if redeemed:
+        bump_version(REDEMPTIONS_VERSION)
+    return redeemed
@@ -0,0 +1,386 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import Prefetch
+from django.template.defaultfilters import truncatewords
+from django.utils import formats, timezone
+
+from .models import (
+    Artist,
+    Coupon,
+    Genre,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+    ShippingAddress,
+)
+from .pagination import KeysetPaginator, is_indexed
+
+PAGE_SIZE = 25
+EMPTY = "—"
+
+
+def money(value):
+    return f"{value} ₽"
+
+
+def percent(value):
+    return f"{value}%"
+
+
+def number(value):
+    return f"#{value}"
+
+
+def short_datetime(value):
+    if value is None:
+        return EMPTY
+    return formats.date_format(timezone.localtime(value), "d.m.Y H:i")
+
+
+def words(count):
+    return lambda value: truncatewords(value, count)
+
+
+def yes_no(yes="Да", no="Нет"):
+    return lambda value: yes if value else no
+
+
+class Column:
+    """One list column: a field path such as ``"price"`` or
+    ``"user__username"`` plus how to show it.
+
+    The path is all the engine needs: it decides the columns to load, the
+    joins for forward relations and the prefetches for reverse ones.
+    """
+
+    def __init__(self, path, label, sortable=False, format=None):
+        self.path = path
+        self.label = label
+        self.sortable = sortable
+        self.format = format
+
+    def value(self, obj):
+        values = [obj]
+        for name in self.path.split("__"):
+            next_values = []
+            for value in values:
+                if value is None:
+                    continue
+                value = getattr(value, name)
+                if hasattr(value, "all"):
+                    next_values.extend(value.all())
+                else:
+                    next_values.append(value)
+            values = next_values
+        if self.choices:
+            values = [self.choices.get(value, value) for value in values]
+        if self.format:
+            values = [self.format(value) for value in values]
+        values = [EMPTY if value in (None, "") else value for value in values]
+        if not self.many:
+            return values[0] if values else EMPTY
+        return ", ".join(str(value) for value in values) or EMPTY
+
+
+class CrudTable:
+    """Declarative list of one model: columns, sorting and URL names.
+
+    From the columns it derives ``only()``, ``select_related()`` and
+    ``prefetch_related()``, so a page costs the same number of queries
+    however many rows it shows, and it pages with ``KeysetPaginator`` over
+    a column that has to be indexed.
+    """
+
+    def __init__(
+        self,
+        key,
+        model,
+        title,
+        columns,
+        create_label=None,
+        empty_text="Записей пока нет.",
+        default_sort="pk",
+        owner_field=None,
+        url_prefix=None,
+        detail_url=None,
+        page_size=PAGE_SIZE,
+    ):
+        self.key = key
+        self.model = model
+        self.title = title
+        self.columns = columns
+        self.create_label = create_label
+        self.empty_text = empty_text
+        self.owner_field = owner_field
+        self.page_size = page_size
+        self.permission = f"{model._meta.app_label}.view_{model._meta.model_name}"
+        prefix = url_prefix if url_prefix is not None else key
+        self.urls = (
+            {
+                "list": f"{prefix}-list",
+                "create": f"{prefix}-create",
+                "detail": detail_url or f"{prefix}-detail",
+                "update": f"{prefix}-update",
+                "delete": f"{prefix}-delete",
+            }
+            if prefix
+            else {}
+        )
+        self._plan()
+        self.sorts = {"pk"}
+        for column in columns:
+            if column.sortable:
+                self.sorts.add(self._check_sortable(column.path))
+        if default_sort.lstrip("-") not in self.sorts:
+            raise ImproperlyConfigured(f"{key}: default sort must be sortable")
+        self.default_sort = default_sort
+
+    def _plan(self):
+        only = set()
+        select_related = set()
+        prefetch = {}
+        for column in self.columns:
+            model = self.model
+            parts = column.path.split("__")
+            column.many = False
+            column.choices = None
+            for position, name in enumerate(parts):
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    raise ImproperlyConfigured(
+                        f"{self.key}: unknown field {column.path!r}"
+                    )
+                if position == len(parts) - 1:
+                    if field.is_relation and name != field.attname:
+                        raise ImproperlyConfigured(
+                            f"{self.key}: {column.path!r} ends on a relation; "
+                            "name the related column to show"
+                        )
+                    if field.choices:
+                        column.choices = dict(field.flatchoices)
+                    only.add(column.path)
+                    if position:
+                        select_related.add("__".join(parts[:position]))
+                elif field.many_to_many or field.one_to_many:
+                    # Reverse and many-to-many relations are loaded with one
+                    # extra query per page, projected to the shown column.
+                    column.many = True
+                    lookup = "__".join(parts[: position + 1])
+                    prefetch.setdefault(lookup, (field.related_model, set()))
+                    prefetch[lookup][1].add("__".join(parts[position + 1 :]))
+                    if field.one_to_many:
+                        # The foreign key is needed to match rows to parents.
+                        prefetch[lookup][1].add(field.field.name)
+                    break
+                else:
+                    model = field.related_model
+        self.only = sorted(only)
+        self.select_related = sorted(select_related)
+        self.prefetch = [
+            Prefetch(lookup, queryset=model.objects.only(*fields))
+            for lookup, (model, fields) in sorted(prefetch.items())
+        ]
+
+    def _check_sortable(self, path):
+        try:
+            field = self.model._meta.get_field(path)
+        except FieldDoesNotExist:
+            field = None
+        if field is None or not field.concrete or "__" in path:
+            raise ImproperlyConfigured(
+                f"{self.key}: only columns of {self.model.__name__} are sortable"
+            )
+        if not is_indexed(self.model, field):
+            raise ImproperlyConfigured(
+                f"{self.key}: sorting by {path!r} needs an index on it"
+            )
+        return path
+
+    def queryset(self, user=None):
+        queryset = self.model.objects.all()
+        if self.owner_field and user is not None and not user.is_staff:
+            queryset = queryset.filter(**{self.owner_field: user})
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch)
+        return queryset.only(*self.only)
+
+    def get_sort(self, value):
+        if value and value.lstrip("-") in self.sorts:
+            return value
+        return self.default_sort
+
+    def page(self, sort=None, cursor=None, user=None):
+        sort = self.get_sort(sort)
+        paginator = KeysetPaginator(self.queryset(user), sort, self.page_size)
+        return paginator.page(cursor)
+
+    def rows(self, objects):
+        return [
+            {"object": obj, "cells": [column.value(obj) for column in self.columns]}
+            for obj in objects
+        ]
+
+
+REGISTRY = {}
+
+
+def register(table):
+    REGISTRY[table.key] = table
+    return table
+
+
+def get_table(key):
+    return REGISTRY.get(key)
+
+
+register(
+    CrudTable(
+        "genre",
+        Genre,
+        "Жанры",
+        [
+            Column("genre_name", "Название", sortable=True),
+            Column("description", "Описание", format=words(15)),
+        ],
+        create_label="Добавить жанр",
+        empty_text="Пока нет жанров.",
+        default_sort="genre_name",
+    )
+)
+register(
+    CrudTable(
+        "artist",
+        Artist,
+        "Исполнители",
+        [
+            Column("artist_name", "Имя", sortable=True),
+            Column("country", "Страна"),
+        ],
+        create_label="Добавить исполнителя",
+        empty_text="Пока нет исполнителей.",
+        default_sort="artist_name",
+    )
+)
+register(
+    CrudTable(
+        "product",
+        Product,
+        "Товары",
+        [
+            Column("product_name", "Название", sortable=True),
+            Column("artist__artist_name", "Исполнитель"),
+            Column("genre__genre_name", "Жанр"),
+            Column("price", "Цена", sortable=True, format=money),
+            Column("stock_quantity", "Остаток"),
+        ],
+        create_label="Добавить товар",
+        empty_text="Пока нет товаров.",
+        default_sort="product_name",
+        detail_url="product-detail-crud",
+    )
+)
+register(
+    CrudTable(
+        "order",
+        Order,
+        "Заказы",
+        [
+            Column("id", "ID", sortable=True, format=number),
+            Column("user__username", "Пользователь"),
+            Column("date_order", "Дата", format=short_datetime),
+            Column("status", "Статус"),
+            Column("item_count", "Товаров"),
+            Column("total", "Сумма", sortable=True, format=money),
+        ],
+        create_label="Добавить заказ",
+        empty_text="Пока нет заказов.",
+        default_sort="-id",
+        owner_field="user",
+    )
+)
+register(
+    CrudTable(
+        "orderitem",
+        OrderItem,
+        "Позиции заказов",
+        [
+            Column("order_id", "Заказ", sortable=True, format=number),
+            Column("product__product_name", "Товар"),
+            Column("quantity", "Кол-во"),
+            Column("price_at_order", "Цена", format=money),
+        ],
+        create_label="Добавить позицию",
+        empty_text="Пока нет позиций заказов.",
+        default_sort="-order_id",
+    )
+)
+register(
+    CrudTable(
+        "review",
+        Review,
+        "Отзывы",
+        [
+            Column("user__username", "Пользователь"),
+            Column("product__product_name", "Товар"),
+            Column("rating", "Оценка", sortable=True),
+            Column("created_at", "Дата", sortable=True, format=short_datetime),
+        ],
+        create_label="Добавить отзыв",
+        empty_text="Пока нет отзывов.",
+        default_sort="-created_at",
+    )
+)
+register(
+    CrudTable(
+        "shippingaddress",
+        ShippingAddress,
+        "Адреса доставки",
+        [
+            Column("user__username", "Пользователь"),
+            Column("full_name", "ФИО"),
+            Column("city", "Город", sortable=True),
+            Column("address_line", "Адрес"),
+        ],
+        create_label="Добавить адрес",
+        empty_text="Пока нет адресов.",
+        default_sort="-pk",
+        owner_field="user",
+    )
+)
+register(
+    CrudTable(
+        "coupon",
+        Coupon,
+        "Купоны",
+        [
+            Column("code", "Код", sortable=True),
+            Column("discount_percent", "Скидка", format=percent),
+            Column("active", "Статус", format=yes_no("Активен", "Неактивен")),
+            Column("times_redeemed", "Использований"),
+            Column("max_redemptions", "Лимит"),
+        ],
+        create_label="Добавить купон",
+        empty_text="Пока нет купонов.",
+        default_sort="code",
+    )
+)
+register(
+    CrudTable(
+        "user",
+        User,
+        "Пользователи",
+        [
+            Column("username", "Имя пользователя", sortable=True),
+            Column("email", "Email"),
+            Column("is_staff", "Персонал", format=yes_no()),
+            Column("groups__name", "Группы"),
+            Column("date_joined", "Регистрация", format=short_datetime),
+        ],
+        default_sort="username",
+        url_prefix="",
+    )
+)
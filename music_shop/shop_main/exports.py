@@ -0,0 +1,277 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Genre, Order, OrderItem, Product
+
+CSV = "csv"
+NDJSON = "ndjson"
+CONTENT_TYPES = {
+    CSV: "text/csv; charset=utf-8",
+    NDJSON: "application/x-ndjson; charset=utf-8",
+}
+# Rows per chunk of output handed to the response or file at once.
+FLUSH_ROWS = 500
+
+
+def get_chunk_size():
+    return getattr(settings, "SHOP_EXPORT_CHUNK_SIZE", 2000)
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _day_start(value, param):
+    day = parse_date(value) if value else None
+    if value and day is None:
+        raise ExportError(f"{param}: ожидается дата в формате ГГГГ-ММ-ДД.")
+    if day is None:
+        return None
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def parse_filters(params):
+    """Export filters from query parameters or command options: ``date_from``
+    and ``date_to`` (inclusive days), ``status`` and ``genre``."""
+    genre = params.get("genre") or None
+    if genre and genre not in Genre.GenreChoices.values:
+        raise ExportError("genre: неизвестный жанр.")
+    date_to = _day_start(params.get("date_to"), "date_to")
+    return {
+        "date_from": _day_start(params.get("date_from"), "date_from"),
+        "date_to": date_to + datetime.timedelta(days=1) if date_to else None,
+        "status": params.get("status") or None,
+        "genre": genre,
+    }
+
+
+class Export:
+    """One exported dataset: its queryset, CSV header and how each object
+    becomes an NDJSON record and CSV rows."""
+
+    name = None
+    permission = None
+    columns = ()
+
+    def queryset(self, filters):
+        raise NotImplementedError
+
+    def record(self, obj):
+        raise NotImplementedError
+
+    def csv_rows(self, record):
+        yield [record[column] for column in self.columns]
+
+
+class OrderExport(Export):
+    """Orders with user, address, coupon and items; CSV has one row per item
+    (an order without items gets one row with empty item columns)."""
+
+    name = "orders"
+    permission = "shop_main.view_order"
+    order_columns = (
+        "order_id",
+        "date_order",
+        "status",
+        "username",
+        "email",
+        "full_name",
+        "phone",
+        "city",
+        "address_line",
+        "postal_code",
+        "coupon",
+        "discount_percent",
+        "subtotal",
+        "discount",
+        "total",
+        "item_count",
+    )
+    item_columns = ("product_id", "product_name", "quantity", "price_at_order")
+    columns = order_columns + item_columns
+
+    def queryset(self, filters):
+        queryset = Order.objects.select_related(
+            "user", "shipping_address", "coupon"
+        ).prefetch_related(
+            Prefetch(
+                "orderitem_set",
+                queryset=OrderItem.objects.select_related("product")
+                .only(
+                    "order_id",
+                    "quantity",
+                    "price_at_order",
+                    "product__product_name",
+                )
+                .order_by("pk"),
+            )
+        )
+        if filters["date_from"]:
+            queryset = queryset.filter(date_order__gte=filters["date_from"])
+        if filters["date_to"]:
+            queryset = queryset.filter(date_order__lt=filters["date_to"])
+        if filters["status"]:
+            queryset = queryset.filter(status=filters["status"])
+        if filters["genre"]:
+            queryset = queryset.filter(
+                Exists(
+                    OrderItem.objects.filter(
+                        order=OuterRef("pk"),
+                        product__genre__genre_name=filters["genre"],
+                    )
+                )
+            )
+        return queryset.order_by("pk")
+
+    def record(self, order):
+        address = order.shipping_address
+        coupon = order.coupon
+        return {
+            "order_id": order.pk,
+            "date_order": order.date_order,
+            "status": order.status,
+            "username": order.user.username,
+            "email": order.user.email,
+            "full_name": address.full_name if address else "",
+            "phone": address.phone if address else "",
+            "city": address.city if address else "",
+            "address_line": address.address_line if address else "",
+            "postal_code": address.postal_code if address else "",
+            "coupon": coupon.code if coupon else "",
+            "discount_percent": coupon.discount_percent if coupon else "",
+            "subtotal": order.subtotal,
+            "discount": order.discount,
+            "total": order.total,
+            "item_count": order.item_count,
+            "items": [
+                {
+                    "product_id": item.product_id,
+                    "product_name": item.product.product_name,
+                    "quantity": item.quantity,
+                    "price_at_order": item.price_at_order,
+                }
+                for item in order.orderitem_set.all()
+            ],
+        }
+
+    def csv_rows(self, record):
+        head = [record[column] for column in self.order_columns]
+        if not record["items"]:
+            yield head + [""] * len(self.item_columns)
+        for item in record["items"]:
+            yield head + [item[column] for column in self.item_columns]
+
+
+class ProductExport(Export):
+    name = "products"
+    permission = "shop_main.view_product"
+    columns = (
+        "product_id",
+        "product_name",
+        "artist",
+        "genre",
+        "price",
+        "stock_quantity",
+        "reserved_quantity",
+        "review_count",
+        "rating_avg",
+        "created_at",
+        "updated_at",
+    )
+
+    def queryset(self, filters):
+        queryset = Product.objects.select_related("artist", "genre").only(
+            "product_name",
+            "price",
+            "stock_quantity",
+            "reserved_quantity",
+            "review_count",
+            "rating_avg",
+            "created_at",
+            "updated_at",
+            "artist__artist_name",
+            "genre__genre_name",
+        )
+        if filters["date_from"]:
+            queryset = queryset.filter(created_at__gte=filters["date_from"])
+        if filters["date_to"]:
+            queryset = queryset.filter(created_at__lt=filters["date_to"])
+        if filters["genre"]:
+            queryset = queryset.filter(genre__genre_name=filters["genre"])
+        return queryset.order_by("pk")
+
+    def record(self, product):
+        return {
+            "product_id": product.pk,
+            "product_name": product.product_name,
+            "artist": product.artist.artist_name,
+            "genre": product.genre.genre_name,
+            "price": product.price,
+            "stock_quantity": product.stock_quantity,
+            "reserved_quantity": product.reserved_quantity,
+            "review_count": product.review_count,
+            "rating_avg": round(product.rating_avg, 2),
+            "created_at": product.created_at,
+            "updated_at": product.updated_at,
+        }
+
+
+EXPORTS = {export.name: export for export in (OrderExport(), ProductExport())}
+
+
+class _Line:
+    """File-like target for csv.writer that hands back what it was given."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+class ExportStats:
+    def __init__(self):
+        self.records = 0
+        self.rows = 0
+
+
+def stream(export, fmt, filters, chunk_size=None, stats=None):
+    """Yield the export as text chunks.
+
+    Objects come from ``QuerySet.iterator(chunk_size=...)`` (prefetches run
+    per chunk), so memory stays bounded by one chunk however many rows are
+    exported. ``stats``, if given, counts records and output rows.
+    """
+    stats = stats or ExportStats()
+    queryset = export.queryset(filters)
+    writer = csv.writer(_Line())
+    lines = []
+    if fmt == CSV:
+        lines.append(writer.writerow(export.columns))
+    for obj in queryset.iterator(chunk_size=chunk_size or get_chunk_size()):
+        record = export.record(obj)
+        stats.records += 1
+        if fmt == CSV:
+            for row in export.csv_rows(record):
+                lines.append(writer.writerow([_csv_value(value) for value in row]))
+                stats.rows += 1
+        else:
+            lines.append(
+                json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+            )
+            stats.rows += 1
+        if len(lines) >= FLUSH_ROWS:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
@@ -0,0 +1,119 @@
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.db.models import Count, Q
+
+from .models import Genre
+
+ARTIST_FACET_SIZE = 20
+ARTIST_FACET_MAX = 200
+# Upper bounds of the price histogram buckets, in rubles; the last bucket is
+# open-ended.
+PRICE_BOUNDS = (1000, 2000, 3000, 5000)
+
+_CENT = Decimal("0.01")
+
+
+def genre_facet(query):
+    """Product count per genre for the current filters, ignoring the genre
+    filter itself so every option shows what selecting it would return."""
+    rows = (
+        query.filter(exclude=("genre",))
+        .values("genre__genre_name")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    counts = {row["genre__genre_name"]: row["count"] for row in rows}
+    facet = []
+    for value, label in Genre.GenreChoices.choices:
+        count = counts.get(value, 0)
+        if count or value == query.genre:
+            facet.append(
+                {
+                    "value": value,
+                    "label": label,
+                    "count": count,
+                    "selected": value == query.genre,
+                }
+            )
+    return facet
+
+
+def artist_facet(query, limit=ARTIST_FACET_SIZE, offset=0):
+    """Top artists by matching product count, one grouped query per page.
+
+    Returns ``(entries, next_offset)``; ``next_offset`` is None on the last
+    page. The selected artist is always part of
+    the first page even when it falls outside the top ``limit``.
+    """
+    limit = max(1, min(limit, ARTIST_FACET_MAX))
+    grouped = (
+        query.filter(exclude=("artist",))
+        .values("artist_id", "artist__artist_name")
+        .annotate(count=Count("pk"))
+    )
+    rows = list(
+        grouped.order_by("-count", "artist__artist_name", "artist_id")[
+            offset : offset + limit + 1
+        ]
+    )
+    next_offset = offset + limit if len(rows) > limit else None
+    rows = rows[:limit]
+    if offset == 0 and query.artist is not None:
+        if not any(row["artist_id"] == query.artist for row in rows):
+            rows.extend(grouped.filter(artist_id=query.artist))
+    return [
+        {
+            "value": row["artist_id"],
+            "label": row["artist__artist_name"],
+            "count": row["count"],
+            "selected": row["artist_id"] == query.artist,
+        }
+        for row in rows
+    ], next_offset
+
+
+def price_facet(query):
+    """Price histogram computed as one aggregate with a filtered COUNT per
+    bucket."""
+    buckets = []
+    lower = Decimal(0)
+    for bound in PRICE_BOUNDS + (None,):
+        upper = Decimal(bound) if bound is not None else None
+        buckets.append((lower, upper))
+        lower = upper
+    aggregates = {}
+    for i, (lower, upper) in enumerate(buckets):
+        condition = Q(price__gte=lower)
+        if upper is not None:
+            condition &= Q(price__lt=upper)
+        aggregates[f"bucket_{i}"] = Count("pk", filter=condition)
+    counts = query.filter(exclude=("price",)).aggregate(**aggregates)
+    facet = []
+    for i, (lower, upper) in enumerate(buckets):
+        max_price = upper - _CENT if upper is not None else None
+        params = query.params(cursor=False)
+        params.pop("max_price", None)
+        params["min_price"] = str(lower)
+        if max_price is not None:
+            params["max_price"] = str(max_price)
+        facet.append(
+            {
+                "min_price": lower,
+                "max_price": max_price,
+                "count": counts[f"bucket_{i}"],
+                "selected": query.min_price == lower and query.max_price == max_price,
+                "query": urlencode(params),
+            }
+        )
+    return facet
+
+
+def catalog_facets(query):
+    artists, artist_next = artist_facet(query)
+    return {
+        "genre_facet": genre_facet(query),
+        "artist_facet": artists,
+        "artist_facet_next": artist_next,
+        "price_facet": price_facet(query),
+    }
@@ -0,0 +1,235 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Product
+
+IGNORE = "ignore"
+ZERO = "zero"
+PHASES = ("parse", "lookup", "diff", "update", "insert", "missing")
+
+
+class FeedRowError(ValueError):
+    pass
+
+
+class SyncStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.missing = 0
+        self.zeroed = 0
+        self.invalid = 0
+        self.errors = []
+        self.timings = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+
+class StockFeedSync:
+    """Applies a full price/stock feed, writing only the rows that changed.
+
+    Feed rows are keyed by ``product_id`` or by ``product_name`` plus
+    ``artist`` (rejected when it matches more than one product). Each batch
+    locks and reads just the pk, price and stock of its products, compares
+    them with the incoming values and writes the changed rows with one
+    ``bulk_update``; unchanged rows keep their ``updated_at`` and cached
+    pages. Rows for unknown products that carry ``genre`` are created
+    through ``importer`` (a ``CatalogImporter``), others are reported as
+    invalid.
+    """
+
+    def __init__(self, importer=None, max_errors=20):
+        self.importer = importer
+        self.max_errors = max_errors
+        self.stats = SyncStats()
+        self.seen = set()
+
+    def error(self, number, message):
+        self.stats.invalid += 1
+        if len(self.stats.errors) < self.max_errors:
+            self.stats.errors.append(f"row {number}: {message}")
+
+    def clean(self, row):
+        if not isinstance(row, dict):
+            raise FeedRowError("expected an object")
+        try:
+            price = Decimal(str(row.get("price", "")).strip())
+        except InvalidOperation:
+            raise FeedRowError(f"bad price {row.get('price')!r}")
+        if (
+            not price.is_finite()
+            or price < 0
+            or price != price.quantize(Decimal("0.01"))
+        ):
+            raise FeedRowError(f"bad price {row.get('price')!r}")
+        try:
+            stock = int(str(row.get("stock_quantity", "")).strip())
+        except ValueError:
+            raise FeedRowError(f"bad stock_quantity {row.get('stock_quantity')!r}")
+        if stock < 0:
+            raise FeedRowError("stock_quantity is negative")
+        product_id = str(row.get("product_id") or "").strip()
+        if product_id:
+            if not product_id.isdigit():
+                raise FeedRowError(f"bad product_id {product_id!r}")
+            key = int(product_id)
+        else:
+            name = str(row.get("product_name") or "").strip()
+            artist = str(row.get("artist") or "").strip()
+            if not name or not artist:
+                raise FeedRowError("product_id or product_name and artist needed")
+            key = (name, artist)
+        return key, price, stock
+
+    def lookup(self, keys):
+        """{key: [(pk, price, stock_quantity)]} for the known products among
+        ``keys``, locked until the batch commits. A name and artist key can
+        match several products, since neither is unique."""
+        queryset = Product.objects.select_for_update(of=("self",))
+        ids = [key for key in keys if isinstance(key, int)]
+        names = [key for key in keys if isinstance(key, tuple)]
+        found = defaultdict(list)
+        if ids:
+            rows = queryset.filter(pk__in=ids).values_list(
+                "pk", "price", "stock_quantity"
+            )
+            for pk, price, stock in rows:
+                found[pk].append((pk, price, stock))
+        if names:
+            rows = queryset.filter(
+                product_name__in={name for name, _ in names},
+                artist__artist_name__in={artist for _, artist in names},
+            ).values_list(
+                "pk", "product_name", "artist__artist_name", "price", "stock_quantity"
+            )
+            for pk, name, artist, price, stock in rows:
+                if (name, artist) in keys:
+                    found[(name, artist)].append((pk, price, stock))
+        return found
+
+    def sync_batch(self, numbered_rows):
+        stats = self.stats
+        with stats.phase("parse"):
+            rows = {}
+            for number, row in numbered_rows:
+                try:
+                    key, price, stock = self.clean(row)
+                except FeedRowError as exc:
+                    self.error(number, exc)
+                    continue
+                rows[key] = (number, row, price, stock)
+        with transaction.atomic():
+            with stats.phase("lookup"):
+                known = self.lookup(set(rows))
+            with stats.phase("diff"):
+                now = timezone.now()
+                changed = []
+                new = []
+                for key, (number, row, price, stock) in rows.items():
+                    if key not in known:
+                        new.append((number, row))
+                        continue
+                    matches = known[key]
+                    # Not applied, but not missing from the feed either.
+                    self.seen.update(pk for pk, _, _ in matches)
+                    if len(matches) > 1:
+                        self.error(
+                            number,
+                            f"{len(matches)} products match {key[0]!r} by "
+                            f"{key[1]!r}; use product_id",
+                        )
+                        continue
+                    pk, current_price, current_stock = matches[0]
+                    # Compared with the live columns, which checkout, the
+                    # admin and the API change as well as the feed.
+                    if (price, stock) == (current_price, current_stock):
+                        stats.unchanged += 1
+                        continue
+                    changed.append(
+                        Product(
+                            pk=pk,
+                            price=price,
+                            stock_quantity=stock,
+                            updated_at=now,
+                        )
+                    )
+            with stats.phase("update"):
+                if changed:
+                    Product.objects.bulk_update(
+                        changed,
+                        ["price", "stock_quantity", "updated_at"],
+                        batch_size=500,
+                    )
+                    # Price and stock are not part of the search index, so
+                    # only the cached pages need to go.
+                    bump_version(
+                        "product", *(f"product:{product.pk}" for product in changed)
+                    )
+                stats.changed += len(changed)
+            with stats.phase("insert"):
+                self.insert(new)
+
+    def insert(self, numbered_rows):
+        creatable = []
+        for number, row in numbered_rows:
+            if self.importer is None or not row.get("genre"):
+                self.error(number, "unknown product")
+            else:
+                creatable.append((number, row))
+        if creatable:
+            importer = self.importer.stats
+            before = importer.inserted, importer.invalid
+            saved = self.importer.import_batch(creatable)
+            self.seen.update(product.pk for product in saved)
+            self.stats.inserted += importer.inserted - before[0]
+            self.stats.invalid += importer.invalid - before[1]
+            self.stats.errors.extend(importer.errors)
+            del self.stats.errors[self.max_errors :]
+            importer.errors = []
+
+    def finish(self, missing=IGNORE, batch_size=1000):
+        """Count (and with ``ZERO`` set to no stock) the products the feed
+        did not mention, walking the product ids in one streaming pass."""
+        stats = self.stats
+        with stats.phase("missing"):
+            zeroed = []
+            now = timezone.now()
+            ids = Product.objects.order_by("pk").values_list("pk", "stock_quantity")
+            for pk, stock in ids.iterator(chunk_size=batch_size):
+                if pk in self.seen:
+                    continue
+                stats.missing += 1
+                if missing == ZERO and stock != 0:
+                    zeroed.append(pk)
+            for start in range(0, len(zeroed), batch_size):
+                chunk = zeroed[start : start + batch_size]
+                with transaction.atomic():
+                    products = list(
+                        Product.objects.select_for_update()
+                        .filter(pk__in=chunk)
+                        .only("stock_quantity")
+                    )
+                    for product in products:
+                        product.stock_quantity = 0
+                        product.updated_at = now
+                    Product.objects.bulk_update(
+                        products, ["stock_quantity", "updated_at"]
+                    )
+                    bump_version(
+                        "product", *(f"product:{product.pk}" for product in products)
+                    )
+                stats.zeroed += len(products)
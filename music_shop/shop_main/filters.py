@@ -0,0 +1,13 @@
+from rest_framework.filters import SearchFilter
+
+from .search import search_products, tokenize
+
+
+class ProductSearchFilter(SearchFilter):
+    """``?search=`` backed by the product full-text index, best match first."""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "")
+        if not tokenize(query):
+            return queryset
+        return search_products(queryset, query).order_by("-search_rank", "pk")
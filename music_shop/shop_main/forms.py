@@ -164,6 +164,11 @@ class OrderItemForm(forms.ModelForm):
             ),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Order.__str__ shows the buyer: one query per option otherwise.
+        self.fields["order"].queryset = Order.objects.select_related("user")
+
 
 class AdminReviewForm(forms.ModelForm):
     class Meta:
@@ -216,12 +221,22 @@ class ShippingAddressForm(forms.ModelForm):
 class CouponForm(forms.ModelForm):
     class Meta:
         model = Coupon
-        fields = ("code", "discount_percent", "active", "valid_from", "valid_to")
+        fields = (
+            "code",
+            "discount_percent",
+            "active",
+            "valid_from",
+            "valid_to",
+            "max_redemptions",
+        )
         widgets = {
             "code": forms.TextInput(attrs={"class": "form-control"}),
             "discount_percent": forms.NumberInput(
                 attrs={"class": "form-control", "min": "0", "max": "100"}
             ),
+            "max_redemptions": forms.NumberInput(
+                attrs={"class": "form-control", "min": "1"}
+            ),
             "active": forms.CheckboxInput(attrs={"class": "form-check-input"}),
             "valid_from": forms.DateTimeInput(
                 attrs={"class": "form-control", "type": "datetime-local"}
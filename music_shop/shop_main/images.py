@@ -0,0 +1,269 @@
+import hashlib
+import io
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .cache import bump_version
+from .models import Product
+from .storage import picture_storage
+
+DERIVED_DIR = "products/derived/"
+# format: (Pillow format, content type, encoder options)
+FORMATS = {
+    "avif": ("AVIF", "image/avif", {"quality": 60, "speed": 6}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True}),
+    "png": ("PNG", "image/png", {"compress_level": 6}),
+}
+
+
+def get_widths():
+    """Widths (px) of the derivatives; the catalog card shows covers about
+    280px wide and the product page about 420px, at 1x and 2x."""
+    return tuple(getattr(settings, "SHOP_IMAGE_WIDTHS", (280, 420, 560, 840)))
+
+
+def get_formats():
+    """Modern formats to encode besides the JPEG/PNG fallback, in order of
+    preference, dropping those this Pillow build cannot write."""
+    wanted = getattr(settings, "SHOP_IMAGE_FORMATS", ("avif", "webp"))
+    return tuple(fmt for fmt in wanted if features.check(fmt))
+
+
+def get_inline_formats():
+    """Modern formats encoded right after an upload, in the request that
+    saved the picture. The rest are left to the build_image_variants
+    command; by default only the JPEG/PNG fallback is encoded inline."""
+    wanted = getattr(settings, "SHOP_IMAGE_INLINE_FORMATS", ())
+    return tuple(fmt for fmt in get_formats() if fmt in wanted)
+
+
+class ImageError(ValueError):
+    pass
+
+
+def encode(data, widths, formats, fallback=True):
+    """Resize the image in ``data`` to each of ``widths`` (never upscaling)
+    and encode every size in ``formats`` plus, unless ``fallback`` is
+    False, a JPEG (PNG for transparent images) fallback.
+
+    Pure Pillow work with bytes in and out, so it can run in a worker
+    process. Returns ``{"width", "height", "fallback", "files"}`` where
+    ``files`` lists ``(format, width, bytes)``.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source = ImageOps.exif_transpose(source)
+            has_alpha = source.mode in ("RGBA", "LA", "PA") or (
+                source.mode == "P" and "transparency" in source.info
+            )
+            image = source.convert("RGBA" if has_alpha else "RGB")
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageError(str(exc))
+    # Many covers are saved as RGBA with every pixel opaque.
+    if has_alpha and image.getchannel("A").getextrema()[0] == 255:
+        image = image.convert("RGB")
+        has_alpha = False
+    fallback_format = "png" if has_alpha else "jpeg"
+    encoded_formats = (*formats, fallback_format) if fallback else tuple(formats)
+    sizes = sorted({min(width, image.width) for width in widths})
+    files = []
+    for width in sizes:
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt in encoded_formats:
+            pillow_format, _, options = FORMATS[fmt]
+            buffer = io.BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            files.append((fmt, width, buffer.getvalue()))
+    return {
+        "width": image.width,
+        "height": image.height,
+        "fallback": fallback_format,
+        "files": files,
+    }
+
+
+def source_digest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def derived_storage():
+    return default_storage
+
+
+def derivative_dir(source, digest):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f"{DERIVED_DIR}{stem}-{digest}"
+
+
+def derivative_name(source, digest, width, fmt):
+    return f"{derivative_dir(source, digest)}/{width}.{fmt}"
+
+
+def store(source, digest, encoded, storage=None):
+    """Save the files of ``encoded`` next to each other and return the
+    ``Product.picture_variants`` value describing them.
+
+    Names carry a digest of the original, so a file that already exists
+    holds the same image and is reused, and a replaced picture never
+    shares URLs (or browser caches) with the old one.
+    """
+    storage = storage or derived_storage()
+    variants = {}
+    for fmt, width, content in encoded["files"]:
+        name = derivative_name(source, digest, width, fmt)
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(content))
+        variants.setdefault(fmt, []).append([width, name])
+    return {
+        "source": source,
+        "width": encoded["width"],
+        "height": encoded["height"],
+        "fallback": encoded["fallback"],
+        "variants": variants,
+    }
+
+
+def read_source(name, storage=None):
+    storage = storage or picture_storage
+    with storage.open(name, "rb") as handle:
+        return handle.read()
+
+
+def save_variants(product_id, source, value):
+    """Record ``value`` for the product if its picture is still ``source``
+    and drop the cached pages that show it."""
+    updated = Product.objects.filter(pk=product_id, picture=source).update(
+        picture_variants=value
+    )
+    if updated:
+        bump_version("product", f"product:{product_id}")
+    return updated
+
+
+def build_variants(product_id, source):
+    """Generate and record the derivatives of one product's picture in this
+    process; used right after an upload.
+
+    A file another product already shows reuses that product's
+    derivatives. Otherwise only the fallback and ``get_inline_formats()``
+    are encoded, and build_image_variants adds the other formats later.
+    """
+    shared = (
+        Product.objects.filter(picture=source, picture_variants__source=source)
+        .exclude(pk=product_id)
+        .values_list("picture_variants", flat=True)
+        .first()
+    )
+    if shared:
+        return bool(save_variants(product_id, source, shared))
+    try:
+        data = read_source(source)
+        encoded = encode(data, get_widths(), get_inline_formats())
+    except (OSError, ImageError):
+        # The original is still served as it is.
+        return False
+    return bool(
+        save_variants(product_id, source, store(source, source_digest(data), encoded))
+    )
+
+
+def referenced_derivatives():
+    """Names of the derivative files some product's ``picture_variants``
+    lists."""
+    names = set()
+    values = Product.objects.values_list("picture_variants", flat=True)
+    for value in values.iterator(chunk_size=2000):
+        for entries in (value or {}).get("variants", {}).values():
+            names.update(name for _, name in entries)
+    return names
+
+
+def sweep_derivatives(min_age=timedelta(hours=1), storage=None):
+    """Delete the derivative files no product lists any more, and the
+    directories left empty. Returns the number of files deleted.
+
+    Derivatives go with their original once no product shows it (see
+    shop_main.media), but a rebuild at other widths or formats, or an
+    original that could no longer be read, leaves files behind. Files
+    younger than ``min_age`` are kept: a build may have stored them
+    without recording them yet.
+    """
+    storage = storage or derived_storage()
+    if not storage.exists(DERIVED_DIR):
+        return 0
+    referenced = referenced_derivatives()
+    cutoff = timezone.now() - min_age
+    deleted = 0
+    for directory in storage.listdir(DERIVED_DIR)[0]:
+        path = f"{DERIVED_DIR}{directory}"
+        kept = False
+        for filename in storage.listdir(path)[1]:
+            name = f"{path}/{filename}"
+            if name in referenced or storage.get_modified_time(name) > cutoff:
+                kept = True
+                continue
+            storage.delete(name)
+            deleted += 1
+        if not kept:
+            try:
+                storage.delete(path)
+            except OSError:
+                # A build stored a file in it meanwhile.
+                pass
+    return deleted
+
+
+def has_variants(product):
+    """Whether ``picture_variants`` describes the current picture."""
+    name = product.picture.name if product.picture else ""
+    return (product.picture_variants or {}).get("source", "") == name
+
+
+def needs_variants(product):
+    """Whether build_image_variants has work for the product: derivatives
+    of an older picture, or formats encoded inline left out."""
+    if not has_variants(product):
+        return True
+    if not product.picture:
+        return False
+    built = product.picture_variants.get("variants", {})
+    return any(fmt not in built for fmt in get_formats())
+
+
+def srcset(entries):
+    return ", ".join(
+        f"{derived_storage().url(name)} {width}w" for width, name in entries
+    )
+
+
+def picture_sources(product):
+    """Template data for a ``<picture>`` of the product: ``sources``
+    (``[{"type", "srcset"}]``, best format first) plus the fallback
+    ``srcset``, ``src``, ``width`` and ``height``; None while the product
+    has no derivatives for its current picture."""
+    if not product.picture or not has_variants(product):
+        return None
+    value = product.picture_variants
+    variants = value["variants"]
+    fallback = variants.get(value["fallback"])
+    if not fallback:
+        return None
+    return {
+        "sources": [
+            {"type": FORMATS[fmt][1], "srcset": srcset(entries)}
+            for fmt, entries in variants.items()
+            if fmt != value["fallback"]
+        ],
+        "srcset": srcset(fallback),
+        "src": derived_storage().url(fallback[0][1]),
+        "width": value["width"],
+        "height": value["height"],
+    }
@@ -0,0 +1,287 @@
+import csv
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.db import transaction
+
+from .bulk import bulk_saved
+from .models import Artist, Genre, Product
+from .storage import picture_storage
+
+PICTURE_DIR = Product._meta.get_field("picture").upload_to
+MAX_NAME_LENGTH = Product._meta.get_field("product_name").max_length
+MAX_ARTIST_LENGTH = Artist._meta.get_field("artist_name").max_length
+UPSERT_FIELDS = [
+    "description",
+    "price",
+    "stock_quantity",
+    "genre",
+    "updated_at",
+]
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as handle:
+        yield from csv.DictReader(handle)
+
+
+def read_ndjson(path):
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_json_array(path, block_size=1 << 16):
+    """Objects of a top-level JSON array, decoded one at a time from blocks
+    of the file instead of loading the whole document."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as handle:
+        buffer = handle.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError("expected a JSON array")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+            if buffer.startswith("]"):
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                block = handle.read(block_size)
+                eof = not block
+                buffer += block
+                continue
+            yield obj
+            buffer = buffer[end:]
+            if len(buffer) < block_size and not eof:
+                block = handle.read(block_size)
+                eof = not block
+                buffer += block
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson, "json": read_json_array}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return {"jsonl": "ndjson"}.get(extension, extension)
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.invalid = 0
+        self.artists_created = 0
+        self.genres_created = 0
+        self.images_attached = 0
+        self.images_missing = 0
+        self.errors = []
+
+
+class CatalogImporter:
+    """Upserts products from row dicts in batches.
+
+    Artists and genres are resolved through dictionaries loaded once and
+    extended as new names appear, so a batch costs a few queries however
+    many rows it has. Products are written with ``bulk_create`` and
+    ``update_conflicts`` on ``("product_name", "artist")``; each batch is
+    its own transaction and ends with a ``bulk_saved`` signal, which keeps
+    the search index, cache versions and row counters current.
+    """
+
+    def __init__(self, images_dir=None, max_errors=20, dry_run=False):
+        self.images_dir = images_dir
+        self.max_errors = max_errors
+        # Name pictures as they would be stored without writing the files.
+        self.dry_run = dry_run
+        self.stats = ImportStats()
+        self.genres = {}
+        for pk, name in Genre.objects.order_by("-pk").values_list("pk", "genre_name"):
+            self.genres[name] = pk
+        self.genre_values = {}
+        for value, label in Genre.GenreChoices.choices:
+            self.genre_values[label.lower()] = value
+            self.genre_values[value.lower()] = value
+        self.artists = dict(
+            Artist.objects.order_by("-pk").values_list("artist_name", "pk")
+        )
+        # Stored name of every image file attached so far.
+        self.pictures = {}
+
+    def error(self, number, message):
+        self.stats.invalid += 1
+        if len(self.stats.errors) < self.max_errors:
+            self.stats.errors.append(f"row {number}: {message}")
+
+    def clean(self, row):
+        if not isinstance(row, dict):
+            raise ImportRowError("expected an object")
+
+        def text(name):
+            value = row.get(name)
+            return "" if value is None else str(value).strip()
+
+        name = text("product_name")
+        artist = text("artist")
+        if not name or len(name) > MAX_NAME_LENGTH:
+            raise ImportRowError("product_name is empty or too long")
+        if not artist or len(artist) > MAX_ARTIST_LENGTH:
+            raise ImportRowError("artist is empty or too long")
+        genre = self.genre_values.get(text("genre").lower())
+        if genre is None:
+            raise ImportRowError(f"unknown genre {text('genre')!r}")
+        try:
+            price = Decimal(text("price"))
+        except InvalidOperation:
+            raise ImportRowError(f"bad price {text('price')!r}")
+        if (
+            not price.is_finite()
+            or price < 0
+            or price != price.quantize(Decimal("0.01"))
+        ):
+            raise ImportRowError(f"bad price {text('price')!r}")
+        try:
+            stock = int(text("stock_quantity") or 0)
+        except ValueError:
+            raise ImportRowError(f"bad stock_quantity {text('stock_quantity')!r}")
+        return {
+            "product_name": name,
+            "artist": artist,
+            "country": text("country"),
+            "genre": genre,
+            "price": price,
+            "stock_quantity": stock,
+            "description": text("description"),
+            "picture": text("picture"),
+        }
+
+    def resolve_names(self, rows):
+        """Create the genres and artists of ``rows`` not seen yet."""
+        genres = [
+            Genre(genre_name=value, description="")
+            for value in {row["genre"] for row in rows}
+            if value not in self.genres
+        ]
+        if genres:
+            Genre.objects.bulk_create(genres)
+            self.genres.update((genre.genre_name, genre.pk) for genre in genres)
+            self.stats.genres_created += len(genres)
+            bulk_saved.send(sender=Genre, created=genres, updated=[], previous={})
+        artists = {}
+        for row in rows:
+            if row["artist"] not in self.artists:
+                artists.setdefault(
+                    row["artist"],
+                    Artist(artist_name=row["artist"], country=row["country"]),
+                )
+        if artists:
+            created = Artist.objects.bulk_create(artists.values())
+            self.artists.update((artist.artist_name, artist.pk) for artist in created)
+            self.stats.artists_created += len(created)
+            bulk_saved.send(sender=Artist, created=created, updated=[], previous={})
+
+    def attach_picture(self, filename):
+        path = os.path.join(self.images_dir, os.path.basename(filename))
+        if not filename or not os.path.isfile(path):
+            self.stats.images_missing += 1
+            return None
+        if path not in self.pictures:
+            # Stored under a hash of the content, once however many rows
+            # (or earlier imports) use the same image.
+            name = os.path.join(PICTURE_DIR, os.path.basename(filename))
+            with open(path, "rb") as handle:
+                if self.dry_run:
+                    stored = picture_storage.hashed_name(name, File(handle))
+                else:
+                    stored = picture_storage.save(name, File(handle))
+                self.pictures[path] = stored
+        self.stats.images_attached += 1
+        return self.pictures[path]
+
+    def import_batch(self, numbered_rows):
+        """Upsert ``(row number, row)`` pairs; returns the saved products."""
+        rows = {}
+        for number, row in numbered_rows:
+            try:
+                cleaned = self.clean(row)
+            except ImportRowError as exc:
+                self.error(number, exc)
+                continue
+            # A later row for the same product wins, as it would one by one.
+            rows[(cleaned["product_name"], cleaned["artist"])] = cleaned
+        if not rows:
+            return []
+        with transaction.atomic():
+            self.resolve_names(rows.values())
+            # Rows with an image file replace the picture; the others keep
+            # whatever picture the product already has.
+            pictured = []
+            unpictured = []
+            for row in rows.values():
+                product = Product(
+                    product_name=row["product_name"],
+                    artist_id=self.artists[row["artist"]],
+                    genre_id=self.genres[row["genre"]],
+                    price=row["price"],
+                    stock_quantity=row["stock_quantity"],
+                    description=row["description"],
+                )
+                picture = (
+                    self.attach_picture(row["picture"]) if self.images_dir else None
+                )
+                if picture:
+                    product.picture = picture
+                    pictured.append(product)
+                else:
+                    unpictured.append(product)
+            products = pictured + unpictured
+            existing = {
+                (name, artist_id): (pk, picture)
+                for name, artist_id, pk, picture in Product.objects.filter(
+                    product_name__in={p.product_name for p in products},
+                    artist_id__in={p.artist_id for p in products},
+                ).values_list("product_name", "artist_id", "pk", "picture")
+            }
+            for group, fields in (
+                (pictured, UPSERT_FIELDS + ["picture"]),
+                (unpictured, UPSERT_FIELDS),
+            ):
+                if group:
+                    Product.objects.bulk_create(
+                        group,
+                        update_conflicts=True,
+                        unique_fields=["product_name", "artist"],
+                        update_fields=fields,
+                    )
+            created = []
+            updated = []
+            previous = {}
+            for product in products:
+                key = (product.product_name, product.artist_id)
+                if key not in existing:
+                    created.append(product)
+                    continue
+                updated.append(product)
+                pk, picture = existing[key]
+                if not product.picture:
+                    product.picture = picture
+                elif picture != product.picture.name:
+                    previous[pk] = {"picture": picture}
+            bulk_saved.send(
+                sender=Product, created=created, updated=updated, previous=previous
+            )
+        self.stats.inserted += len(created)
+        self.stats.updated += len(updated)
+        return products
@@ -0,0 +1,176 @@
+import json
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("shop_main.sql")
+
+DEFAULT_THRESHOLDS = {"*": {"queries": 50, "sql_ms": 250, "repeats": 10}}
+# Statements listed in the log line, by total time and by repetitions.
+TOP_STATEMENTS = 3
+MAX_SQL_LENGTH = 300
+
+_IN_LIST_RE = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_SAVEPOINT_RE = re.compile(r'"s\d+_x\d+"')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+
+
+def get_sample_rate():
+    """Share of requests logged whatever their cost."""
+    return getattr(settings, "SHOP_SQL_LOG_SAMPLE_RATE", 0.01)
+
+
+def get_thresholds(view_name):
+    """Limits above which a request is always logged: ``queries``,
+    ``sql_ms`` and ``repeats`` (runs of one SQL statement), from the
+    "*" entry of SHOP_SQL_LOG_THRESHOLDS overridden by the view's own."""
+    thresholds = getattr(settings, "SHOP_SQL_LOG_THRESHOLDS", DEFAULT_THRESHOLDS)
+    return {**thresholds.get("*", {}), **thresholds.get(view_name, {})}
+
+
+def fingerprint(sql):
+    """``sql`` with literals and the length of IN lists taken out, so the
+    same statement run for different rows gives the same fingerprint."""
+    sql = _IN_LIST_RE.sub("(...)", sql)
+    sql = _SAVEPOINT_RE.sub('"s_x"', sql)
+    sql = _STRING_RE.sub("?", sql)
+    return _NUMBER_RE.sub("?", sql)
+
+
+class QueryStats:
+    """``execute_wrapper`` that counts and times every statement.
+
+    Statements are grouped by their raw (placeholder) SQL while the request
+    runs, which costs a dict lookup per query; fingerprints are only
+    computed when the numbers are reported.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            entry = self.statements.get(sql)
+            if entry is None:
+                self.statements[sql] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def most_repeated(self):
+        """Runs of the most repeated statement, by raw SQL."""
+        return max((count for count, _ in self.statements.values()), default=0)
+
+    def fingerprints(self):
+        """[(fingerprint, count, seconds)], most repeated first."""
+        merged = {}
+        for sql, (count, elapsed) in self.statements.items():
+            entry = merged.setdefault(fingerprint(sql), [0, 0.0])
+            entry[0] += count
+            entry[1] += elapsed
+        return sorted(
+            ((sql, count, elapsed) for sql, (count, elapsed) in merged.items()),
+            key=lambda item: (-item[1], -item[2]),
+        )
+
+
+def _statement(sql, count, elapsed):
+    return {"sql": sql[:MAX_SQL_LENGTH], "count": count, "ms": round(elapsed * 1000, 2)}
+
+
+def server_timing(stats, total):
+    return (
+        f'sql;dur={stats.duration * 1000:.1f};desc="{stats.count} queries, '
+        f'most repeated x{stats.most_repeated()}", app;dur={total * 1000:.1f}'
+    )
+
+
+class QueryInstrumentationMiddleware:
+    """Counts and times the SQL of each request.
+
+    The totals go out as a ``Server-Timing`` header (``sql`` and ``app``
+    durations, visible in the browser's network panel); a JSON log line on
+    the ``shop_main.sql`` logger adds the slowest and the most repeated
+    statements, whose repetition is the signature of an N+1 query. A
+    request is logged when it passes one of its view's thresholds (as a
+    warning) or is picked by the sample rate (as info).
+
+    Queries a streaming response runs while it is being sent are not
+    included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        if getattr(settings, "SHOP_SQL_SERVER_TIMING", True):
+            timing = server_timing(stats, total)
+            if response.has_header("Server-Timing"):
+                timing = f"{response['Server-Timing']}, {timing}"
+            response["Server-Timing"] = timing
+        self.log(request, response, stats, total)
+        return response
+
+    def log(self, request, response, stats, total):
+        match = request.resolver_match
+        view = match.view_name if match else None
+        thresholds = get_thresholds(view)
+        values = {
+            "queries": stats.count,
+            "sql_ms": stats.duration * 1000,
+            "repeats": stats.most_repeated(),
+        }
+        exceeded = [
+            name
+            for name, limit in thresholds.items()
+            if limit is not None and values.get(name, 0) >= limit
+        ]
+        if not exceeded and random.random() >= get_sample_rate():
+            return
+        # Fingerprinting is left until the request is known to be logged.
+        fingerprints = stats.fingerprints()
+        repeat_limit = thresholds.get("repeats") or 2
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "queries": stats.count,
+            "sql_ms": round(stats.duration * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+            "exceeded": exceeded,
+            "slowest": [
+                _statement(*item)
+                for item in sorted(fingerprints, key=lambda item: -item[2])[
+                    :TOP_STATEMENTS
+                ]
+            ],
+            "repeated": [
+                _statement(*item)
+                for item in fingerprints[:TOP_STATEMENTS]
+                if item[1] >= repeat_limit
+            ],
+        }
+        level = logging.WARNING if exceeded else logging.INFO
+        logger.log(level, json.dumps(record, ensure_ascii=False))
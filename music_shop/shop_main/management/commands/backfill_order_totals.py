@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from shop_main.models import Order
+from shop_main.orders import recalculate_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the stored subtotal, discount, total and item count of existing "
+        "orders from their items, one batch of orders per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--start-after", type=int, default=0, help="resume after this order id"
+        )
+
+    def handle(self, *args, **options):
+        last = options["start_after"]
+        done = 0
+        while True:
+            ids = list(
+                Order.objects.filter(pk__gt=last)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: options["batch_size"]]
+            )
+            if not ids:
+                break
+            done += recalculate_totals(ids)
+            last = ids[-1]
+            self.stdout.write(f"{done} orders updated (last id {last})")
+        self.stdout.write(self.style.SUCCESS(f"Done: {done} orders."))
@@ -0,0 +1,130 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from shop_main import images
+from shop_main.models import Product
+
+# Slots a cover is shown in: (label, CSS width, device pixel ratio).
+SLOTS = (
+    ("card 1x", 260, 1),
+    ("card 2x", 260, 2),
+    ("page 1x", 420, 1),
+    ("page 2x", 420, 2),
+)
+
+
+def pick(files, fmt, width):
+    """Bytes the browser downloads for a slot ``width`` device pixels wide:
+    the smallest ``fmt`` derivative at least that wide, or the largest."""
+    sizes = sorted((w, len(data)) for f, w, data in files if f == fmt)
+    for w, size in sizes:
+        if w >= width:
+            return size
+    return sizes[-1][1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the bytes a cover costs per display slot as the original and "
+        "as each derivative format, and the encode throughput per core with "
+        "one process and with a pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*", help="image files (default: product pictures)"
+        )
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        sources = self.load(options["paths"], options["limit"])
+        if not sources:
+            raise CommandError("No images to measure.")
+        widths, formats = images.get_widths(), images.get_formats()
+        self.stdout.write(
+            f"{len(sources)} images, widths {', '.join(map(str, widths))}, "
+            f"{options['repeat']} rounds"
+        )
+        self.report_bytes(sources, widths, formats)
+        self.report_throughput(sources, widths, formats, options)
+
+    def load(self, paths, limit):
+        sources = []
+        if paths:
+            for path in paths[:limit]:
+                with open(path, "rb") as handle:
+                    sources.append(handle.read())
+            return sources
+        names = (
+            Product.objects.exclude(picture="")
+            .exclude(picture__isnull=True)
+            .order_by()
+            .values_list("picture", flat=True)
+            .distinct()[:limit]
+        )
+        for name in names:
+            try:
+                sources.append(images.read_source(name))
+            except OSError as exc:
+                self.stderr.write(f"{name}: {exc}")
+        return sources
+
+    def report_bytes(self, sources, widths, formats):
+        encoded = [images.encode(data, widths, formats) for data in sources]
+        columns = ["original", *formats, "fallback"]
+        self.stdout.write("")
+        self.stdout.write(
+            f"{'KB per image':<14}" + "".join(f"{name:>10}" for name in columns)
+        )
+        original = sum(map(len, sources)) / len(sources)
+        for label, css_width, ratio in SLOTS:
+            row = [original]
+            for fmt in (*formats, None):
+                total = sum(
+                    pick(item["files"], fmt or item["fallback"], css_width * ratio)
+                    for item in encoded
+                )
+                row.append(total / len(encoded))
+            self.stdout.write(
+                f"{label:<14}" + "".join(f"{size / 1024:>10.1f}" for size in row)
+            )
+
+    def report_throughput(self, sources, widths, formats, options):
+        self.stdout.write("")
+        self.stdout.write(f"{'encode':<22}{'images/s':>10}{'per core':>10}")
+        for fmt in formats:
+            rate = self.rate(sources, widths, (fmt,), False, options["repeat"])
+            self.stdout.write(f"{fmt + ', 1 process':<22}{rate:>10.1f}{rate:>10.1f}")
+        rate = self.rate(sources, widths, (), True, options["repeat"])
+        self.stdout.write(f"{'fallback, 1 process':<22}{rate:>10.1f}{rate:>10.1f}")
+        rate = self.rate(sources, widths, formats, True, options["repeat"])
+        self.stdout.write(f"{'all, 1 process':<22}{rate:>10.1f}{rate:>10.1f}")
+        workers = max(1, options["workers"])
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            # Start the workers before timing.
+            list(pool.map(images.source_digest, [b""] * workers))
+            started = time.perf_counter()
+            jobs = [
+                pool.submit(images.encode, data, widths, formats)
+                for _ in range(options["repeat"])
+                for data in sources
+            ]
+            for job in jobs:
+                job.result()
+            rate = len(jobs) / (time.perf_counter() - started)
+        self.stdout.write(
+            f"{f'all, {workers} processes':<22}{rate:>10.1f}{rate / workers:>10.1f}"
+        )
+
+    def rate(self, sources, widths, formats, fallback, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for data in sources:
+                images.encode(data, widths, formats, fallback)
+        return repeat * len(sources) / (time.perf_counter() - started)
@@ -0,0 +1,116 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from shop_main.models import Artist, Genre, Product
+from shop_main.search import get_backend, search_products
+
+WORDS = (
+    "moon dark side wall echo storm night river blue fire glass road "
+    "black white heart stone dream silver ghost city sun rain wind "
+    "электро ночь звезда город лето рок джаз весна море небо"
+).split()
+
+DEFAULT_QUERIES = ["moon", "dark side", "ghost city", "ночь", "zzz"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare catalog search through the full-text index with the "
+        "legacy icontains scan on a synthetic catalog. All generated rows "
+        "are rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--artists", type=int, default=5_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--query", action="append", dest="queries")
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with transaction.atomic():
+            self.populate(rng, options["products"], options["artists"])
+            backend = get_backend()
+            started = time.perf_counter()
+            backend.rebuild()
+            self.stdout.write(
+                f"{type(backend).__name__}: indexed {options['products']} "
+                f"products in {time.perf_counter() - started:.2f}s"
+            )
+            self.stdout.write(
+                f"{'query':<14}{'matches':>9}{'icontains ms':>15}{'index ms':>11}"
+                f"{'speedup':>9}"
+            )
+            for query in options["queries"] or DEFAULT_QUERIES:
+                self.compare(query, options["repeat"])
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def populate(self, rng, products, artists):
+        genres = []
+        for value in Genre.GenreChoices.values:
+            genre, _ = Genre.objects.get_or_create(
+                genre_name=value, defaults={"description": ""}
+            )
+            genres.append(genre)
+        artist_objs = Artist.objects.bulk_create(
+            [
+                Artist(artist_name=f"{rng.choice(WORDS).title()} Band {i}")
+                for i in range(artists)
+            ],
+            batch_size=1000,
+        )
+        batch = []
+        for i in range(products):
+            words = rng.sample(WORDS, 3)
+            batch.append(
+                Product(
+                    product_name=f"{' '.join(words).title()} {i}",
+                    description=" ".join(rng.choices(WORDS, k=12)),
+                    price=Decimal(rng.randint(500, 9000)),
+                    stock_quantity=rng.randint(0, 50),
+                    genre=rng.choice(genres),
+                    artist=rng.choice(artist_objs),
+                )
+            )
+            if len(batch) == 2000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+    def timed(self, build, repeat):
+        samples = []
+        result = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = build()
+            result = queryset.count()
+            list(queryset.order_by("created_at", "pk")[:24])
+            samples.append((time.perf_counter() - started) * 1000)
+        return result, statistics.median(samples)
+
+    def compare(self, query, repeat):
+        def legacy():
+            return Product.objects.filter(
+                Q(product_name__icontains=query)
+                | Q(artist__artist_name__icontains=query)
+            )
+
+        def indexed():
+            return search_products(Product.objects.all(), query, ranked=False)
+
+        _, legacy_ms = self.timed(legacy, repeat)
+        matches, index_ms = self.timed(indexed, repeat)
+        speedup = legacy_ms / index_ms if index_ms else float("inf")
+        self.stdout.write(
+            f"{query:<14}{matches:>9}{legacy_ms:>15.1f}{index_ms:>11.1f}"
+            f"{speedup:>8.1f}x"
+        )
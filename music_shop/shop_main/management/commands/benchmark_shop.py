@@ -0,0 +1,376 @@
+import datetime
+import fnmatch
+import json
+import logging
+import platform
+import random
+import statistics
+import time
+from io import StringIO
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Max, Min
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from shop_main import seeding
+from shop_main.api import router
+from shop_main.models import Genre, Order, Product
+
+ROCK = Genre.GenreChoices.ROCK_METAL
+JAZZ = Genre.GenreChoices.JAZZ_BLUES
+CATALOG_VARIANTS = {
+    "default": {},
+    "sort-price": {"sort": "price"},
+    "sort-newest": {"sort": "-created_at"},
+    "sort-name": {"sort": "product_name"},
+    "genre": {"genre": ROCK},
+    "genre-price-desc": {"genre": ROCK, "sort": "-price"},
+    "price-range": {"min_price": "1000", "max_price": "3000"},
+    "rating": {"min_rating": "4"},
+    "search": {"search": "moon"},
+    "search-genre": {"search": "night", "genre": JAZZ},
+}
+CHECKOUT_ADDRESS = {
+    "full_name": "Иван Иванов",
+    "phone": "+7 900 000-00-00",
+    "city": "Москва",
+    "address_line": "ул. Ленина, 1",
+    "postal_code": "101000",
+}
+# The benchmark's own cache, so neither --cold nor the pages it stores
+# touch the cache the shop is configured with.
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "shop-benchmark",
+    }
+}
+METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def summarize(samples, errors):
+    """Latency percentiles (ms) and sequential throughput of ``samples``
+    (seconds per request)."""
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "rps": round(len(samples) / sum(samples), 1),
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """[(scale, scenario, metric, baseline, current)] of every percentile
+    more than ``threshold`` (and ``min_delta_ms``) slower than the baseline
+    and every throughput more than ``threshold`` lower."""
+    regressions = []
+    for scale, run in results["scales"].items():
+        base_run = baseline.get("scales", {}).get(scale, {})
+        for name, current in run["scenarios"].items():
+            base = base_run.get("scenarios", {}).get(name)
+            if base is None:
+                continue
+            for metric in METRICS:
+                if (
+                    current[metric] > base[metric] * (1 + threshold)
+                    and current[metric] - base[metric] >= min_delta_ms
+                ):
+                    regressions.append(
+                        (scale, name, metric, base[metric], current[metric])
+                    )
+            if current["rps"] < base["rps"] * (1 - threshold):
+                regressions.append((scale, name, "rps", base["rps"], current["rps"]))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the storefront and the API through Django's test client "
+        "on throwaway databases seeded with seed_shop at each --scales "
+        "value: p50/p95/p99 latency and sequential throughput per scenario, "
+        "written as JSON and optionally compared with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales", default="0.1,1", help="comma-separated seed_shop scales"
+        )
+        parser.add_argument("--requests", type=int, default=50, help="per scenario")
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="patterns",
+            help="only scenarios matching this pattern (e.g. 'api:*')",
+        )
+        parser.add_argument(
+            "--cold", action="store_true", help="clear the cache before each request"
+        )
+        parser.add_argument("--output", help="write the results to this JSON file")
+        parser.add_argument("--compare", help="baseline JSON file to compare with")
+        parser.add_argument(
+            "--threshold", type=float, default=0.2, help="allowed slowdown (0.2: 20%%)"
+        )
+        parser.add_argument(
+            "--min-delta-ms",
+            type=float,
+            default=1.0,
+            help="ignore latency changes smaller than this",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            scales = sorted({float(value) for value in options["scales"].split(",")})
+        except ValueError:
+            raise CommandError("--scales takes numbers such as 0.1,1")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as handle:
+                baseline = json.load(handle)
+        results = {
+            "meta": {
+                "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "database": connection.vendor,
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                "requests": max(options["requests"], 2),
+                "warmup": options["warmup"],
+                "seed": options["seed"],
+                "cold": options["cold"],
+            },
+            "scales": {},
+        }
+        self.run(scales, results, options)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                json.dump(results, handle, indent=2, ensure_ascii=False)
+                handle.write("\n")
+            self.stdout.write(f"Results written to {options['output']}.")
+        if baseline is not None:
+            for key in ("database", "django", "cold"):
+                if baseline.get("meta", {}).get(key) != results["meta"][key]:
+                    self.stderr.write(
+                        f"The baseline differs in {key}: "
+                        f"{baseline.get('meta', {}).get(key)}, here "
+                        f"{results['meta'][key]}."
+                    )
+            self.report_comparison(
+                compare(
+                    results, baseline, options["threshold"], options["min_delta_ms"]
+                )
+            )
+
+    def run(self, scales, results, options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        sql_logger = logging.getLogger("shop_main.sql")
+        sql_level = sql_logger.level
+        # The instrumentation still runs; its log lines would drown the table.
+        sql_logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                seeded = dict.fromkeys(seeding.BASE_ROWS, 0)
+                for index, scale in enumerate(scales):
+                    key = f"{scale:g}"
+                    rows = self.seed(scale, seeded, options["seed"] + index)
+                    self.stdout.write(f"\nscale {key}: " + self.describe(rows))
+                    results["scales"][key] = {
+                        "rows": rows,
+                        "scenarios": self.measure(options),
+                    }
+        finally:
+            sql_logger.setLevel(sql_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, scale, seeded, seed):
+        """Top the database up to ``scale``; returns the row counts."""
+        target = seeding.plan_rows(scale)
+        args = ["--seed", str(seed)]
+        for table, count in target.items():
+            args += ["--rows", f"{table}={max(count - seeded[table], 0)}"]
+            seeded[table] = max(count, seeded[table])
+        call_command("seed_shop", *args, stdout=StringIO())
+        return dict(seeded)
+
+    def describe(self, rows):
+        return ", ".join(f"{count:,} {table}" for table, count in rows.items())
+
+    def measure(self, options):
+        context = Context(options["seed"])
+        scenarios = {
+            name: scenario
+            for name, scenario in context.scenarios().items()
+            if not options["patterns"]
+            or any(fnmatch.fnmatch(name, pattern) for pattern in options["patterns"])
+        }
+        self.stdout.write(
+            f"{'scenario':<28}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'req/s':>9}{'errors':>8}"
+        )
+        measured = {}
+        for name, scenario in scenarios.items():
+            samples, errors = [], 0
+            for i in range(options["warmup"] + max(options["requests"], 2)):
+                client, method, path, data = scenario()
+                if options["cold"]:
+                    cache.clear()
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                elapsed = time.perf_counter() - started
+                if i < options["warmup"]:
+                    continue
+                samples.append(elapsed)
+                errors += response.status_code >= 400
+            stats = measured[name] = summarize(samples, errors)
+            self.stdout.write(
+                f"{name:<28}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+                f"{stats['p99_ms']:>9.2f}{stats['rps']:>9.1f}{errors:>8}"
+            )
+        return measured
+
+    def report_comparison(self, regressions):
+        if not regressions:
+            self.stdout.write(
+                self.style.SUCCESS("No regressions against the baseline.")
+            )
+            return
+        for scale, name, metric, base, current in regressions:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"scale {scale} {name} {metric}: {base:g} -> {current:g}"
+                )
+            )
+        raise CommandError(f"{len(regressions)} regressions against the baseline.")
+
+
+class Context:
+    """The users, clients and row ids the scenarios draw from.
+
+    A scenario returns ``(client, method, path, data)`` for the request
+    to time; the requests it makes itself to set the stage (filling the
+    cart before a checkout) are not measured.
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.admin = self.client(
+            User.objects.create_superuser(f"bench-admin-{seed}-{time.time_ns()}")
+        )
+        self.shopper = self.client(
+            User.objects.create_user(f"bench-shopper-{seed}-{time.time_ns()}")
+        )
+        heavy = (
+            Order.objects.values("user")
+            .annotate(orders=Count("pk"))
+            .order_by("-orders")
+            .values_list("user", flat=True)
+            .first()
+        )
+        self.heavy = self.client(User.objects.get(pk=heavy))
+        self.in_stock = list(
+            Product.objects.filter(stock_quantity__gte=20).values_list("pk", flat=True)[
+                :500
+            ]
+        )
+        self.added = None
+        self.cart_line = None
+
+    def client(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def pick_pk(self, model):
+        bounds = model.objects.aggregate(low=Min("pk"), high=Max("pk"))
+        return self.rng.randint(bounds["low"], bounds["high"])
+
+    def scenarios(self):
+        scenarios = {
+            f"catalog[{name}]": (
+                lambda params=params: (self.shopper, "get", "/catalog/", params)
+            )
+            for name, params in CATALOG_VARIANTS.items()
+        }
+        scenarios.update(
+            {
+                "product": lambda: (
+                    self.shopper,
+                    "get",
+                    f"/product/{self.pick_pk(Product)}/",
+                    None,
+                ),
+                "cart-add": self.cart_add,
+                "cart-inc": self.cart_inc,
+                "cart-dec": self.cart_dec,
+                "checkout": self.checkout,
+                "account[heavy user]": lambda: (self.heavy, "get", "/account/", None),
+                "db": lambda: (self.admin, "get", "/db/", None),
+            }
+        )
+        for prefix, viewset, basename in router.registry:
+            model = viewset.queryset.model
+            scenarios[f"api:{basename}-list"] = lambda prefix=prefix: (
+                self.admin,
+                "get",
+                f"/api/{prefix}/",
+                None,
+            )
+            # Small scales leave some tables (coupons) without a row to show.
+            if not model.objects.exists():
+                continue
+            scenarios[f"api:{basename}-detail"] = lambda prefix=prefix, model=model: (
+                self.admin,
+                "get",
+                f"/api/{prefix}/{self.pick_pk(model)}/",
+                None,
+            )
+        return scenarios
+
+    def cart_add(self):
+        # One line at a time: the previous one is taken out first.
+        if self.added is not None:
+            self.shopper.post("/cart/", {"action": "remove", "item_id": self.added})
+        self.added = self.rng.choice(self.in_stock)
+        return self.shopper, "post", "/catalog/", {"product_id": self.added}
+
+    def ensure_cart_line(self):
+        if self.cart_line is None:
+            self.cart_line = self.rng.choice(self.in_stock)
+            for _ in range(2):
+                self.shopper.post("/catalog/", {"product_id": self.cart_line})
+        return self.cart_line
+
+    def cart_inc(self):
+        # Taken down first, so the quantity stays within the stock.
+        line = self.ensure_cart_line()
+        self.shopper.post("/cart/", {"action": "dec", "item_id": line})
+        return self.shopper, "post", "/cart/", {"action": "inc", "item_id": line}
+
+    def cart_dec(self):
+        line = self.ensure_cart_line()
+        self.shopper.post("/cart/", {"action": "inc", "item_id": line})
+        return self.shopper, "post", "/cart/", {"action": "dec", "item_id": line}
+
+    def checkout(self):
+        # Checkout empties the cart.
+        self.added = self.cart_line = None
+        for product in self.rng.sample(self.in_stock, 2):
+            self.shopper.post("/catalog/", {"product_id": product})
+        return (
+            self.shopper,
+            "post",
+            "/cart/",
+            {"action": "checkout", **CHECKOUT_ADDRESS},
+        )
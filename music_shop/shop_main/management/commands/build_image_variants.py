@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from shop_main import images
+from shop_main.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized WebP/AVIF/JPEG copies of product pictures that "
+        "do not have them yet (or all with --force), encoding in a pool of "
+        "worker processes. Copies a rebuild replaces are left on disk for "
+        "sweep_image_variants."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--start-after", type=int, default=0, help="resume after this product id"
+        )
+        parser.add_argument("--force", action="store_true")
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        widths, formats = images.get_widths(), images.get_formats()
+        self.stdout.write(
+            f"widths {', '.join(map(str, widths))}; formats "
+            f"{', '.join(formats) or '-'} + jpeg/png fallback; {workers} workers"
+        )
+        pool = ProcessPoolExecutor(workers, initializer=django.setup)
+        last = options["start_after"]
+        done = failed = 0
+        with pool:
+            while True:
+                batch = list(
+                    Product.objects.filter(pk__gt=last)
+                    .exclude(picture="")
+                    .exclude(picture__isnull=True)
+                    .order_by("pk")
+                    .only("picture", "picture_variants")[: options["batch_size"]]
+                )
+                if not batch:
+                    break
+                last = batch[-1].pk
+                todo = [
+                    p for p in batch if options["force"] or images.needs_variants(p)
+                ]
+                built, errors = self.build(pool, todo, widths, formats)
+                done += built
+                failed += len(errors)
+                for message in errors:
+                    self.stderr.write(message)
+                self.stdout.write(f"{done} products updated (last id {last})")
+        self.stdout.write(
+            self.style.SUCCESS(f"Done: {done} products updated, {failed} failed.")
+        )
+
+    def build(self, pool, products, widths, formats):
+        # Products sharing a file are encoded once.
+        by_source = {}
+        for product in products:
+            by_source.setdefault(product.picture.name, []).append(product.pk)
+        jobs = {}
+        errors = []
+        for source in by_source:
+            try:
+                data = images.read_source(source)
+            except OSError as exc:
+                errors.append(f"{source}: {exc}")
+                continue
+            future = pool.submit(images.encode, data, widths, formats)
+            jobs[source] = (images.source_digest(data), future)
+        built = 0
+        for source, (digest, future) in jobs.items():
+            try:
+                encoded = future.result()
+            except images.ImageError as exc:
+                errors.append(f"{source}: {exc}")
+                continue
+            value = images.store(source, digest, encoded)
+            for pk in by_source[source]:
+                built += images.save_variants(pk, source, value)
+        return built, errors
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from shop_main.cache import NAMESPACES, reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss statistics of the catalog and product page cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true")
+
+    def handle(self, *args, **options):
+        for namespace, row in stats(NAMESPACES).items():
+            ratio = row["hit_ratio"]
+            ratio = f"{ratio:.1%}" if ratio is not None else "—"
+            self.stdout.write(
+                f"{namespace:<18} hits={row['hits']:<8} "
+                f"misses={row['misses']:<8} hit ratio={ratio}"
+            )
+        if options["reset"]:
+            reset_stats(NAMESPACES)
+            self.stdout.write("Statistics reset.")
@@ -0,0 +1,62 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop_main.exports import (
+    CSV,
+    EXPORTS,
+    ExportError,
+    ExportStats,
+    parse_filters,
+    stream,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream orders (with items, addresses and coupons) or the product "
+        "catalog to CSV or NDJSON and report the throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("export", choices=sorted(EXPORTS))
+        parser.add_argument("--format", choices=["csv", "ndjson"], default=CSV)
+        parser.add_argument(
+            "--output", "-o", help="file to write to (default: standard output)"
+        )
+        parser.add_argument("--date-from", help="ГГГГ-ММ-ДД, inclusive")
+        parser.add_argument("--date-to", help="ГГГГ-ММ-ДД, inclusive")
+        parser.add_argument("--status")
+        parser.add_argument("--genre")
+        parser.add_argument("--chunk-size", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters(options)
+        except ExportError as exc:
+            raise CommandError(exc)
+        export = EXPORTS[options["export"]]
+        stats = ExportStats()
+        output = (
+            open(options["output"], "w", encoding="utf-8", newline="")
+            if options["output"]
+            else sys.stdout
+        )
+        # The report goes to stderr when the data itself is on stdout.
+        report = self.stdout if options["output"] else self.stderr
+        started = time.perf_counter()
+        try:
+            for chunk in stream(
+                export, options["format"], filters, options["chunk_size"], stats
+            ):
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
+        elapsed = time.perf_counter() - started
+        rate = stats.records / elapsed if elapsed else 0
+        report.write(
+            f"{export.name}: {stats.records} records, {stats.rows} rows "
+            f"in {elapsed:.2f}s ({rate:,.0f} records/s)"
+        )
@@ -0,0 +1,86 @@
+import itertools
+from contextlib import nullcontext
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop_main.imports import READERS, CatalogImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV, NDJSON or JSON file and upsert them on "
+        "(product_name, artist) in batches, creating missing artists and "
+        "genres. Columns: product_name, artist, genre, price, stock_quantity, "
+        "description, and optionally country and picture."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=sorted(READERS))
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--offset", type=int, default=0, help="skip this many rows (resume)"
+        )
+        parser.add_argument(
+            "--images", help="directory with the files named in the picture column"
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="run the whole import in one transaction and roll it back",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or detect_format(options["path"])
+        if fmt not in READERS:
+            raise CommandError(f"Unknown format {fmt!r}; pass --format.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        try:
+            # Without --dry-run each batch commits on its own, so an
+            # interrupted import resumes with --offset from the last report.
+            with transaction.atomic() if options["dry_run"] else nullcontext():
+                importer = self.run(READERS[fmt](options["path"]), options)
+                if options["dry_run"]:
+                    transaction.set_rollback(True)
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        stats = importer.stats
+        for message in stats.errors:
+            self.stderr.write(message)
+        if options["images"]:
+            self.stdout.write(
+                f"images: {stats.images_attached} attached, "
+                f"{stats.images_missing} missing; run build_image_variants to "
+                "resize them"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Dry run' if options['dry_run'] else 'Done'}: {stats.read} rows, "
+                f"{stats.inserted} inserted, {stats.updated} updated, "
+                f"{stats.invalid} invalid; {stats.artists_created} artists and "
+                f"{stats.genres_created} genres created"
+            )
+        )
+
+    def run(self, rows, options):
+        importer = CatalogImporter(options["images"], dry_run=options["dry_run"])
+        stats = importer.stats
+        position = options["offset"]
+        numbered = itertools.islice(enumerate(rows, start=1), position, None)
+        started = time.perf_counter()
+        while True:
+            batch = list(itertools.islice(numbered, options["batch_size"]))
+            if not batch:
+                break
+            importer.import_batch(batch)
+            position = batch[-1][0]
+            stats.read += len(batch)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{stats.read} rows in {elapsed:.1f}s "
+                f"({stats.read / elapsed:,.0f} rows/s), resume with --offset {position}"
+            )
+        return importer
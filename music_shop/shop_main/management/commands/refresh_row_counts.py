@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop_main.counts import refresh_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every counted table exactly and store the result in the "
+        "RowCount table used by SHOP_ROW_COUNT_MODE = 'counter'."
+    )
+
+    def handle(self, *args, **options):
+        for model, rows in refresh_counters().items():
+            self.stdout.write(f"{model._meta.label_lower:<28} {rows}")
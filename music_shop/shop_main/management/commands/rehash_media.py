@@ -0,0 +1,129 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop_main import images, media
+from shop_main.cache import bump_version
+from shop_main.imports import PICTURE_DIR
+from shop_main.models import Product
+from shop_main.storage import is_content_addressed, picture_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move product pictures stored under their upload names to content "
+        "addressed names, so identical files collapse into one, and rebuild "
+        "the media reference counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--search",
+            action="append",
+            default=[],
+            help="directory to look in for pictures missing from MEDIA_ROOT",
+        )
+        parser.add_argument(
+            "--delete-originals",
+            action="store_true",
+            help="delete the old files and their derivatives once moved",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="delete content addressed pictures no product references "
+            "(while nothing is being uploaded)",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        legacy = [
+            name
+            for name in Product.objects.exclude(picture="")
+            .exclude(picture__isnull=True)
+            .order_by("picture")
+            .values_list("picture", flat=True)
+            .distinct()
+            if not is_content_addressed(name)
+        ]
+        targets = set()
+        moved = updated = duplicate_bytes = 0
+        for old in legacy:
+            try:
+                new, size = self.store(old, options["search"], options["dry_run"])
+            except OSError as exc:
+                self.stderr.write(f"{old}: {exc}")
+                continue
+            if new in targets:
+                duplicate_bytes += size
+            targets.add(new)
+            moved += 1
+            if not options["dry_run"]:
+                updated += self.relink(old, new, options["delete_originals"])
+        self.stdout.write(
+            f"{moved} of {len(legacy)} files moved into {len(targets)} "
+            f"({duplicate_bytes / 1024:.1f} KB of duplicates), "
+            f"{updated} products updated"
+        )
+        if options["dry_run"]:
+            return
+        self.stdout.write(f"{media.recount()} files reference-counted")
+        if options["prune"]:
+            self.stdout.write(f"{self.prune()} unreferenced files deleted")
+        if updated:
+            self.stdout.write("Run build_image_variants to resize the moved pictures.")
+
+    def open(self, name, search):
+        if picture_storage.exists(name):
+            return picture_storage.open(name, "rb")
+        for directory in search:
+            path = os.path.join(directory, os.path.basename(name))
+            if os.path.isfile(path):
+                return open(path, "rb")
+        raise FileNotFoundError("file not found")
+
+    def store(self, name, search, dry_run):
+        target = os.path.join(PICTURE_DIR, os.path.basename(name))
+        with self.open(name, search) as handle:
+            content = File(handle, target)
+            if dry_run:
+                return picture_storage.hashed_name(target, content), content.size
+            return picture_storage.save(target, content), content.size
+
+    def relink(self, old, new, delete_original):
+        with transaction.atomic():
+            products = Product.objects.filter(picture=old)
+            derivatives = {
+                name
+                for variants in products.values_list("picture_variants", flat=True)
+                for entries in (variants or {}).get("variants", {}).values()
+                for _, name in entries
+            }
+            ids = list(products.values_list("pk", flat=True))
+            Product.objects.filter(pk__in=ids).update(picture=new, picture_variants={})
+            bump_version("product", *(f"product:{pk}" for pk in ids))
+        if delete_original:
+            picture_storage.delete(old)
+            for name in derivatives:
+                images.derived_storage().delete(name)
+        return len(ids)
+
+    def prune(self):
+        referenced = set(
+            Product.objects.exclude(picture="")
+            .exclude(picture__isnull=True)
+            .values_list("picture", flat=True)
+        )
+        deleted = 0
+        if not picture_storage.exists(PICTURE_DIR):
+            return deleted
+        for shard in picture_storage.listdir(PICTURE_DIR)[0]:
+            directory = os.path.join(PICTURE_DIR, shard)
+            for filename in picture_storage.listdir(directory)[1]:
+                name = os.path.join(directory, filename)
+                if is_content_addressed(name) and name not in referenced:
+                    media.delete_file(name)
+                    deleted += 1
+        return deleted
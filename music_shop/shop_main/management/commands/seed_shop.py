@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from shop_main import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic genres, artists, products, users, "
+        "addresses, coupons, orders, order items and reviews: Zipf-skewed "
+        "popularity, seasonal order dates, deterministic for a given --seed "
+        "and --batch-size. Rows are added after the existing ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="multiplier of the base counts (scale 1: 3 000 products, "
+            "10 000 orders)",
+        )
+        parser.add_argument(
+            "--rows",
+            action="append",
+            default=[],
+            metavar="TABLE=N",
+            help=f"exact row count of one of {', '.join(seeding.BASE_ROWS)}",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--days", type=int, default=730, help="order history")
+        parser.add_argument("--zipf", type=float, default=1.1, help="skew exponent")
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        rows = seeding.plan_rows(options["scale"], self.parse_rows(options["rows"]))
+        for table, needs in (
+            ("products", "artists"),
+            ("addresses", "users"),
+            ("orders", "users"),
+            ("orders", "products"),
+            ("reviews", "products"),
+        ):
+            if rows[table] and not rows[needs]:
+                raise CommandError(f"{table} need at least one of {needs}")
+        workers = max(1, options["workers"])
+        if workers > 1 and connection.vendor == "sqlite":
+            self.stderr.write("SQLite takes one writer at a time: using 1 worker.")
+            workers = 1
+
+        started = time.perf_counter()
+        self.report("genres", seeding.ensure_genres(), 0.0)
+        plan = seeding.make_plan(
+            rows, seed=options["seed"], days=options["days"], zipf=options["zipf"]
+        )
+        pool = None
+        if workers > 1:
+            connections.close_all()
+            pool = ProcessPoolExecutor(workers, initializer=django.setup)
+        try:
+            for stage in seeding.STAGES:
+                self.run_stage(pool, plan, stage, options["batch_size"])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        stage_started = time.perf_counter()
+        seeding.finish(plan)
+        self.stdout.write(
+            f"search index, statistics and counters in "
+            f"{time.perf_counter() - stage_started:.1f}s"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s.")
+        )
+
+    def parse_rows(self, values):
+        overrides = {}
+        for value in values:
+            table, _, count = value.partition("=")
+            if table not in seeding.BASE_ROWS or not count.isdigit():
+                raise CommandError(f"--rows {value}: expected TABLE=N")
+            overrides[table] = int(count)
+        return overrides
+
+    def run_stage(self, pool, plan, stage, batch_size):
+        jobs = seeding.stage_chunks(plan, stage, batch_size)
+        started = time.perf_counter()
+        if pool is None:
+            results = [seeding.generate(table, plan, *job) for table, *job in jobs]
+        else:
+            futures = [
+                pool.submit(seeding.generate, table, plan, *job) for table, *job in jobs
+            ]
+            results = [future.result() for future in futures]
+        totals = {}
+        for result in results:
+            for table, count in result.items():
+                totals[table] = totals.get(table, 0) + count
+        elapsed = time.perf_counter() - started
+        for table, count in totals.items() or [(stage, 0)]:
+            self.report(table, count, elapsed)
+
+    def report(self, table, count, elapsed):
+        rate = f"{count / elapsed:>10,.0f} rows/s" if elapsed and count else ""
+        self.stdout.write(f"{table:<16}{count:>10,}{elapsed:>8.1f}s {rate}")
@@ -0,0 +1,142 @@
+import multiprocessing
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Sum
+
+from shop_main.checkout import CheckoutError, place_order
+from shop_main.models import Artist, Genre, Order, OrderItem, Product
+
+
+def run_worker(user_id, product_ids, orders, max_lines, seed, results):
+    connections.close_all()
+    rng = random.Random(seed)
+    user = User.objects.get(pk=user_id)
+    placed = failed = retried = 0
+    for _ in range(orders):
+        picked = rng.sample(product_ids, rng.randint(1, max_lines))
+        lines = {pid: rng.randint(1, 3) for pid in picked}
+        for _ in range(5):
+            try:
+                place_order(user, lines)
+            except CheckoutError:
+                failed += 1
+            except OperationalError:
+                retried += 1
+                continue
+            else:
+                placed += 1
+            break
+        else:
+            failed += 1
+    connections.close_all()
+    results.put((placed, failed, retried))
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent checkouts from several processes against a small "
+        "set of products and verify that stock never goes negative and "
+        "that every unit sold is accounted for by an order item."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=8)
+        parser.add_argument("--orders", type=int, default=50, help="per process")
+        parser.add_argument("--products", type=int, default=5)
+        parser.add_argument("--stock", type=int, default=100)
+        parser.add_argument("--lines", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        if connections["default"].settings_dict["NAME"] in ("", ":memory:"):
+            raise CommandError("The stress test needs a file or server database.")
+        tag = f"stress-{uuid.uuid4().hex[:8]}"
+        genre = Genre.objects.create(genre_name="rock and metal", description=tag)
+        artist = Artist.objects.create(artist_name=tag)
+        products = Product.objects.bulk_create(
+            [
+                Product(
+                    product_name=f"{tag}-{i}",
+                    description=tag,
+                    price=Decimal("100.00"),
+                    stock_quantity=options["stock"],
+                    genre=genre,
+                    artist=artist,
+                )
+                for i in range(options["products"])
+            ]
+        )
+        product_ids = [p.pk for p in products]
+        users = [
+            User.objects.create_user(f"{tag}-{i}") for i in range(options["processes"])
+        ]
+        connections.close_all()
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    user.pk,
+                    product_ids,
+                    options["orders"],
+                    min(options["lines"], len(product_ids)),
+                    options["seed"] + i,
+                    results,
+                ),
+            )
+            for i, user in enumerate(users)
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        totals = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        placed = sum(t[0] for t in totals)
+        failed = sum(t[1] for t in totals)
+        retried = sum(t[2] for t in totals)
+        stock = dict(
+            Product.objects.filter(pk__in=product_ids).values_list(
+                "pk", "stock_quantity"
+            )
+        )
+        sold = dict(
+            OrderItem.objects.filter(product_id__in=product_ids)
+            .values("product_id")
+            .annotate(total=Sum("quantity"))
+            .values_list("product_id", "total")
+        )
+        self.stdout.write(
+            f"{placed} orders placed, {failed} rejected, {retried} retries "
+            f"in {elapsed:.2f}s ({placed / elapsed:.1f} orders/s)"
+        )
+        ok = True
+        for pid in product_ids:
+            remaining, units = stock[pid], sold.get(pid, 0)
+            if remaining < 0 or remaining + units != options["stock"]:
+                ok = False
+                self.stderr.write(
+                    f"product {pid}: {units} sold, {remaining} left, "
+                    f"started with {options['stock']}"
+                )
+
+        if not options["keep"]:
+            Order.objects.filter(user__in=users).delete()
+            Product.objects.filter(pk__in=product_ids).delete()
+            artist.delete()
+            genre.delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+        if not ok:
+            raise CommandError("Oversell or lost stock detected.")
+        self.stdout.write(self.style.SUCCESS("No oversell: stock is consistent."))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from shop_main.images import sweep_derivatives
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete resized picture copies no product uses any more, such as "
+        "the old widths and formats after build_image_variants --force. "
+        "Run it from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=60,
+            metavar="MINUTES",
+            help="keep files younger than this, which a running build may "
+            "not have recorded yet",
+        )
+
+    def handle(self, *args, **options):
+        deleted = sweep_derivatives(min_age=timedelta(minutes=options["min_age"]))
+        self.stdout.write(f"{deleted} unused picture derivatives deleted.")
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop_main.reservations import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Release stock held by cart reservations whose time limit has run "
+        "out. Run it from cron, or keep it running with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--loop",
+            type=int,
+            metavar="SECONDS",
+            help="sweep again every SECONDS instead of exiting",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            removed = sweep(batch_size=options["batch_size"])
+            self.stdout.write(f"{removed} expired reservations released.")
+            if not options["loop"]:
+                return
+            time.sleep(options["loop"])
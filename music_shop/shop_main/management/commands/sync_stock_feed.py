@@ -0,0 +1,84 @@
+import itertools
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop_main.feeds import IGNORE, PHASES, ZERO, StockFeedSync
+from shop_main.imports import READERS, CatalogImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply a supplier price and stock feed (CSV, NDJSON or JSON with "
+        "product_id or product_name and artist, price, stock_quantity). Only "
+        "rows whose price or stock changed are written; rows for new products "
+        "that carry a genre are created."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=sorted(READERS))
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--missing",
+            choices=[IGNORE, ZERO],
+            default=IGNORE,
+            help="what to do with products the feed does not list",
+        )
+        parser.add_argument(
+            "--no-create",
+            action="store_true",
+            help="report unknown products instead of creating them",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="run the whole sync in one transaction and roll it back",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or detect_format(options["path"])
+        if fmt not in READERS:
+            raise CommandError(f"Unknown format {fmt!r}; pass --format.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        started = time.perf_counter()
+        try:
+            with transaction.atomic() if options["dry_run"] else nullcontext():
+                sync = self.run(READERS[fmt](options["path"]), options)
+                if options["dry_run"]:
+                    transaction.set_rollback(True)
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+        stats = sync.stats
+        for message in stats.errors:
+            self.stderr.write(message)
+        for phase in PHASES:
+            self.stdout.write(f"{phase:<10}{stats.timings[phase]:>9.2f}s")
+        self.stdout.write(f"{'total':<10}{elapsed:>9.2f}s")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Dry run' if options['dry_run'] else 'Done'}: {stats.read} rows, "
+                f"{stats.inserted} inserted, {stats.changed} changed, "
+                f"{stats.unchanged} unchanged, {stats.missing} missing"
+                f"{f' ({stats.zeroed} set to zero stock)' if stats.zeroed else ''}, "
+                f"{stats.invalid} invalid"
+            )
+        )
+
+    def run(self, rows, options):
+        importer = None if options["no_create"] else CatalogImporter()
+        sync = StockFeedSync(importer)
+        numbered = enumerate(rows, start=1)
+        while True:
+            with sync.stats.phase("parse"):
+                batch = list(itertools.islice(numbered, options["batch_size"]))
+            if not batch:
+                break
+            sync.sync_batch(batch)
+            sync.stats.read += len(batch)
+        sync.finish(options["missing"])
+        return sync
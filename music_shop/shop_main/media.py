@@ -0,0 +1,101 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+
+from . import images
+from .models import MediaFile, Product
+from .storage import is_content_addressed, picture_storage
+
+
+def adjust(deltas):
+    """Move the reference counts of content-addressed files by ``deltas``
+    ({name: change}); files that drop to no references are deleted once
+    the transaction commits."""
+    deltas = {
+        name: delta
+        for name, delta in deltas.items()
+        if delta and is_content_addressed(name)
+    }
+    if not deltas:
+        return
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name) for name in deltas], ignore_conflicts=True
+    )
+    by_delta = defaultdict(list)
+    for name, delta in deltas.items():
+        by_delta[delta].append(name)
+    for delta, names in by_delta.items():
+        MediaFile.objects.filter(name__in=names).update(
+            references=Greatest(F("references") + delta, Value(0))
+        )
+    released = [name for name, delta in deltas.items() if delta < 0]
+    if released:
+        transaction.on_commit(lambda: collect(released))
+
+
+def changes(pairs):
+    """Reference count deltas for ``(old name, new name)`` pairs; an old
+    name of None stands for a new row."""
+    deltas = Counter()
+    for old, new in pairs:
+        if old == new:
+            continue
+        if old:
+            deltas[old] -= 1
+        if new:
+            deltas[new] += 1
+    return deltas
+
+
+def collect(names):
+    """Delete the files among ``names`` that nothing references any more,
+    together with their derivatives."""
+    for name in names:
+        with transaction.atomic():
+            entry = (
+                MediaFile.objects.select_for_update()
+                .filter(name=name, references__lte=0)
+                .first()
+            )
+            # The counter is checked against the products as well, so a
+            # count that drifted can never take a file still in use.
+            if entry is None or Product.objects.filter(picture=name).exists():
+                continue
+            entry.delete()
+            delete_file(name)
+
+
+def delete_file(name):
+    try:
+        data = images.read_source(name)
+    except OSError:
+        return
+    directory = images.derivative_dir(name, images.source_digest(data))
+    storage = images.derived_storage()
+    if storage.exists(directory):
+        for filename in storage.listdir(directory)[1]:
+            storage.delete(f"{directory}/{filename}")
+    picture_storage.delete(name)
+
+
+def recount():
+    """Rebuild every reference count from the products; returns the
+    number of files counted."""
+    counted = (
+        Product.objects.exclude(picture="")
+        .exclude(picture__isnull=True)
+        .order_by()
+        .values("picture")
+        .annotate(references=Count("pk"))
+    )
+    entries = [
+        MediaFile(name=row["picture"], references=row["references"])
+        for row in counted
+        if is_content_addressed(row["picture"])
+    ]
+    with transaction.atomic():
+        MediaFile.objects.all().delete()
+        MediaFile.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
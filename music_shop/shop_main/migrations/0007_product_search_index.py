@@ -0,0 +1,89 @@
+from django.db import migrations
+
+# The search index of shop_main.search as it was at this migration, frozen
+# here so later changes to that module cannot break a fresh migrate.
+SQLITE_TABLE = "shop_main_product_fts"
+POSTGRES_TABLE = "shop_main_product_search"
+GENRE_LABELS = (
+    ("rock and metal", "Рок & Металл"),
+    ("jazz and blues", "Джаз & Блюз"),
+    ("indie and alternative", "Инди & Альтернатива"),
+    ("pop and disco", "Поп & Диско"),
+    ("classical", "Классика"),
+    ("russian and soviet", "Русское & Советское"),
+)
+
+
+def document_select():
+    """Product id, name, artist, genre (value and label) and description of
+    every product, with its parameters."""
+    whens = " ".join("WHEN %s THEN %s" for _ in GENRE_LABELS)
+    params = []
+    for value, label in GENRE_LABELS:
+        params.extend([value, f"{value} {label}"])
+    sql = (
+        "SELECT p.id, p.product_name, a.artist_name, "
+        f"CASE g.genre_name {whens} ELSE g.genre_name END, p.description "
+        "FROM shop_main_product p "
+        "JOIN shop_main_artist a ON a.id = p.artist_id "
+        "JOIN shop_main_genre g ON g.id = p.genre_id"
+    )
+    return sql, params
+
+
+def install_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    sql, params = document_select()
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+            "product_name, artist_name, genre, description, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            f"INSERT OR REPLACE INTO {SQLITE_TABLE} "
+            "(rowid, product_name, artist_name, genre, description) " + sql,
+            params,
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+            "product_id bigint PRIMARY KEY "
+            "REFERENCES shop_main_product (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+            f"ON {POSTGRES_TABLE} USING gin (document)"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {POSTGRES_TABLE} (product_id, document) "
+            "SELECT d.id, "
+            "setweight(to_tsvector('simple', coalesce(d.product_name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(d.artist_name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(d.genre, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(d.description, '')), 'D') "
+            f"FROM ({sql}) AS d (id, product_name, artist_name, genre, description) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            params,
+        )
+
+
+def uninstall_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SQLITE_TABLE}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {POSTGRES_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0006_product_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:11
+
+import django.db.models.deletion
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0008_cartitem"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockReservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField()),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="reserved_quantity",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                django.db.models.expressions.CombinedExpression(
+                    models.F("stock_quantity"), "-", models.F("reserved_quantity")
+                ),
+                name="product_available_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockreservation",
+            name="product",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="shop_main.product"
+            ),
+        ),
+        migrations.AddField(
+            model_name="stockreservation",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="stockreservation",
+            constraint=models.UniqueConstraint(
+                fields=("user", "product"), name="reservation_user_product_uniq"
+            ),
+        ),
+    ]
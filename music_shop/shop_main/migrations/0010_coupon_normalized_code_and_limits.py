@@ -0,0 +1,55 @@
+from django.db import migrations, models
+
+
+def fill_normalized_code(apps, schema_editor):
+    Coupon = apps.get_model("shop_main", "Coupon")
+    groups = {}
+    for pk, code in Coupon.objects.order_by("pk").values_list("pk", "code"):
+        groups.setdefault(code.strip().upper(), []).append((pk, code))
+    # Codes that only differ by case or spaces would now be one code. Which
+    # of them customers hold is not known here, so they are left for a
+    # person to sort out rather than renamed or deactivated.
+    conflicts = [coupons for coupons in groups.values() if len(coupons) > 1]
+    if conflicts:
+        listed = "; ".join(
+            ", ".join(f"{code!r} (id {pk})" for pk, code in coupons)
+            for coupons in conflicts
+        )
+        raise RuntimeError(
+            "These coupon codes differ only by case or surrounding spaces and "
+            "would redeem as one code. Rename or delete all but one of each "
+            f"group, then migrate again: {listed}."
+        )
+    for normalized, [(pk, _)] in groups.items():
+        Coupon.objects.filter(pk=pk).update(normalized_code=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0009_stock_reservations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coupon",
+            name="normalized_code",
+            field=models.CharField(editable=False, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name="coupon",
+            name="max_redemptions",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="coupon",
+            name="times_redeemed",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_normalized_code, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="coupon",
+            name="normalized_code",
+            field=models.CharField(editable=False, max_length=50, unique=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:16
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0010_coupon_normalized_code_and_limits"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="discount",
+            field=models.DecimalField(
+                decimal_places=2, default=Decimal("0"), editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="item_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="subtotal",
+            field=models.DecimalField(
+                decimal_places=2, default=Decimal("0"), editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total",
+            field=models.DecimalField(
+                decimal_places=2, default=Decimal("0"), editable=False, max_digits=12
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "date_order", "id"], name="order_user_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["total", "id"], name="order_total_idx"),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:17
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, Sum
+
+logger = logging.getLogger(__name__)
+
+
+def drop_duplicate_reviews(apps, schema_editor):
+    # The constraint below allows one review per user and product: the
+    # newest review of each pair is kept and the deletions are reported.
+    Review = apps.get_model("shop_main", "Review")
+    pairs = (
+        Review.objects.values("user_id", "product_id")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    removed = 0
+    for row in pairs.iterator():
+        reviews = Review.objects.filter(
+            user_id=row["user_id"], product_id=row["product_id"]
+        )
+        newest = reviews.order_by("-created_at", "-pk").values_list("pk", flat=True)[0]
+        removed += reviews.exclude(pk=newest).delete()[0]
+    if removed:
+        logger.warning(
+            "Deleted %d older duplicate reviews, keeping the newest review of "
+            "each user and product.",
+            removed,
+        )
+
+
+def fill_ratings(apps, schema_editor):
+    Product = apps.get_model("shop_main", "Product")
+    Review = apps.get_model("shop_main", "Review")
+    rows = (
+        Review.objects.values("product_id")
+        .annotate(count=Count("id"), total=Sum("rating"), average=Avg("rating"))
+        .order_by()
+    )
+    for row in rows.iterator():
+        Product.objects.filter(pk=row["product_id"]).update(
+            review_count=row["count"],
+            rating_sum=row["total"],
+            rating_avg=row["average"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0011_order_totals"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_avg",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="review_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(drop_duplicate_reviews, migrations.RunPython.noop),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["rating_avg", "id"], name="product_rating_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["product", "created_at", "id"], name="review_product_date_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="review",
+            constraint=models.UniqueConstraint(
+                fields=("user", "product"), name="review_user_product_uniq"
+            ),
+        ),
+    ]
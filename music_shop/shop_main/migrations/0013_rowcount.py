@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0012_product_ratings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RowCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("label", models.CharField(max_length=100, unique=True)),
+                ("rows", models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
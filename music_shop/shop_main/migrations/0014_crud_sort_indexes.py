@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0013_rowcount"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="artist",
+            index=models.Index(fields=["artist_name", "id"], name="artist_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="genre",
+            index=models.Index(fields=["genre_name", "id"], name="genre_name_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["created_at", "id"], name="review_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(fields=["rating", "id"], name="review_rating_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="shippingaddress",
+            index=models.Index(fields=["city", "id"], name="address_city_id_idx"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0014_crud_sort_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["date_order", "id"], name="order_date_id_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0015_order_date_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="picture_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:42
+
+import shop_main.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0017_product_picture_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("references", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="product",
+            name="picture",
+            field=models.ImageField(
+                null=True,
+                storage=shop_main.storage.get_picture_storage,
+                upload_to="products/images/",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shop_main", "0018_media_files"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(fields=["user", "status"], name="order_user_status_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["genre", "created_at", "id"], name="product_genre_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["genre", "price", "id"], name="product_genre_price_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="shippingaddress",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="address_user_created_idx"
+            ),
+        ),
+    ]
@@ -1,6 +1,13 @@
+from decimal import ROUND_HALF_UP, Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.core.exceptions import ValidationError
+
+from .storage import get_picture_storage
+
+CENT = Decimal("0.01")
 
 
 def max_len_choices(choices):
@@ -21,6 +28,9 @@ class Genre(models.Model):
     )
     description = models.TextField()
 
+    class Meta:
+        indexes = [models.Index(fields=["genre_name", "id"], name="genre_name_id_idx")]
+
     def __str__(self):
         return self.get_genre_name_display()
 
@@ -29,6 +39,11 @@ class Artist(models.Model):
     artist_name = models.CharField(max_length=100)
     country = models.CharField(max_length=50, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["artist_name", "id"], name="artist_name_id_idx")
+        ]
+
     def __str__(self):
         return self.artist_name
 
@@ -38,7 +53,19 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.IntegerField()
-    picture = models.ImageField(upload_to="products/images/", null=True)
+    # Units held by active StockReservation rows; kept in step by
+    # shop_main.reservations so availability never needs a SUM over holds.
+    reserved_quantity = models.IntegerField(default=0)
+    # Review aggregates, updated incrementally by shop_main.ratings.
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.FloatField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    # Stored under a hash of the content; see shop_main.storage.
+    picture = models.ImageField(
+        upload_to="products/images/", storage=get_picture_storage, null=True
+    )
+    # Resized WebP/AVIF/JPEG copies of ``picture``, see shop_main.images.
+    picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -46,10 +73,32 @@ class Product(models.Model):
 
     class Meta:
         unique_together = ("product_name", "artist")
+        indexes = [
+            # Keyset pagination of the catalog: (sort key, id) for each sort.
+            models.Index(fields=["price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["product_name", "id"], name="product_name_id_idx"),
+            models.Index(fields=["created_at", "id"], name="product_created_id_idx"),
+            models.Index(fields=["rating_avg", "id"], name="product_rating_id_idx"),
+            # The same sorts within one genre (the catalog's genre filter).
+            models.Index(
+                fields=["genre", "created_at", "id"], name="product_genre_created_idx"
+            ),
+            models.Index(
+                fields=["genre", "price", "id"], name="product_genre_price_idx"
+            ),
+            models.Index(
+                models.F("stock_quantity") - models.F("reserved_quantity"),
+                name="product_available_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.product_name
 
+    @property
+    def available_quantity(self):
+        return self.stock_quantity - self.reserved_quantity
+
 
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -61,6 +110,43 @@ class Order(models.Model):
     coupon = models.ForeignKey(
         "Coupon", on_delete=models.SET_NULL, null=True, blank=True
     )
+    # Denormalized from the order items and coupon by ``set_totals``; kept
+    # current by the OrderItem signals and by checkout.
+    subtotal = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal("0"), editable=False
+    )
+    discount = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal("0"), editable=False
+    )
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=Decimal("0"), editable=False
+    )
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "date_order", "id"], name="order_user_date_idx"
+            ),
+            # The user's pending order, found by checkout.
+            models.Index(fields=["user", "status"], name="order_user_status_idx"),
+            models.Index(fields=["date_order", "id"], name="order_date_id_idx"),
+            models.Index(fields=["total", "id"], name="order_total_idx"),
+        ]
+
+    def set_totals(self, subtotal, item_count, discount_percent=None):
+        subtotal = Decimal(subtotal or 0).quantize(CENT)
+        discount = Decimal("0")
+        if discount_percent:
+            discount = (subtotal * discount_percent / 100).quantize(
+                CENT, rounding=ROUND_HALF_UP
+            )
+        self.subtotal = subtotal
+        self.discount = discount
+        self.total = subtotal - discount
+        self.item_count = item_count or 0
+        # Saving with this coupon needs no recalculation (see signals).
+        self._totals_coupon_id = self.coupon_id
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
@@ -85,6 +171,20 @@ class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="review_user_product_uniq"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["product", "created_at", "id"], name="review_product_date_idx"
+            ),
+            models.Index(fields=["created_at", "id"], name="review_created_id_idx"),
+            models.Index(fields=["rating", "id"], name="review_rating_id_idx"),
+        ]
+
     def __str__(self):
         return f"Review for {self.product.product_name} by {self.user.username}"
 
@@ -98,18 +198,115 @@ class ShippingAddress(models.Model):
     postal_code = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["city", "id"], name="address_city_id_idx"),
+            # The user's most recent address prefills checkout.
+            models.Index(
+                fields=["user", "created_at", "id"], name="address_user_created_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.full_name}, {self.city}, {self.address_line}"
 
 
 class Coupon(models.Model):
     code = models.CharField(max_length=50, unique=True)
+    # Upper-cased, trimmed copy of ``code``: lookups are an exact match on
+    # this unique index instead of a case-insensitive scan.
+    normalized_code = models.CharField(max_length=50, unique=True, editable=False)
     discount_percent = models.PositiveIntegerField(
         validators=[MinValueValidator(0), MaxValueValidator(100)]
     )
     active = models.BooleanField(default=True)
     valid_from = models.DateTimeField(null=True, blank=True)
     valid_to = models.DateTimeField(null=True, blank=True)
+    max_redemptions = models.PositiveIntegerField(null=True, blank=True)
+    times_redeemed = models.PositiveIntegerField(default=0, editable=False)
+
+    @staticmethod
+    def normalize_code(code):
+        return (code or "").strip().upper()
+
+    def clean(self):
+        super().clean()
+        self.normalized_code = self.normalize_code(self.code)
+        duplicate = Coupon.objects.filter(normalized_code=self.normalized_code)
+        if self.pk is not None:
+            duplicate = duplicate.exclude(pk=self.pk)
+        if duplicate.exists():
+            raise ValidationError({"code": "Промокод с таким кодом уже существует."})
+
+    def save(self, *args, **kwargs):
+        self.normalized_code = self.normalize_code(self.code)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "code" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "normalized_code"}
+        super().save(*args, **kwargs)
+
+    def is_valid_at(self, when):
+        return (
+            self.active
+            and (self.valid_from is None or self.valid_from <= when)
+            and (self.valid_to is None or self.valid_to >= when)
+        )
 
     def __str__(self):
         return f"{self.code} ({self.discount_percent}%)"
+
+
+class CartItem(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="cartitem_user_product_uniq"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} × {self.product_id} in cart of {self.user_id}"
+
+
+class StockReservation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="reservation_user_product_uniq"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} × {self.product_id} held for {self.user_id}"
+
+
+class RowCount(models.Model):
+    """Row count of one model, kept by signals in the "counter" mode of
+    shop_main.counts."""
+
+    label = models.CharField(max_length=100, unique=True)
+    rows = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.label}: {self.rows}"
+
+
+class MediaFile(models.Model):
+    """Number of rows referencing a content-addressed media file, kept by
+    shop_main.media so a file is deleted once nothing uses it."""
+
+    name = models.CharField(max_length=255, unique=True)
+    references = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.references}"
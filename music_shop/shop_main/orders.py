@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+
+from .cache import bump_version
+from .models import Order, OrderItem
+
+TOTAL_FIELDS = ("subtotal", "discount", "total", "item_count")
+
+
+def item_sums(order_ids):
+    """{order_id: (subtotal, item_count)} from one grouped query."""
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values("order_id")
+        .annotate(
+            subtotal=Sum(
+                F("price_at_order") * F("quantity"),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=Sum("quantity"),
+        )
+        .values_list("order_id", "subtotal", "item_count")
+        .order_by()
+    )
+    return {order_id: (subtotal, count) for order_id, subtotal, count in rows}
+
+
+def recalculate_totals(order_ids):
+    """Recompute the stored totals of ``order_ids`` from their items.
+
+    The orders are locked first, so two item changes on the same order
+    cannot interleave their reads and writes; the item sums come from one
+    grouped query and the totals are written with one bulk UPDATE.
+    """
+    order_ids = {pk for pk in order_ids if pk is not None}
+    if not order_ids:
+        return 0
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update(of=("self",))
+            .filter(pk__in=order_ids)
+            .select_related("coupon")
+            .only("coupon__discount_percent", *TOTAL_FIELDS)
+            .order_by("pk")
+        )
+        sums = item_sums(order_ids)
+        for order in orders:
+            subtotal, item_count = sums.get(order.pk, (0, 0))
+            percent = order.coupon.discount_percent if order.coupon else None
+            order.set_totals(subtotal, item_count, percent)
+        Order.objects.bulk_update(orders, TOTAL_FIELDS)
+        bump_version("order")
+    return len(orders)
@@ -0,0 +1,347 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.functional import cached_property
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .counts import ESTIMATED, EXACT, count_queryset, count_rows
+
+COUNT_MODES = (EXACT, ESTIMATED)
+
+
+def _cursor_default(value):
+    # DjangoJSONEncoder truncates datetimes to milliseconds, which would make
+    # the seek predicate skip rows created within the same millisecond.
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(payload):
+    raw = json.dumps(payload, default=_cursor_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return payload
+
+
+def cursor_querystring(params, cursor, param="cursor"):
+    if cursor is None:
+        return None
+    query = params.copy()
+    query[param] = cursor
+    return query.urlencode()
+
+
+class KeysetPage:
+    def __init__(
+        self, object_list, next_cursor=None, previous_cursor=None, pinned=None
+    ):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.pinned = pinned or []
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def is_indexed(model, field):
+    """Whether an index of ``model`` starts with ``field``, which keeps
+    seeking on it cheap."""
+    if field.primary_key or field.unique or field.db_index:
+        return True
+    names = {field.name, field.attname}
+    for index in model._meta.indexes:
+        if index.fields and index.fields[0].lstrip("-") in names:
+            return True
+    for constraint in model._meta.constraints:
+        fields = getattr(constraint, "fields", ())
+        if fields and fields[0] in names:
+            return True
+    return False
+
+
+class KeysetPaginator:
+    """Seek-method pagination over ``ordering`` with a ``pk`` tiebreak.
+
+    Every page is a ``WHERE key >= last_key AND (key > last_key OR pk >
+    last_pk) ORDER BY key, pk LIMIT n`` query, so the cost does not depend on
+    how deep the page is as long as ``(key, pk)`` is covered by an index.
+    The leading range on ``key`` alone is what lets the database read the
+    index in order; a bare OR of the two conditions is planned as two index
+    lookups whose union has to be sorted again.
+    """
+
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.descending = ordering.startswith("-")
+        self.field_name = ordering.lstrip("-")
+        if self.field_name == "id":
+            self.field_name = "pk"
+        self.page_size = page_size
+        if self.field_name == "pk":
+            self.field = queryset.model._meta.pk
+            self.attname = None
+        elif self.field_name in queryset.query.annotations:
+            self.field = queryset.query.annotations[self.field_name].output_field
+            self.attname = self.field_name
+        else:
+            self.field = queryset.model._meta.get_field(self.field_name)
+            self.attname = self.field.attname
+
+    def order_by(self, reverse=False):
+        descending = self.descending != reverse
+        prefix = "-" if descending else ""
+        if self.field_name == "pk":
+            return (prefix + "pk",)
+        return (prefix + self.field_name, prefix + "pk")
+
+    def seek(self, value, pk, reverse=False):
+        lookup = "lt" if self.descending != reverse else "gt"
+        if self.field_name == "pk":
+            return Q(**{"pk__" + lookup: pk})
+        return Q(**{f"{self.field_name}__{lookup}e": value}) & (
+            Q(**{f"{self.field_name}__{lookup}": value}) | Q(**{f"pk__{lookup}": pk})
+        )
+
+    def cursor_for(self, obj, reverse=False):
+        value = getattr(obj, self.attname) if self.attname else None
+        payload = {"v": value, "pk": obj.pk}
+        if reverse:
+            payload["r"] = 1
+        return encode_cursor(payload)
+
+    def page(self, cursor=None, pinned=None):
+        """One page after (or, for a reversed cursor, before) ``cursor``.
+
+        ``pinned`` is a ``Q`` matching at most one row, such as the viewer's
+        own review. That row is fetched by the same query on every page,
+        returned as ``page.pinned`` and left out of the page rows.
+        """
+        position = decode_cursor(cursor)
+        reverse = False
+        seek = Q()
+        if position is not None and "pk" in position:
+            try:
+                value = self.field.to_python(position.get("v"))
+                pk = self.queryset.model._meta.pk.to_python(position["pk"])
+            except (ValidationError, TypeError, ValueError):
+                position = None
+            else:
+                reverse = bool(position.get("r"))
+                seek = self.seek(value, pk, reverse)
+        else:
+            position = None
+
+        queryset = self.queryset
+        ordering = self.order_by(reverse)
+        limit = self.page_size + 1
+        if pinned is None:
+            queryset = queryset.filter(seek)
+        else:
+            queryset = queryset.annotate(
+                is_pinned=Case(
+                    When(pinned, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            ).filter((seek & ~pinned) | pinned)
+            ordering = ("-is_pinned", *ordering)
+            limit += 1
+
+        rows = list(queryset.order_by(*ordering)[:limit])
+        pinned_rows = []
+        if pinned is not None and rows and rows[0].is_pinned:
+            pinned_rows.append(rows.pop(0))
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows, pinned=pinned_rows)
+        if reverse:
+            next_cursor = self.cursor_for(rows[-1])
+            previous_cursor = (
+                self.cursor_for(rows[0], reverse=True) if has_more else None
+            )
+        else:
+            next_cursor = self.cursor_for(rows[-1]) if has_more else None
+            previous_cursor = (
+                self.cursor_for(rows[0], reverse=True) if position is not None else None
+            )
+        return KeysetPage(rows, next_cursor, previous_cursor, pinned_rows)
+
+
+class CountingPaginator(Paginator):
+    """Page-number paginator that takes the total of an unfiltered queryset
+    from ``shop_main.counts`` instead of running COUNT(*) over the table."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is None or query.where or query.distinct or query.combinator:
+            return super().count
+        return count_rows(self.object_list.model).rows
+
+
+class CountingPageNumberPagination(PageNumberPagination):
+    django_paginator_class = CountingPaginator
+    page_size_query_param = "page_size"
+
+    @property
+    def max_page_size(self):
+        return get_api_max_page_size()
+
+
+def get_api_max_page_size():
+    return getattr(settings, "SHOP_API_MAX_PAGE_SIZE", 500)
+
+
+def with_pk_tiebreak(queryset):
+    """``queryset`` in its own order (or by ``pk``) with the primary key
+    breaking ties, so OFFSET pages neither repeat nor skip rows."""
+    if queryset.query.combinator:
+        return queryset
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    if any(
+        isinstance(item, str) and item.lstrip("-") in ("pk", "id") for item in ordering
+    ):
+        return queryset
+    return queryset.order_by(*ordering, "pk")
+
+
+class ShopApiPagination(BasePagination):
+    """Keyset pagination for the REST API, with a page-number fallback.
+
+    Responses carry ``next``/``previous`` cursor links and no total: a page
+    is one ``WHERE (key, pk) > (...) LIMIT n`` query whatever its depth.
+    ``?count=estimated`` or ``?count=exact`` adds ``count`` and the
+    ``count_mode`` it came from. ``?page_size=`` is honoured up to
+    ``SHOP_API_MAX_PAGE_SIZE``.
+
+    Keyset paging needs the queryset ordered by one indexed column of the
+    model, optionally with an ``id`` tiebreak in the same direction. Any
+    other ordering, such as search relevance, and the legacy ``?page=``
+    parameter are served by ``CountingPageNumberPagination``.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 10
+        value = request.query_params.get(self.page_size_query_param)
+        if value:
+            try:
+                page_size = int(value)
+            except ValueError:
+                pass
+        return max(1, min(page_size, get_api_max_page_size()))
+
+    def get_keyset_ordering(self, queryset, view):
+        ordering = [
+            item
+            for item in (queryset.query.order_by or queryset.model._meta.ordering)
+            if isinstance(item, str)
+        ]
+        if len(ordering) == 2 and ordering[1].lstrip("-") in ("pk", "id"):
+            if ordering[0].startswith("-") == ordering[1].startswith("-"):
+                ordering = ordering[:1]
+        if not ordering:
+            return "pk"
+        if len(ordering) != 1:
+            return None
+        name = ordering[0].lstrip("-")
+        if name == "pk":
+            return ordering[0]
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if (
+            field.concrete
+            and not field.is_relation
+            and is_indexed(queryset.model, field)
+        ):
+            return ordering[0]
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.get_keyset_ordering(queryset, view)
+        if "page" in request.query_params or ordering is None:
+            self.fallback = CountingPageNumberPagination()
+            return self.fallback.paginate_queryset(
+                with_pk_tiebreak(queryset), request, view
+            )
+        self.fallback = None
+        paginator = KeysetPaginator(queryset, ordering, self.get_page_size(request))
+        self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        mode = request.query_params.get(self.count_query_param)
+        self.count = count_queryset(queryset, mode) if mode in COUNT_MODES else None
+        return list(self.page.object_list)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, "page")
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        payload = {
+            "next": self.get_link(self.page.next_cursor),
+            "previous": self.get_link(self.page.previous_cursor),
+        }
+        if self.count is not None:
+            payload["count"] = self.count.rows
+            payload["count_mode"] = self.count.mode
+        payload["results"] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "count": {"type": "integer"},
+                "count_mode": {"type": "string", "enum": list(COUNT_MODES)},
+                "results": schema,
+            },
+        }
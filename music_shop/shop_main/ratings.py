@@ -0,0 +1,31 @@
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Product
+
+
+def apply_review_change(product_id, count_delta, rating_delta):
+    """Move a product's review aggregates by ``count_delta`` reviews and
+    ``rating_delta`` rating points with one UPDATE.
+
+    Every right-hand side reads the row's old values, so the new average is
+    computed from the same count and sum that are being written and
+    concurrent review changes cannot leave the three columns out of step.
+    """
+    count = F("review_count") + count_delta
+    total = F("rating_sum") + rating_delta
+    Product.objects.filter(pk=product_id).update(
+        review_count=count,
+        rating_sum=total,
+        rating_avg=Case(
+            When(review_count__lte=-count_delta, then=Value(0.0)),
+            default=total / Cast(count, FloatField()),
+            output_field=FloatField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    # Ratings show on product cards and can be sorted on, so the catalog
+    # depends on them as well.
+    bump_version("product", f"product:{product_id}")
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import Product, StockReservation
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, "SHOP_RESERVATION_TTL", 15 * 60))
+
+
+def _release_reserved(released):
+    """Give ``released`` ({product_id: units}) back to availability with one
+    UPDATE."""
+    if not released:
+        return
+    units = Case(
+        *(When(pk=pid, then=Value(qty)) for pid, qty in released.items()),
+        output_field=IntegerField(),
+    )
+    Product.objects.filter(pk__in=released).update(
+        reserved_quantity=F("reserved_quantity") - units
+    )
+    bump_version("product", *(f"product:{pid}" for pid in released))
+
+
+def reserve(user, product_id, quantity=1):
+    """Hold ``quantity`` units of a product for ``user`` until the TTL runs
+    out. Returns False, without holding anything, if not enough stock is
+    available."""
+    expires_at = timezone.now() + get_ttl()
+    with transaction.atomic():
+        held = Product.objects.filter(
+            pk=product_id,
+            stock_quantity__gte=F("reserved_quantity") + quantity,
+        ).update(reserved_quantity=F("reserved_quantity") + quantity)
+        if not held:
+            return False
+        updated = StockReservation.objects.filter(
+            user=user, product_id=product_id
+        ).update(quantity=F("quantity") + quantity, expires_at=expires_at)
+        if not updated:
+            StockReservation.objects.create(
+                user=user,
+                product_id=product_id,
+                quantity=quantity,
+                expires_at=expires_at,
+            )
+        sold_out = Product.objects.filter(
+            pk=product_id, stock_quantity__lte=F("reserved_quantity")
+        ).exists()
+    # The catalog only shows whether a card can be added to the cart, so
+    # the catalog-wide version only moves when a product sells out.
+    if sold_out:
+        bump_version("product", f"product:{product_id}")
+    else:
+        bump_version(f"product:{product_id}")
+    return True
+
+
+def release(user, product_id, quantity=None):
+    """Return up to ``quantity`` held units (all of them when None)."""
+    with transaction.atomic():
+        hold = (
+            StockReservation.objects.select_for_update()
+            .filter(user=user, product_id=product_id)
+            .first()
+        )
+        if hold is None:
+            return
+        units = hold.quantity if quantity is None else min(quantity, hold.quantity)
+        if units >= hold.quantity:
+            hold.delete()
+        else:
+            StockReservation.objects.filter(pk=hold.pk).update(
+                quantity=F("quantity") - units
+            )
+        _release_reserved({product_id: units})
+
+
+def consume(user, placed):
+    """Drop the holds ``user`` had on products that were just ordered and
+    return {product_id: units} that were held. Call inside the checkout
+    transaction, after the products are locked."""
+    holds = dict(
+        StockReservation.objects.filter(user=user, product_id__in=placed)
+        .select_for_update()
+        .values_list("product_id", "quantity")
+    )
+    if holds:
+        StockReservation.objects.filter(user=user, product_id__in=holds).delete()
+    return holds
+
+
+def sweep(now=None, batch_size=1000):
+    """Release every expired hold; returns the number of holds removed."""
+    now = now or timezone.now()
+    removed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                StockReservation.objects.filter(expires_at__lte=now)
+                .order_by("expires_at")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                return removed
+            expired = StockReservation.objects.filter(pk__in=ids)
+            released = dict(
+                expired.values("product_id")
+                .annotate(units=Sum("quantity"))
+                .values_list("product_id", "units")
+                .order_by()
+            )
+            expired.delete()
+            _release_reserved(released)
+        removed += len(ids)
@@ -0,0 +1,256 @@
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Genre
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKENS = 8
+
+
+def tokenize(query):
+    return TOKEN_RE.findall((query or "").lower())[:MAX_TOKENS]
+
+
+def _genre_label_sql(column):
+    # Genre labels live in GenreChoices, not in the database; index both the
+    # stored value and the Russian label so either one matches.
+    whens = " ".join("WHEN %s THEN %s" for _ in Genre.GenreChoices.choices)
+    params = []
+    for value, label in Genre.GenreChoices.choices:
+        params.extend([value, f"{value} {label}"])
+    return f"CASE {column} {whens} ELSE {column} END", params
+
+
+def _document_select(where, params):
+    genre_sql, genre_params = _genre_label_sql("g.genre_name")
+    sql = (
+        "SELECT p.id, p.product_name, a.artist_name, "
+        f"{genre_sql}, p.description "
+        "FROM shop_main_product p "
+        "JOIN shop_main_artist a ON a.id = p.artist_id "
+        "JOIN shop_main_genre g ON g.id = p.genre_id"
+    )
+    if where:
+        sql += f" WHERE {where}"
+    return sql, genre_params + list(params)
+
+
+class SearchBackend:
+    """Inverted index over product name, artist, genre and description.
+
+    ``filter`` restricts a product queryset to matching rows and ``rank``
+    annotates ``search_rank`` (higher is better). The index is kept current
+    by the signal handlers in ``shop_main.signals`` and by ``index_products``
+    calls from bulk write paths that bypass signals.
+    """
+
+    table = None
+
+    def __init__(self, db=None):
+        self.connection = db or connection
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index_where(self, cursor, where, params):
+        pass
+
+    def remove_products(self, ids):
+        pass
+
+    def filter(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(product_name__icontains=token)
+                | Q(artist__artist_name__icontains=token)
+            )
+        return queryset
+
+    def rank(self, queryset, query):
+        return queryset
+
+    def index_products(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        with self.connection.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(ids))
+            self.index_where(cursor, f"p.id IN ({placeholders})", ids)
+
+    def index_artist(self, artist_id):
+        with self.connection.cursor() as cursor:
+            self.index_where(cursor, "p.artist_id = %s", [artist_id])
+
+    def index_genre(self, genre_id):
+        with self.connection.cursor() as cursor:
+            self.index_where(cursor, "p.genre_id = %s", [genre_id])
+
+    def rebuild(self):
+        if not self.table:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            self.index_where(cursor, "", [])
+
+
+class SQLiteSearchBackend(SearchBackend):
+    table = "shop_main_product_fts"
+    # bm25 column weights: product_name, artist_name, genre, description.
+    weights = (10.0, 6.0, 2.0, 1.0)
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            "product_name, artist_name, genre, description, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index_where(self, cursor, where, params):
+        sql, params = _document_select(where, params)
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {self.table} "
+            "(rowid, product_name, artist_name, genre, description) " + sql,
+            params,
+        )
+
+    def remove_products(self, ids):
+        ids = list(ids)
+        if not ids:
+            return
+        placeholders = ", ".join(["%s"] * len(ids))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids
+            )
+
+    def match_expression(self, tokens):
+        return " ".join(f'"{token}"*' for token in tokens)
+
+    def filter(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        return queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s",
+                [self.match_expression(tokens)],
+            )
+        )
+
+    def rank(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        weights = ", ".join(str(w) for w in self.weights)
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({self.table}, {weights}) FROM {self.table} "
+                f"WHERE {self.table} MATCH %s "
+                f"AND {self.table}.rowid = shop_main_product.id",
+                [self.match_expression(tokens)],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    table = "shop_main_product_search"
+    config = "simple"
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "product_id bigint PRIMARY KEY "
+            "REFERENCES shop_main_product (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_document_gin "
+            f"ON {self.table} USING gin (document)"
+        )
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index_where(self, cursor, where, params):
+        sql, params = _document_select(where, params)
+        c = self.config
+        cursor.execute(
+            f"INSERT INTO {self.table} (product_id, document) "
+            "SELECT d.id, "
+            f"setweight(to_tsvector('{c}', coalesce(d.product_name, '')), 'A') || "
+            f"setweight(to_tsvector('{c}', coalesce(d.artist_name, '')), 'A') || "
+            f"setweight(to_tsvector('{c}', coalesce(d.genre, '')), 'B') || "
+            f"setweight(to_tsvector('{c}', coalesce(d.description, '')), 'D') "
+            f"FROM ({sql}) AS d (id, product_name, artist_name, genre, description) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            params,
+        )
+
+    def tsquery(self, tokens):
+        return " & ".join(f"{token}:*" for token in tokens)
+
+    def filter(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        return queryset.filter(
+            pk__in=RawSQL(
+                f"SELECT product_id FROM {self.table} "
+                f"WHERE document @@ to_tsquery('{self.config}', %s)",
+                [self.tsquery(tokens)],
+            )
+        )
+
+    def rank(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        return queryset.annotate(
+            search_rank=RawSQL(
+                f"SELECT ts_rank(document, to_tsquery('{self.config}', %s)) "
+                f"FROM {self.table} WHERE product_id = shop_main_product.id",
+                [self.tsquery(tokens)],
+                output_field=FloatField(),
+            )
+        )
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(db=None):
+    db = db or connection
+    return BACKENDS.get(db.vendor, SearchBackend)(db)
+
+
+def search_products(queryset, query, ranked=True):
+    backend = get_backend()
+    queryset = backend.filter(queryset, query)
+    if ranked:
+        queryset = backend.rank(queryset, query)
+    return queryset
+
+
+def index_products(ids):
+    get_backend().index_products(ids)
+
+
+def remove_products(ids):
+    get_backend().remove_products(ids)
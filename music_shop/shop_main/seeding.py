@@ -0,0 +1,515 @@
+import bisect
+import datetime
+import itertools
+import math
+import random
+from array import array
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import counts
+from .cache import bump_version
+from .models import (
+    Artist,
+    Coupon,
+    Genre,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+    ShippingAddress,
+)
+from .search import get_backend
+
+# Rows of each table at --scale 1; order items follow from the orders.
+BASE_ROWS = {
+    "artists": 300,
+    "products": 3_000,
+    "users": 2_000,
+    "addresses": 2_400,
+    "coupons": 40,
+    "orders": 10_000,
+    "reviews": 12_000,
+}
+# Generation order: every stage only reads the tables before it; "ratings"
+# fills the products' stored review aggregates.
+STAGES = (
+    "artists",
+    "products",
+    "users",
+    "addresses",
+    "coupons",
+    "orders",
+    "reviews",
+    "ratings",
+)
+MODELS = {
+    "artists": Artist,
+    "products": Product,
+    "users": User,
+    "addresses": ShippingAddress,
+    "coupons": Coupon,
+    "orders": Order,
+}
+
+GENRE_WEIGHTS = {
+    Genre.GenreChoices.ROCK_METAL: 30,
+    Genre.GenreChoices.JAZZ_BLUES: 14,
+    Genre.GenreChoices.INDIE_ALTERNATIVE: 20,
+    Genre.GenreChoices.POP_DISCO: 20,
+    Genre.GenreChoices.CLASSICAL: 8,
+    Genre.GenreChoices.RUSSIAN_SOVIET: 8,
+}
+STATUS_WEIGHTS = {"Delivered": 70, "Shipped": 12, "Placed": 10, "Cancelled": 8}
+RATING_WEIGHTS = {1: 4, 2: 6, 3: 15, 4: 33, 5: 42}
+WORDS = (
+    "moon dark side wall echo storm night river blue fire glass road black "
+    "white heart stone dream silver ghost city sun rain wind velvet neon "
+    "electric golden wild quiet northern summer winter highway midnight"
+).split()
+REVIEW_WORDS = (
+    "отличный звук винил качество упаковка доставка быстро классика любимый "
+    "альбом рекомендую немного шумит обложка коллекция подарок"
+).split()
+COUNTRIES = ("UK", "USA", "Россия", "Германия", "Швеция", "Франция", "Япония")
+FIRST_NAMES = ("Иван", "Анна", "Пётр", "Мария", "Алексей", "Ольга", "Дмитрий")
+LAST_NAMES = ("Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева")
+CITY_WEIGHTS = {
+    "Москва": 35,
+    "Санкт-Петербург": 18,
+    "Новосибирск": 6,
+    "Екатеринбург": 6,
+    "Казань": 5,
+    "Нижний Новгород": 4,
+    "Самара": 3,
+}
+
+
+class Plan:
+    """Everything a worker needs to generate any chunk of any table: the
+    row counts, the first primary key of each table and the seed.
+
+    Rows get explicit primary keys from ``starts`` on, so a chunk can
+    point at rows of other tables (and other chunks) by arithmetic. Each
+    chunk draws from its own generator seeded with the table and the
+    chunk's first row, which makes the data depend only on the seed, the
+    counts, ``end`` and the batch size, not on the number of workers.
+    """
+
+    def __init__(self, rows, starts, seed=1, days=730, end=None, zipf=1.1):
+        self.rows = rows
+        self.starts = starts
+        self.seed = seed
+        self.days = days
+        self.end = end or datetime.datetime.now(datetime.timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        self.zipf = zipf
+
+    def rng(self, table, start):
+        return random.Random(f"{self.seed}:{table}:{start}")
+
+    def pk(self, table, index):
+        return self.starts[table] + index
+
+    def pick(self, table, rng):
+        """Index of a row of ``table`` drawn by Zipf popularity."""
+        return popularity(self.seed, table, self.rows[table], self.zipf).pick(rng)
+
+    def moment(self, rng, seasonal=True):
+        """A datetime within the last ``days``; seasonal ones follow order
+        traffic, the others are uniform."""
+        if seasonal:
+            day = calendar(self.days, self.end.date()).pick(rng)
+        else:
+            day = rng.randrange(self.days)
+        seconds = rng.choices(range(24), HOUR_WEIGHTS)[0] * 3600 + rng.randrange(3600)
+        return self.end - datetime.timedelta(days=self.days - day, seconds=-seconds)
+
+
+# Share of orders by hour of day: quiet nights, evening peak.
+HOUR_WEIGHTS = (
+    2,
+    1,
+    1,
+    1,
+    1,
+    1,
+    2,
+    3,
+    4,
+    5,
+    6,
+    6,
+    7,
+    7,
+    6,
+    6,
+    7,
+    8,
+    9,
+    10,
+    10,
+    9,
+    6,
+    4,
+)
+
+
+class Weighted:
+    """Draws indexes ``0..n-1`` by cumulative weight; ``order`` maps the
+    ranks onto indexes so the popular rows are spread over the table."""
+
+    def __init__(self, weights, order=None):
+        self.cumulative = array("d", itertools.accumulate(weights))
+        self.total = self.cumulative[-1] if self.cumulative else 0.0
+        self.order = order
+
+    def pick(self, rng):
+        rank = bisect.bisect(self.cumulative, rng.random() * self.total)
+        rank = min(rank, len(self.cumulative) - 1)
+        return self.order(rank) if self.order else rank
+
+
+@lru_cache(maxsize=None)
+def popularity(seed, table, n, exponent):
+    # A multiplicative permutation (step coprime with n) scatters the ranks
+    # without holding a shuffled list of n ids.
+    if not n:
+        return Weighted([])
+    step = next(p for p in itertools.count(7_919, 2) if math.gcd(p, n) == 1)
+    offset = random.Random(f"{seed}:{table}").randrange(n)
+    return Weighted(
+        (1 / (rank + 1) ** exponent for rank in range(n)),
+        lambda rank: (rank * step + offset) % n,
+    )
+
+
+@lru_cache(maxsize=None)
+def calendar(days, end):
+    """Daily order weights: growth over the period, a December peak, a
+    summer lull and busier weekends."""
+    weights = []
+    for day in range(days):
+        date = end - datetime.timedelta(days=days - day)
+        doy = date.timetuple().tm_yday
+        growth = 0.6 + 0.4 * day / max(days - 1, 1)
+        season = 1 + 0.8 * math.exp(-(((doy - 350) / 18) ** 2))
+        season += 0.15 * math.cos(2 * math.pi * (doy - 15) / 365)
+        weekend = 1.2 if date.weekday() >= 5 else 1.0
+        weights.append(growth * season * weekend)
+    return Weighted(weights)
+
+
+def product_price(seed, index):
+    """Current price of a generated product, computable without reading
+    it back: between 500 and 10 000, most of them cheap."""
+    share = ((index * 2_654_435_761 + seed * 40_503) % 2**32) / 2**32
+    return Decimal(500 + round(9_500 * share**2, -1))
+
+
+def choose(rng, weights):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+
+def words(rng, pool, count):
+    return " ".join(rng.choices(pool, k=count))
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """Let bulk_create store the generated dates instead of now."""
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def plan_rows(scale=1.0, overrides=None):
+    rows = {table: round(count * scale) for table, count in BASE_ROWS.items()}
+    rows.update(overrides or {})
+    return rows
+
+
+def make_plan(rows, **options):
+    """A Plan starting after the rows already in each table."""
+    starts = {
+        table: (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+        for table, model in MODELS.items()
+    }
+    return Plan(rows, starts, **options)
+
+
+def ensure_genres():
+    """Every GenreChoices genre, created where missing; returns how many
+    were created."""
+    existing = set(Genre.objects.values_list("genre_name", flat=True))
+    missing = [value for value in Genre.GenreChoices.values if value not in existing]
+    Genre.objects.bulk_create(
+        [Genre(genre_name=value, description="") for value in missing]
+    )
+    return len(missing)
+
+
+def chunks(total, size):
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def generate(table, plan, start, stop):
+    """Create rows ``start..stop-1`` of ``table``; returns {table: rows}."""
+    with explicit_timestamps(*MODELS.values(), Review), transaction.atomic():
+        return GENERATORS[table](plan, plan.rng(table, start), start, stop)
+
+
+def _artists(plan, rng, start, stop):
+    Artist.objects.bulk_create(
+        [
+            Artist(
+                pk=plan.pk("artists", i),
+                artist_name=f"{words(rng, WORDS, 2).title()} {i}",
+                country=rng.choice(COUNTRIES),
+            )
+            for i in range(start, stop)
+        ]
+    )
+    return {"artists": stop - start}
+
+
+def _products(plan, rng, start, stop):
+    genres = dict(Genre.objects.values_list("genre_name", "pk"))
+    products = []
+    for i in range(start, stop):
+        created = plan.moment(rng, seasonal=False)
+        products.append(
+            Product(
+                pk=plan.pk("products", i),
+                product_name=f"{words(rng, WORDS, rng.randint(1, 3)).title()} {i}",
+                description=words(rng, WORDS, 12),
+                price=product_price(plan.seed, i),
+                stock_quantity=0 if rng.random() < 0.1 else rng.randint(1, 60),
+                genre_id=genres[choose(rng, GENRE_WEIGHTS)],
+                artist_id=plan.pk("artists", plan.pick("artists", rng)),
+                created_at=created,
+                updated_at=created,
+            )
+        )
+    Product.objects.bulk_create(products)
+    return {"products": stop - start}
+
+
+def _users(plan, rng, start, stop):
+    users = []
+    for i in range(start, stop):
+        pk = plan.pk("users", i)
+        users.append(
+            User(
+                pk=pk,
+                username=f"seed{plan.seed}_{pk}",
+                email=f"seed{plan.seed}_{pk}@example.com",
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                password="!",  # unusable
+                date_joined=plan.moment(rng, seasonal=False),
+            )
+        )
+    User.objects.bulk_create(users)
+    return {"users": stop - start}
+
+
+def _addresses(plan, rng, start, stop):
+    users = plan.rows["users"]
+    ShippingAddress.objects.bulk_create(
+        [
+            ShippingAddress(
+                pk=plan.pk("addresses", i),
+                # Address i belongs to user i mod users: every user has one
+                # while there are enough, the first ones get a second.
+                user_id=plan.pk("users", i % users),
+                full_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                phone=f"+7 9{rng.randrange(10**9):09d}",
+                city=choose(rng, CITY_WEIGHTS),
+                address_line=f"ул. {rng.choice(LAST_NAMES)}а, {rng.randint(1, 150)}",
+                postal_code=f"{rng.randint(100000, 699999)}",
+                created_at=plan.moment(rng, seasonal=False),
+            )
+            for i in range(start, stop)
+        ]
+    )
+    return {"addresses": stop - start}
+
+
+def _coupons(plan, rng, start, stop):
+    Coupon.objects.bulk_create(
+        [
+            Coupon(
+                pk=plan.pk("coupons", i),
+                code=f"SEED{plan.seed}-{plan.pk('coupons', i)}",
+                normalized_code=f"SEED{plan.seed}-{plan.pk('coupons', i)}",
+                discount_percent=rng.choice((5, 10, 10, 15, 20, 30)),
+                active=rng.random() < 0.8,
+            )
+            for i in range(start, stop)
+        ]
+    )
+    return {"coupons": stop - start}
+
+
+def _orders(plan, rng, start, stop):
+    coupons = dict(
+        Coupon.objects.filter(
+            pk__gte=plan.starts["coupons"],
+            pk__lt=plan.pk("coupons", plan.rows["coupons"]),
+        ).values_list("pk", "discount_percent")
+    )
+    coupon_ids = sorted(coupons)
+    orders, items = [], []
+    for i in range(start, stop):
+        user = plan.pick("users", rng)
+        coupon = rng.choice(coupon_ids) if coupon_ids and rng.random() < 0.08 else None
+        order = Order(
+            pk=plan.pk("orders", i),
+            user_id=plan.pk("users", user),
+            date_order=plan.moment(rng),
+            status=choose(rng, STATUS_WEIGHTS),
+            shipping_address_id=(
+                plan.pk("addresses", user) if user < plan.rows["addresses"] else None
+            ),
+            coupon_id=coupon,
+        )
+        lines = {}
+        for _ in range(min(1 + int(rng.expovariate(1 / 1.2)), 8)):
+            product = plan.pick("products", rng)
+            lines[product] = rng.choices((1, 2, 3), (80, 15, 5))[0]
+        subtotal = Decimal(0)
+        for product, quantity in lines.items():
+            price = product_price(plan.seed, product)
+            subtotal += price * quantity
+            items.append(
+                OrderItem(
+                    order_id=order.pk,
+                    product_id=plan.pk("products", product),
+                    quantity=quantity,
+                    price_at_order=price,
+                )
+            )
+        order.set_totals(subtotal, sum(lines.values()), coupons.get(coupon))
+        orders.append(order)
+    Order.objects.bulk_create(orders)
+    OrderItem.objects.bulk_create(items, batch_size=5_000)
+    return {"orders": len(orders), "order items": len(items)}
+
+
+def _reviews(plan, rng, start, stop):
+    # Chunked over the reviewing users, so (user, product) stays unique.
+    mean = plan.rows["reviews"] / max(plan.rows["users"], 1)
+    cap = min(plan.rows["products"], 200)
+    reviews = []
+    for user in range(start, stop):
+        wanted = min(round(rng.expovariate(1 / mean)) if mean else 0, cap)
+        products = set()
+        # Popular products come up again and again; redraw, within reason.
+        for _ in range(wanted * 4):
+            if len(products) == wanted:
+                break
+            products.add(plan.pick("products", rng))
+        for product in products:
+            reviews.append(
+                Review(
+                    user_id=plan.pk("users", user),
+                    product_id=plan.pk("products", product),
+                    rating=choose(rng, RATING_WEIGHTS),
+                    text=words(rng, REVIEW_WORDS, rng.randint(3, 12)).capitalize(),
+                    created_at=plan.moment(rng),
+                )
+            )
+    Review.objects.bulk_create(reviews, batch_size=5_000)
+    return {"reviews": len(reviews)}
+
+
+def _ratings(plan, rng, start, stop):
+    """Stored review aggregates of products ``start..stop-1``."""
+    reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+    count = Subquery(reviews.annotate(value=Count("pk")).values("value"))
+    total = Subquery(reviews.annotate(value=Sum("rating")).values("value"))
+    average = Subquery(reviews.annotate(value=Avg("rating")).values("value"))
+    updated = Product.objects.filter(
+        pk__gte=plan.pk("products", start), pk__lt=plan.pk("products", stop)
+    ).update(
+        review_count=Coalesce(count, 0),
+        rating_sum=Coalesce(total, 0.0),
+        rating_avg=Coalesce(average, 0.0),
+    )
+    return {"product ratings": updated}
+
+
+GENERATORS = {
+    "artists": _artists,
+    "products": _products,
+    "users": _users,
+    "addresses": _addresses,
+    "coupons": _coupons,
+    "orders": _orders,
+    "reviews": _reviews,
+    "ratings": _ratings,
+}
+
+
+def stage_chunks(plan, table, batch_size):
+    """(table, start, stop) jobs of one stage; reviews are generated per
+    reviewing user and ratings per product."""
+    total = {"reviews": plan.rows["users"], "ratings": plan.rows["products"]}.get(
+        table, plan.rows.get(table, 0)
+    )
+    return [(table, start, stop) for start, stop in chunks(total, batch_size)]
+
+
+def finish(plan):
+    """The writes that go around signals: coupon redemption counts,
+    database sequences, planner statistics, the search index, row
+    counters and cached pages."""
+    redeemed = (
+        Order.objects.filter(pk__gte=plan.starts["orders"], coupon__isnull=False)
+        .values("coupon_id")
+        .annotate(count=Count("pk"))
+        .values_list("coupon_id", "count")
+        .order_by()
+    )
+    with transaction.atomic():
+        for coupon_id, count in redeemed:
+            Coupon.objects.filter(pk=coupon_id).update(times_redeemed=count)
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+            no_style(), [*MODELS.values(), OrderItem, Review]
+        ):
+            cursor.execute(sql)
+        cursor.execute("ANALYZE")
+    get_backend().rebuild()
+    if counts.get_mode() == counts.COUNTER:
+        counts.refresh_counters()
+    bump_version(
+        "product",
+        "artist",
+        "genre",
+        "order",
+        "orderitem",
+        "review",
+        "coupon",
+        "coupon_redemptions",
+    )
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from .bulk import BulkListSerializer, PrefetchedPrimaryKeyRelatedField
 from .models import (
     Genre,
     Artist,
@@ -15,18 +16,23 @@ from .models import (
 class GenreSerializer(serializers.ModelSerializer):
     class Meta:
         model = Genre
+        list_serializer_class = BulkListSerializer
         fields = ["id", "genre_name", "description"]
 
 
 class ArtistSerializer(serializers.ModelSerializer):
     class Meta:
         model = Artist
+        list_serializer_class = BulkListSerializer
         fields = ["id", "artist_name", "country"]
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = Product
+        list_serializer_class = BulkListSerializer
         fields = [
             "id",
             "product_name",
@@ -38,8 +44,10 @@ class ProductSerializer(serializers.ModelSerializer):
             "artist",
             "created_at",
             "updated_at",
+            "review_count",
+            "rating_avg",
         ]
-        read_only_fields = ["created_at", "updated_at"]
+        read_only_fields = ["created_at", "updated_at", "review_count", "rating_avg"]
 
 
 class ShippingAddressSerializer(serializers.ModelSerializer):
@@ -68,12 +76,26 @@ class CouponSerializer(serializers.ModelSerializer):
             "active",
             "valid_from",
             "valid_to",
+            "max_redemptions",
+            "times_redeemed",
         ]
+        read_only_fields = ["times_redeemed"]
+
+    def validate_code(self, value):
+        duplicate = Coupon.objects.filter(normalized_code=Coupon.normalize_code(value))
+        if self.instance is not None:
+            duplicate = duplicate.exclude(pk=self.instance.pk)
+        if duplicate.exists():
+            raise serializers.ValidationError("Промокод с таким кодом уже существует.")
+        return value
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = OrderItem
+        list_serializer_class = BulkListSerializer
         fields = ["id", "order", "product", "quantity", "price_at_order"]
 
 
@@ -87,8 +109,12 @@ class OrderSerializer(serializers.ModelSerializer):
             "status",
             "shipping_address",
             "coupon",
+            "subtotal",
+            "discount",
+            "total",
+            "item_count",
         ]
-        read_only_fields = ["date_order"]
+        read_only_fields = ["date_order", "subtotal", "discount", "total", "item_count"]
 
 
 class ReviewSerializer(serializers.ModelSerializer):
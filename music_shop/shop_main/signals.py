@@ -0,0 +1,283 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counts, images, media, search
+from .bulk import bulk_saved
+from .cart import merge_on_login
+from .cache import bump_version
+from .models import (
+    Artist,
+    Coupon,
+    Genre,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+    ShippingAddress,
+)
+from .orders import TOTAL_FIELDS, recalculate_totals
+from .ratings import apply_review_change
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def build_picture_variants(sender, instance, raw=False, **kwargs):
+    # Bulk writes and imports leave this to the build_image_variants command.
+    if raw or images.has_variants(instance):
+        return
+    if instance.picture:
+        source = instance.picture.name
+        transaction.on_commit(lambda: images.build_variants(instance.pk, source))
+    else:
+        Product.objects.filter(pk=instance.pk).update(picture_variants={})
+
+
+def writes_picture(instance, raw, update_fields=None, **kwargs):
+    return (
+        not raw
+        and "picture" in instance.__dict__
+        and (update_fields is None or "picture" in update_fields)
+    )
+
+
+@receiver(pre_save, sender=Product)
+def remember_stored_picture(sender, instance, raw=False, **kwargs):
+    # The picture file the row references in the database, for the
+    # reference counts of shop_main.media.
+    if instance.pk is not None and writes_picture(instance, raw, **kwargs):
+        stored = Product.objects.filter(pk=instance.pk).values_list(
+            "picture", flat=True
+        )
+        instance._stored_picture = stored.first() or ""
+
+
+@receiver(post_save, sender=Product)
+def count_picture_references(sender, instance, created=False, raw=False, **kwargs):
+    if not writes_picture(instance, raw, **kwargs):
+        return
+    previous = None if created else getattr(instance, "_stored_picture", None)
+    media.adjust(media.changes([(previous, instance.picture.name or "")]))
+
+
+@receiver(post_delete, sender=Product)
+def release_picture(sender, instance, **kwargs):
+    media.adjust(media.changes([(instance.picture.name, None)]))
+
+
+@receiver(bulk_saved, sender=Product)
+def count_bulk_picture_references(sender, created, updated, previous, **kwargs):
+    pairs = [(None, product.picture.name) for product in created]
+    for product in updated:
+        if "picture" in previous.get(product.pk, {}):
+            old = previous[product.pk]["picture"]
+            pairs.append((getattr(old, "name", old), product.picture.name))
+    media.adjust(media.changes(pairs))
+
+
+@receiver(post_save, sender=Artist)
+def reindex_artist_products(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        search.get_backend().index_artist(instance.pk)
+
+
+@receiver(post_save, sender=Genre)
+def reindex_genre_products(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        search.get_backend().index_genre(instance.pk)
+
+
+@receiver(bulk_saved, sender=Product)
+def index_bulk_products(sender, created, updated, **kwargs):
+    ids = [product.pk for product in (*created, *updated)]
+    search.index_products(ids)
+    bump_version("product", *(f"product:{pk}" for pk in ids))
+
+
+@receiver(bulk_saved, sender=Artist)
+def reindex_bulk_artists(sender, updated, **kwargs):
+    for artist in updated:
+        search.get_backend().index_artist(artist.pk)
+    bump_version("artist")
+
+
+@receiver(bulk_saved, sender=Genre)
+def reindex_bulk_genres(sender, updated, **kwargs):
+    for genre in updated:
+        search.get_backend().index_genre(genre.pk)
+    bump_version("genre")
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_product_version(sender, instance, **kwargs):
+    bump_version("product", f"product:{instance.pk}")
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def bump_artist_version(sender, instance, **kwargs):
+    bump_version("artist")
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_genre_version(sender, instance, **kwargs):
+    bump_version("genre")
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_review_version(sender, instance, **kwargs):
+    bump_version("review", f"reviews:product:{instance.product_id}")
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk)
+            .values_list("product_id", "rating")
+            .first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, "_previous_rating", None)
+    if previous is None:
+        apply_review_change(instance.product_id, 1, instance.rating)
+    elif previous[0] != instance.product_id:
+        apply_review_change(previous[0], -1, -previous[1])
+        apply_review_change(instance.product_id, 1, instance.rating)
+    elif previous[1] != instance.rating:
+        apply_review_change(instance.product_id, 0, instance.rating - previous[1])
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    apply_review_change(instance.product_id, -1, -instance.rating)
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def bump_coupon_version(sender, instance, **kwargs):
+    bump_version("coupon")
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def bump_order_version(sender, instance, **kwargs):
+    bump_version("order")
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+@receiver(bulk_saved, sender=OrderItem)
+def bump_order_item_version(sender, **kwargs):
+    bump_version("orderitem")
+
+
+@receiver(post_save, sender=ShippingAddress)
+@receiver(post_delete, sender=ShippingAddress)
+def bump_shipping_address_version(sender, instance, **kwargs):
+    bump_version("shippingaddress")
+
+
+@receiver(pre_save, sender=OrderItem)
+def remember_item_order(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._previous_order_id = (
+            OrderItem.objects.filter(pk=instance.pk)
+            .values_list("order_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=OrderItem)
+def update_totals_on_item_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        previous = getattr(instance, "_previous_order_id", None)
+        recalculate_totals([instance.order_id, previous])
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_totals_on_item_delete(sender, instance, **kwargs):
+    recalculate_totals([instance.order_id])
+
+
+@receiver(bulk_saved, sender=OrderItem)
+def update_totals_on_bulk_save(sender, created, updated, previous, **kwargs):
+    order_ids = {item.order_id for item in (*created, *updated)}
+    order_ids.update(old.get("order_id") for old in previous.values())
+    recalculate_totals(order_ids)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_coupon(sender, instance, raw=False, update_fields=None, **kwargs):
+    if (
+        instance.pk is not None
+        and not raw
+        and "coupon_id" in instance.__dict__
+        and (update_fields is None or "coupon" in update_fields)
+    ):
+        instance._previous_coupon_id = (
+            Order.objects.filter(pk=instance.pk)
+            .values_list("coupon_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def update_totals_on_coupon_change(
+    sender, instance, created=False, raw=False, **kwargs
+):
+    # Totals computed by set_totals for the saved coupon are already right.
+    computed = "_totals_coupon_id" in instance.__dict__
+    computed_for = instance.__dict__.pop("_totals_coupon_id", None)
+    if created or raw or "_previous_coupon_id" not in instance.__dict__:
+        return
+    coupon_id = instance.coupon_id
+    if coupon_id != instance.__dict__.pop("_previous_coupon_id") and not (
+        computed and computed_for == coupon_id
+    ):
+        recalculate_totals([instance.pk])
+        instance.refresh_from_db(fields=TOTAL_FIELDS)
+
+
+def count_created_row(sender, instance, created=False, raw=False, **kwargs):
+    if created:
+        counts.adjust(sender, 1)
+
+
+def count_deleted_row(sender, instance, **kwargs):
+    counts.adjust(sender, -1)
+
+
+def count_bulk_created_rows(sender, created, **kwargs):
+    counts.adjust(sender, len(created))
+
+
+for model in counts.COUNTED_MODELS:
+    post_save.connect(count_created_row, sender=model)
+    post_delete.connect(count_deleted_row, sender=model)
+    bulk_saved.connect(count_bulk_created_rows, sender=model)
+
+
+@receiver(user_logged_in)
+def merge_cart(sender, request, user, **kwargs):
+    if request is not None:
+        merge_on_login(request, user)
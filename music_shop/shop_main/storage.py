@@ -0,0 +1,74 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+# "<upload_to>/ab/<sha256>.<ext>"
+HASHED_NAME_RE = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+# Served files whose URL changes with their content (see is_immutable).
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def file_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    return bool(name) and HASHED_NAME_RE.search(name) is not None
+
+
+def is_immutable(name):
+    """Whether a media file is named after its content: hashed originals
+    and the derivatives built from them (shop_main.images)."""
+    return is_content_addressed(name) or name.startswith("products/derived/")
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names every file after the SHA-256 of its
+    content, keeping the directory it was uploaded to and its extension.
+
+    Saving bytes that are already stored returns the existing name without
+    writing anything, so identical uploads share one file; the files are
+    reference-counted in shop_main.media so they are only deleted once no
+    product uses them.
+    """
+
+    def hashed_name(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        digest = file_digest(content)
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        return super().save(self.hashed_name(name, content), content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # An existing file under a content name holds the same bytes.
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        # Write under a unique name and rename, so a concurrent upload of
+        # the same content never sees a partial file.
+        temporary = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+picture_storage = ContentAddressedStorage()
+
+
+def get_picture_storage():
+    return picture_storage
@@ -0,0 +1,19 @@
+from django import template
+
+from shop_main.images import picture_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag("includes/picture.html")
+def product_picture(product, sizes, css_class="", loading="lazy"):
+    """``<picture>`` of the product's cover built from its derivatives, with
+    ``sizes`` telling the browser how wide the image is shown; the original
+    file is used until the derivatives exist."""
+    return {
+        "product": product,
+        "picture": picture_sources(product),
+        "sizes": sizes,
+        "css_class": css_class,
+        "loading": loading,
+    }
@@ -1,3 +1,1895 @@
-from django.test import TestCase
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import addModuleCleanup, mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import cache as shop_cache
+from . import cart, counts, coupons, crud, exports, facets, images, reservations, search
+from . import urls as shop_urls
+from .api import router as api_router
+from .cache import get_versions
+from .catalog import PAGE_SIZE, SORT_OPTIONS, CatalogQuery
+from .checkout import CheckoutError, place_order
+from .crud import REGISTRY, Column, CrudTable
+from .exports import CONTENT_TYPES, EXPORTS
+from .feeds import StockFeedSync
+from .imports import CatalogImporter
+from .instrumentation import QueryInstrumentationMiddleware, QueryStats
+from .models import (
+    Artist,
+    CartItem,
+    Coupon,
+    Genre,
+    MediaFile,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+    RowCount,
+    ShippingAddress,
+    StockReservation,
+)
+from .pagination import KeysetPaginator
+from .storage import is_content_addressed, picture_storage
+
+# SQLite: a table read without an index, or a separate sorting step.
+SQLITE_FULL_SCAN = re.compile(r"\bSCAN \w+$")
+SQLITE_SORT = re.compile(r"\bUSE TEMP B-TREE\b")
+# PostgreSQL: the same, as plan nodes.
+POSTGRES_FULL_SCAN = re.compile(r"\bSeq Scan\b")
+POSTGRES_SORT = re.compile(r"(^|->)\s*(Incremental )?Sort\b")
+
+
+def setUpModule():
+    # Requests over the SQL thresholds (or picked by the sample rate) would
+    # print their log line among the test output; tests that expect one
+    # capture it with assertLogs, which sets its own level.
+    sql_logger = logging.getLogger("shop_main.sql")
+    addModuleCleanup(sql_logger.setLevel, sql_logger.level)
+    sql_logger.setLevel(logging.CRITICAL)
+
+
+def make_product(name="The Wall", artist=None, genre=None, **fields):
+    """A product with the genre and artist it needs created on the way."""
+    if genre is None:
+        genre, _ = Genre.objects.get_or_create(
+            genre_name=Genre.GenreChoices.ROCK_METAL, defaults={"description": ""}
+        )
+    if artist is None:
+        artist = Artist.objects.create(artist_name="Pink Floyd")
+    fields = {
+        "description": "",
+        "price": Decimal("1000"),
+        "stock_quantity": 10,
+        **fields,
+    }
+    return Product.objects.create(
+        product_name=name, genre=genre, artist=artist, **fields
+    )
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN of the shop's hot queries: each one has to be answered from
+    an index, in index order, without a full scan of a table or a sort.
+
+    Runs on SQLite and, when the default database is PostgreSQL, there with
+    sequential scans and sorts disabled, so a plan still containing them
+    means no index could serve the query.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer")
+        cls.genre = Genre.objects.create(
+            genre_name=Genre.GenreChoices.ROCK_METAL, description=""
+        )
+        Genre.objects.create(genre_name=Genre.GenreChoices.JAZZ_BLUES, description="")
+        artist = Artist.objects.create(artist_name="Pink Floyd")
+        cls.product = Product.objects.create(
+            product_name="The Dark Side of the Moon",
+            price=Decimal("2500"),
+            stock_quantity=3,
+            genre=cls.genre,
+            artist=artist,
+        )
+        Review.objects.create(user=cls.user, product=cls.product, rating=5, text="")
+        ShippingAddress.objects.create(
+            user=cls.user,
+            full_name="Иван Иванов",
+            phone="+7 900 000-00-00",
+            city="Москва",
+            address_line="ул. Ленина, 1",
+            postal_code="101000",
+        )
+        Order.objects.create(user=cls.user, status="Placed")
+
+    def setUp(self):
+        # Cached lookups (genre ids) would outlive the rows of other tests.
+        cache.clear()
+
+    def explain(self, queryset):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("SET LOCAL enable_sort = off")
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor == "sqlite":
+            full_scan, sort = SQLITE_FULL_SCAN, SQLITE_SORT
+        elif connection.vendor == "postgresql":
+            full_scan, sort = POSTGRES_FULL_SCAN, POSTGRES_SORT
+        else:
+            self.skipTest(f"no plan checks for {connection.vendor}")
+        plan = self.explain(queryset)
+        for line in plan.splitlines():
+            self.assertIsNone(full_scan.search(line), f"full scan:\n{plan}")
+            self.assertIsNone(sort.search(line), f"sort:\n{plan}")
+
+    def page_queries(self, queryset, ordering, page_size):
+        """The first-page and a later-page query KeysetPaginator runs."""
+        paginator = KeysetPaginator(queryset, ordering, page_size)
+        obj = queryset.order_by(*paginator.order_by()).first()
+        value = getattr(obj, paginator.attname) if paginator.attname else None
+        ordered = queryset.order_by(*paginator.order_by())
+        return [
+            ordered[: page_size + 1],
+            ordered.filter(paginator.seek(value, obj.pk))[: page_size + 1],
+        ]
+
+    def assertCatalogPagesUseIndex(self, **params):
+        query = CatalogQuery.from_params(params)
+        for queryset in self.page_queries(query.queryset(), query.sort, PAGE_SIZE):
+            with self.subTest(**params):
+                self.assertUsesIndex(queryset)
+
+    def test_catalog_sorts(self):
+        # Relevance orders by the search rank, which no index can hold.
+        for sort in SORT_OPTIONS:
+            if sort != "relevance":
+                self.assertCatalogPagesUseIndex(sort=sort)
+
+    def test_catalog_sorts_within_genre(self):
+        for sort in ("created_at", "-created_at", "price", "-price"):
+            self.assertCatalogPagesUseIndex(
+                sort=sort, genre=Genre.GenreChoices.ROCK_METAL
+            )
+
+    def test_pending_order_lookup(self):
+        # checkout: Order.objects.get_or_create(user=user, status="Pending")
+        self.assertUsesIndex(Order.objects.filter(user=self.user, status="Pending"))
+
+    def test_account_orders(self):
+        orders = Order.objects.filter(user=self.user)
+        for queryset in self.page_queries(orders, "-date_order", 10):
+            self.assertUsesIndex(queryset)
+
+    def test_product_reviews(self):
+        reviews = Review.objects.filter(product=self.product).select_related("user")
+        for queryset in self.page_queries(reviews, "-created_at", 10):
+            self.assertUsesIndex(queryset)
+
+    def test_latest_shipping_address(self):
+        self.assertUsesIndex(
+            ShippingAddress.objects.filter(user=self.user).order_by("-created_at")[:1]
+        )
+
+
+QUERY_BUDGETS = Path(__file__).with_name("query_budgets.json")
+# Set to rewrite QUERY_BUDGETS with the counts measured instead of checking them.
+UPDATE_BUDGETS = "SHOP_UPDATE_QUERY_BUDGETS"
+# Pages measured with a query string as well as bare.
+QUERY_VARIANTS = {
+    "catalog": {
+        "filtered": {"genre": Genre.GenreChoices.ROCK_METAL, "sort": "price"},
+        "search": {"search": "album", "min_rating": "3"},
+    },
+}
+
+
+class ApiURLConf:
+    urlpatterns = [path("api/", include(api_router.urls))]
+
+
+@override_settings(SHOP_SQL_LOG_SAMPLE_RATE=0)
+class QueryBudgetTests(TestCase):
+    """Queries run by every GET page of shop_main.urls and every API route,
+    checked against query_budgets.json.
+
+    Each page is measured with a cold cache over a small dataset and again
+    after more rows have been added: a count that grows with the rows is an
+    N+1 query. After an intended change, rerun with
+    SHOP_UPDATE_QUERY_BUDGETS=1 to rewrite the budgets.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="admin")
+        cls.genres = [
+            Genre.objects.create(genre_name=value, description="")
+            for value in Genre.GenreChoices.values
+        ]
+        cls.rows = 0
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        """``count`` more of everything: artists, products, reviews by new
+        users, addresses, coupons and the admin's orders."""
+        start, self.rows = self.rows, self.rows + count
+        for i in range(start, self.rows):
+            user = User.objects.create_user(f"buyer{i}")
+            artist = Artist.objects.create(artist_name=f"Artist {i}", country="UK")
+            product = Product.objects.create(
+                product_name=f"Album {i}",
+                description="",
+                price=Decimal(1000 + i * 10),
+                stock_quantity=10,
+                genre=self.genres[i % len(self.genres)],
+                artist=artist,
+            )
+            address = ShippingAddress.objects.create(
+                user=self.admin,
+                full_name="Иван Иванов",
+                phone="+7 900 000-00-00",
+                city="Москва",
+                address_line=f"ул. Ленина, {i}",
+                postal_code="101000",
+            )
+            coupon = Coupon.objects.create(code=f"SALE{i}", discount_percent=10)
+            order = Order.objects.create(
+                user=self.admin,
+                status="Placed",
+                shipping_address=address,
+                coupon=coupon,
+            )
+            for reviewed in Product.objects.order_by("pk")[:3]:
+                OrderItem.objects.create(
+                    order=order,
+                    product=reviewed,
+                    quantity=1,
+                    price_at_order=reviewed.price,
+                )
+                Review.objects.create(
+                    user=user, product=reviewed, rating=4, text="Отличный звук"
+                )
+            Review.objects.create(user=self.admin, product=product, rating=5, text="")
+
+    def pages(self):
+        """(label, path) of every GET route, with a row of the view's model
+        for a ``pk``."""
+        options = {
+            "model": list(REGISTRY),
+            "name": list(EXPORTS),
+            "fmt": list(CONTENT_TYPES),
+        }
+        routes = [(pattern, "shop_main.urls", "") for pattern in shop_urls.urlpatterns]
+        routes += [(pattern, ApiURLConf, "api:") for pattern in api_router.urls]
+        seen = set()
+        for pattern, urlconf, prefix in routes:
+            callback = pattern.callback
+            actions = getattr(callback, "actions", None)
+            if (prefix, pattern.name) in seen:
+                continue  # format suffix routes
+            seen.add((prefix, pattern.name))
+            methods = actions or callback.view_class.http_method_names
+            if "get" not in methods:
+                continue
+            keys = sorted(pattern.pattern.regex.groupindex)
+            if "pk" in keys:
+                model = (
+                    callback.cls.queryset.model
+                    if actions
+                    else callback.view_class.model
+                )
+                options["pk"] = [model.objects.order_by("pk").first().pk]
+            for values in itertools.product(*(options[key] for key in keys)):
+                kwargs = dict(zip(keys, values))
+                url = reverse(pattern.name, urlconf=urlconf, kwargs=kwargs)
+                variant = ",".join(str(kwargs[key]) for key in keys if key != "pk")
+                label = prefix + pattern.name + (f"[{variant}]" if variant else "")
+                yield label, url
+                for name, query in QUERY_VARIANTS.get(pattern.name, {}).items():
+                    yield f"{label}[{name}]", f"{url}?{urlencode(query)}"
+
+    def measure(self):
+        counts = {}
+        for label, url in self.pages():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+            self.assertLess(response.status_code, 500, f"{label}: {url}")
+            counts[label] = len(queries)
+        return counts
+
+    def test_query_budgets(self):
+        self.add_rows(2)
+        small = self.measure()
+        self.add_rows(8)
+        large = self.measure()
+        for label, count in large.items():
+            with self.subTest(label):
+                self.assertLessEqual(
+                    count, small[label], "query count grows with the number of rows"
+                )
+        if os.environ.get(UPDATE_BUDGETS):
+            QUERY_BUDGETS.write_text(
+                json.dumps(large, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+            )
+            return
+        budgets = json.loads(QUERY_BUDGETS.read_text(encoding="utf-8"))
+        self.assertEqual(
+            sorted(budgets),
+            sorted(large),
+            f"pages added or removed, rerun with {UPDATE_BUDGETS}=1",
+        )
+        for label, count in large.items():
+            with self.subTest(label):
+                self.assertEqual(
+                    count,
+                    budgets[label],
+                    f"queries of {label} changed; if that is intended, rerun "
+                    f"with {UPDATE_BUDGETS}=1",
+                )
+
+
+class StockFeedSyncTests(TestCase):
+    def sync(self, *rows):
+        sync = StockFeedSync()
+        sync.sync_batch(enumerate(rows, start=1))
+        return sync.stats
+
+    def test_applies_feed_after_price_changed_elsewhere(self):
+        product = make_product()
+        row = {"product_id": product.pk, "price": "999.00", "stock_quantity": 3}
+        self.assertEqual(self.sync(row).changed, 1)
+        # A sale or an admin edit in between is still overwritten.
+        Product.objects.filter(pk=product.pk).update(
+            price=Decimal("5"), stock_quantity=1
+        )
+        stats = self.sync(row)
+        self.assertEqual((stats.changed, stats.unchanged), (1, 0))
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal("999.00"))
+        self.assertEqual(product.stock_quantity, 3)
+
+    def test_skips_unchanged_rows(self):
+        product = make_product(price=Decimal("1000"), stock_quantity=10)
+        updated_at = product.updated_at
+        stats = self.sync(
+            {"product_id": product.pk, "price": "1000.00", "stock_quantity": "10"}
+        )
+        self.assertEqual((stats.changed, stats.unchanged), (0, 1))
+        product.refresh_from_db()
+        self.assertEqual(product.updated_at, updated_at)
+
+    def test_matches_by_name_and_artist(self):
+        product = make_product("Animals")
+        stats = self.sync(
+            {
+                "product_name": "Animals",
+                "artist": "Pink Floyd",
+                "price": "1500",
+                "stock_quantity": 2,
+            }
+        )
+        self.assertEqual(stats.changed, 1)
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal("1500"))
+
+    def test_rejects_ambiguous_name_and_artist(self):
+        first = make_product("Animals")
+        second = make_product("Animals")  # another artist of the same name
+        sync = StockFeedSync()
+        sync.sync_batch(
+            [
+                (
+                    1,
+                    {
+                        "product_name": "Animals",
+                        "artist": "Pink Floyd",
+                        "price": "1",
+                        "stock_quantity": 0,
+                    },
+                )
+            ]
+        )
+        self.assertEqual((sync.stats.changed, sync.stats.invalid), (0, 1))
+        self.assertIn("use product_id", sync.stats.errors[0])
+        for product in (first, second):
+            product.refresh_from_db()
+            self.assertEqual(product.price, Decimal("1000"))
+        sync.finish()
+        self.assertEqual(sync.stats.missing, 0)
+
+
+def temporary_directory(testcase):
+    directory = tempfile.TemporaryDirectory()
+    testcase.addCleanup(directory.cleanup)
+    return Path(directory.name)
+
+
+class CatalogImporterTests(TestCase):
+    def setUp(self):
+        self.media_root = temporary_directory(self)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.images = temporary_directory(self)
+        (self.images / "wall.png").write_bytes(b"the wall")
+
+    def row(self, **fields):
+        return {
+            "product_name": "The Wall",
+            "artist": "Pink Floyd",
+            "genre": Genre.GenreChoices.ROCK_METAL,
+            "price": "1000",
+            "stock_quantity": 10,
+            **fields,
+        }
+
+    def stored_files(self):
+        return sorted(p for p in self.media_root.rglob("*") if p.is_file())
+
+    def test_attaches_picture(self):
+        importer = CatalogImporter(self.images)
+        (product,) = importer.import_batch([(1, self.row(picture="wall.png"))])
+        product.refresh_from_db()
+        self.assertEqual(product.picture.read(), b"the wall")
+        self.assertEqual(importer.stats.images_attached, 1)
+
+    def test_row_without_picture_file_keeps_existing_picture(self):
+        CatalogImporter(self.images).import_batch([(1, self.row(picture="wall.png"))])
+        stored = Product.objects.get().picture.name
+        importer = CatalogImporter(self.images)
+        importer.import_batch(
+            [
+                (1, self.row(picture="", price="900")),
+                (2, self.row(product_name="Animals", picture="missing.png")),
+            ]
+        )
+        self.assertEqual(importer.stats.images_missing, 2)
+        product = Product.objects.get(product_name="The Wall")
+        self.assertEqual(product.price, Decimal("900"))
+        self.assertEqual(product.picture.name, stored)
+        self.assertFalse(Product.objects.get(product_name="Animals").picture)
+
+    def test_dry_run_writes_no_files(self):
+        path = self.images / "catalog.ndjson"
+        path.write_text(json.dumps(self.row(picture="wall.png")))
+        call_command(
+            "import_catalog",
+            str(path),
+            images=str(self.images),
+            dry_run=True,
+            stdout=io.StringIO(),
+        )
+        self.assertFalse(Product.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class MediaReferenceTests(TestCase):
+    def setUp(self):
+        self.media_root = temporary_directory(self)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def references(self, product):
+        entry = MediaFile.objects.filter(name=product.picture.name).first()
+        return entry and entry.references
+
+    def test_identical_uploads_share_one_file(self):
+        first = make_product(picture=ContentFile(b"cover", name="a.png"))
+        second = make_product("Animals", picture=ContentFile(b"cover", name="b.png"))
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertTrue(is_content_addressed(first.picture.name))
+        self.assertEqual(self.references(first), 2)
+
+    def test_replacing_a_shared_picture_keeps_the_file(self):
+        first = make_product(picture=ContentFile(b"cover", name="a.png"))
+        second = make_product("Animals", picture=ContentFile(b"cover", name="a.png"))
+        shared = first.picture.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.picture = ContentFile(b"other", name="c.png")
+            first.save()
+        self.assertEqual(self.references(second), 1)
+        self.assertEqual(self.references(first), 1)
+        self.assertTrue(picture_storage.exists(shared))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(MediaFile.objects.filter(name=shared).exists())
+        self.assertFalse(picture_storage.exists(shared))
+
+    def test_save_of_other_fields_keeps_references(self):
+        product = make_product(picture=ContentFile(b"cover", name="a.png"))
+        product.price = Decimal("1")
+        product.save()
+        product.save(update_fields=["price"])
+        Product.objects.get(pk=product.pk).save()
+        Product.objects.only("price").get(pk=product.pk).save()
+        self.assertEqual(self.references(product), 1)
+
+    def test_import_without_picture_file_keeps_reference(self):
+        product = make_product(picture=ContentFile(b"cover", name="a.png"))
+        images = temporary_directory(self)
+        with self.captureOnCommitCallbacks(execute=True):
+            CatalogImporter(images).import_batch(
+                [
+                    (
+                        1,
+                        {
+                            "product_name": product.product_name,
+                            "artist": product.artist.artist_name,
+                            "genre": product.genre.genre_name,
+                            "price": "5",
+                            "picture": "missing.png",
+                        },
+                    )
+                ]
+            )
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal("5"))
+        self.assertEqual(self.references(product), 1)
+        self.assertTrue(picture_storage.exists(product.picture.name))
+
+    def test_rehash_media_moves_legacy_files(self):
+        first = make_product()
+        second = make_product("Animals")
+        legacy = self.media_root / "products" / "images"
+        legacy.mkdir(parents=True)
+        for product, filename in ((first, "a.png"), (second, "b.png")):
+            (legacy / filename).write_bytes(b"cover")
+            Product.objects.filter(pk=product.pk).update(
+                picture=f"products/images/{filename}"
+            )
+        call_command("rehash_media", delete_originals=True, stdout=io.StringIO())
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertTrue(is_content_addressed(first.picture.name))
+        self.assertEqual(first.picture.read(), b"cover")
+        self.assertEqual(self.references(first), 2)
+        self.assertFalse((legacy / "a.png").exists())
+        self.assertFalse((legacy / "b.png").exists())
+
+
+class CouponRedemptionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        coupons.clear()
+        self.coupon = Coupon.objects.create(code="SALE", discount_percent=10)
+
+    def test_redeem_keeps_cached_coupons(self):
+        coupons.resolve("sale")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(coupons.redeem(self.coupon))
+        with self.assertNumQueries(0):
+            self.assertEqual(coupons.resolve("SALE"), self.coupon)
+
+    def test_redeem_changes_api_etag(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        url = reverse("coupon-detail", args=[self.coupon.pk])
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            coupons.redeem(self.coupon)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["times_redeemed"], 1)
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer")
+        self.product = make_product(stock_quantity=2)
+
+    def test_trims_lines_to_stock(self):
+        other = make_product("Animals", stock_quantity=5)
+        result = place_order(self.user, {self.product.pk: 3, other.pk: 1})
+        self.assertTrue(result.trimmed)
+        self.assertEqual(result.placed, {self.product.pk: 2, other.pk: 1})
+        self.assertEqual(result.rejected, {self.product.pk: (3, 2)})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 0)
+        self.assertEqual(result.order.status, "Placed")
+        self.assertEqual(result.order.total, Decimal("3000"))
+
+    def test_rejects_short_lines_without_partial(self):
+        with self.assertRaises(CheckoutError):
+            place_order(self.user, {self.product.pk: 3}, partial=False)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_rolls_back_when_coupon_is_used_up(self):
+        coupon = Coupon.objects.create(
+            code="ONCE", discount_percent=10, max_redemptions=1
+        )
+        place_order(self.user, {self.product.pk: 1}, coupon=coupon)
+        with self.assertRaises(CheckoutError):
+            place_order(self.user, {self.product.pk: 1}, coupon=coupon)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_redeemed, 1)
+        self.assertEqual(OrderItem.objects.get().quantity, 1)
+
+    def test_view_keeps_rejected_lines_in_cart(self):
+        other = make_product("Animals", stock_quantity=5)
+        CartItem.objects.create(user=self.user, product=self.product, quantity=3)
+        CartItem.objects.create(user=self.user, product=other, quantity=1)
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("cart"),
+            {
+                "action": "checkout",
+                "full_name": "Roger Waters",
+                "phone": "+7 900 000-00-00",
+                "city": "London",
+                "address_line": "Abbey Road, 3",
+                "postal_code": "NW8",
+            },
+            follow=True,
+        )
+        self.assertEqual(
+            list(CartItem.objects.values_list("product_id", "quantity")),
+            [(self.product.pk, 1)],
+        )
+        self.assertContains(response, "«The Wall»: заказано 2 из 3")
+        self.assertEqual(OrderItem.objects.count(), 2)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_sqlite_transactions_take_the_write_lock(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite transaction mode")
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Product.objects.exists()
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    def test_stock_never_goes_negative(self):
+        product = make_product(stock_quantity=3)
+        users = [User.objects.create_user(f"buyer{i}") for i in range(6)]
+        outcomes = []
+
+        def checkout(user):
+            try:
+                for attempt in range(50):
+                    try:
+                        place_order(user, {product.pk: 1}, partial=False)
+                    except CheckoutError:
+                        outcomes.append(False)
+                    except OperationalError:
+                        # "database is locked": retried like stress_checkout.
+                        time.sleep(0.01 * attempt)
+                        continue
+                    else:
+                        outcomes.append(True)
+                    return
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).aggregate(Sum("quantity"))
+        self.assertEqual(outcomes.count(True), 3)
+        self.assertEqual(len(outcomes), len(users))
+        self.assertEqual(product.stock_quantity, 0)
+        self.assertEqual(sold["quantity__sum"], 3)
+
+
+class CouponResolveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        coupons.clear()
+
+    def test_normalizes_case_and_whitespace(self):
+        coupon = Coupon.objects.create(code=" Summer10 ", discount_percent=10)
+        self.assertEqual(coupon.normalized_code, "SUMMER10")
+        self.assertEqual(coupons.resolve("summer10"), coupon)
+        self.assertEqual(coupons.resolve("  SUMMER10\n"), coupon)
+        self.assertIsNone(coupons.resolve("   "))
+        self.assertIsNone(coupons.resolve("WINTER10"))
+
+    def test_checks_validity_window(self):
+        now = timezone.now()
+        Coupon.objects.create(
+            code="LATER", discount_percent=10, valid_from=now + timedelta(days=1)
+        )
+        Coupon.objects.create(
+            code="OVER", discount_percent=10, valid_to=now - timedelta(days=1)
+        )
+        self.assertIsNone(coupons.resolve("LATER", now))
+        self.assertIsNotNone(coupons.resolve("LATER", now + timedelta(days=2)))
+        self.assertIsNone(coupons.resolve("OVER", now))
+
+    def test_ignores_inactive_coupons(self):
+        coupon = Coupon.objects.create(code="OFF", discount_percent=10)
+        self.assertEqual(coupons.resolve("OFF"), coupon)
+        coupon.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            coupon.save()
+        self.assertIsNone(coupons.resolve("OFF"))
+
+    def test_redeem_stops_at_max_redemptions(self):
+        coupon = Coupon.objects.create(
+            code="TWICE", discount_percent=10, max_redemptions=2
+        )
+        self.assertEqual(
+            [coupons.redeem(coupon) for _ in range(3)], [True, True, False]
+        )
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.times_redeemed, 2)
+
+    def test_detail_page_renders_tags(self):
+        coupon = Coupon.objects.create(
+            code="PAGE", discount_percent=10, max_redemptions=5
+        )
+        self.client.force_login(User.objects.create_superuser("admin"))
+        response = self.client.get(f"/coupons/{coupon.pk}/")
+        self.assertContains(response, "из 5")
+        self.assertNotContains(response, "{%")
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(user=User.objects.create_user("buyer"))
+        self.wall = make_product(price=Decimal("1000"))
+        self.animals = make_product("Animals", price=Decimal("250.50"))
+
+    def add(self, product, quantity):
+        return OrderItem.objects.create(
+            order=self.order,
+            product=product,
+            quantity=quantity,
+            price_at_order=product.price,
+        )
+
+    def assertTotals(self, subtotal, discount, item_count):
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(
+            (order.subtotal, order.discount, order.total, order.item_count),
+            (
+                Decimal(subtotal),
+                Decimal(discount),
+                Decimal(subtotal) - Decimal(discount),
+                item_count,
+            ),
+        )
+
+    def test_follow_item_changes(self):
+        wall = self.add(self.wall, 2)
+        animals = self.add(self.animals, 1)
+        self.assertTotals("2250.50", "0", 3)
+        wall.quantity = 1
+        wall.save()
+        self.assertTotals("1250.50", "0", 2)
+        animals.delete()
+        self.assertTotals("1000", "0", 1)
+
+    def test_item_moved_to_another_order(self):
+        item = self.add(self.wall, 1)
+        other = Order.objects.create(user=self.order.user, status="Placed")
+        item.order = other
+        item.save()
+        self.assertTotals("0", "0", 0)
+        other.refresh_from_db()
+        self.assertEqual(other.total, Decimal("1000"))
+
+    def test_follow_coupon_changes(self):
+        self.add(self.animals, 1)
+        self.order.coupon = Coupon.objects.create(code="TEN", discount_percent=10)
+        self.order.save()
+        self.assertTotals("250.50", "25.05", 1)
+        self.assertEqual(self.order.total, Decimal("225.45"))
+        self.add(self.wall, 1)
+        self.assertTotals("1250.50", "125.05", 2)
+        order = Order.objects.get(pk=self.order.pk)
+        order.coupon = None
+        order.save()
+        self.assertTotals("1250.50", "0", 2)
+
+    def test_backfill_order_totals(self):
+        self.add(self.wall, 3)
+        self.order.coupon = Coupon.objects.create(code="HALF", discount_percent=50)
+        self.order.save()
+        Order.objects.update(
+            subtotal=Decimal("0"), discount=Decimal("0"), total=0, item_count=0
+        )
+        call_command("backfill_order_totals", batch_size=1, stdout=io.StringIO())
+        self.assertTotals("3000", "1500", 3)
+
+
+class BulkApiTests(TestCase):
+    url = "/api/products/bulk/"
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.genre = Genre.objects.create(
+            genre_name=Genre.GenreChoices.ROCK_METAL, description=""
+        )
+        self.artist = Artist.objects.create(artist_name="Pink Floyd")
+
+    def row(self, name, **fields):
+        return {
+            "product_name": name,
+            "description": "LP",
+            "price": "1000.00",
+            "stock_quantity": 1,
+            "genre": self.genre.pk,
+            "artist": self.artist.pk,
+            **fields,
+        }
+
+    def send(self, method, rows):
+        return getattr(self.client, method)(
+            self.url, json.dumps(rows), content_type="application/json"
+        )
+
+    def test_partial_failure(self):
+        response = self.send(
+            "post",
+            [
+                self.row("Animals"),
+                self.row("Meddle", price="-"),
+                self.row("Animals"),
+                self.row("Relics", artist=0),
+            ],
+        )
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(body["summary"], {"created": 1, "invalid": 3})
+        statuses = [result["status"] for result in body["results"]]
+        self.assertEqual(statuses, ["created", "invalid", "invalid", "invalid"])
+        self.assertIn("price", body["results"][1]["errors"])
+        self.assertIn("artist", body["results"][3]["errors"])
+        self.assertEqual(
+            list(Product.objects.values_list("product_name", flat=True)), ["Animals"]
+        )
+
+    def test_all_invalid_is_bad_request(self):
+        response = self.send("patch", [{"id": 0, "price": "1"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["summary"], {"invalid": 1})
+
+    @override_settings(SHOP_BULK_MAX_ROWS=2)
+    def test_batch_size_limit(self):
+        response = self.send("post", [self.row(f"Album {i}") for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+
+    @override_settings(SHOP_ROW_COUNT_MODE=counts.COUNTER)
+    def test_upsert_reaches_search_cache_and_counts(self):
+        counts.refresh_counters([Product])
+        existing = make_product("Animals", artist=self.artist, genre=self.genre)
+        product_version = get_versions(["product"])["product"]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.send(
+                "put",
+                [
+                    self.row("Animals", description="pigs and sheep"),
+                    self.row("Wish You Were Here", description="shine on"),
+                ],
+            )
+        self.assertEqual(response.json()["summary"], {"created": 1, "updated": 1})
+        self.assertNotEqual(get_versions(["product"])["product"], product_version)
+        self.assertEqual(int(counts.count_rows(Product)), 2)
+        found = search.search_products(Product.objects.all(), "sheep", ranked=False)
+        self.assertEqual(list(found), [existing])
+        found = search.search_products(Product.objects.all(), "shine", ranked=False)
+        self.assertEqual(
+            [product.product_name for product in found], ["Wish You Were Here"]
+        )
+
+
+class CartMergeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer")
+
+    def merge(self, cookie):
+        request = RequestFactory().get("/")
+        request.COOKIES[cart.COOKIE_NAME] = signing.Signer(salt=cart.COOKIE_SALT).sign(
+            cookie
+        )
+        request.user = self.user
+        cart.merge_on_login(request, self.user)
+        return request
+
+    def test_drops_products_that_no_longer_exist(self):
+        product = make_product()
+        self.merge(f"{product.pk}:2,{product.pk + 100}:1")
+        self.assertEqual(
+            list(CartItem.objects.values_list("product_id", "quantity")),
+            [(product.pk, 2)],
+        )
+
+    def test_reserves_merged_units(self):
+        product = make_product(stock_quantity=3)
+        other = make_product("Animals", stock_quantity=0)
+        request = self.merge(f"{product.pk}:5,{other.pk}:1")
+        self.assertEqual(
+            list(CartItem.objects.values_list("product_id", "quantity")),
+            [(product.pk, 3)],
+        )
+        product.refresh_from_db()
+        self.assertEqual(product.reserved_quantity, 3)
+        self.assertEqual(
+            StockReservation.objects.get(user=self.user, product=product).quantity, 3
+        )
+        response = HttpResponse()
+        for backend in request._cart_backends:
+            backend.persist(response)
+        self.assertEqual(response.cookies[cart.COOKIE_NAME].value, "")
+
+
+class ApiPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin"))
+        artist = Artist.objects.create(artist_name="Pink Floyd")
+        self.ids = [
+            make_product(f"Album {i}", artist=artist, price=Decimal("10")).pk
+            for i in range(5)
+        ]
+
+    def pages(self, **params):
+        ids = []
+        for page in (1, 2, 3):
+            query = urlencode({"page": page, "page_size": 2, **params})
+            response = self.client.get(f"/api/products/?{query}")
+            ids += [row["id"] for row in response.json()["results"]]
+        return ids
+
+    def test_page_fallback_orders_by_pk(self):
+        self.assertEqual(self.pages(), self.ids)
+
+    def test_page_fallback_breaks_ties_by_pk(self):
+        self.assertEqual(self.pages(ordering="price"), self.ids)
+        with CaptureQueriesContext(connection) as queries:
+            self.pages(ordering="-price")
+        paged = [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith('SELECT "shop_main_product"') and "LIMIT" in q["sql"]
+        ]
+        self.assertTrue(paged)
+        for sql in paged:
+            self.assertRegex(sql, r'ORDER BY .*"price" DESC, .*"id" ASC')
+
+
+class QueryInstrumentationTests(TestCase):
+    def run_request(self, queries, view_name=None):
+        def view(request):
+            for i in range(queries):
+                Product.objects.filter(pk=i).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        request.resolver_match = view_name and mock.Mock(view_name=view_name)
+        return QueryInstrumentationMiddleware(view)(request)
+
+    @override_settings(SHOP_SQL_LOG_SAMPLE_RATE=0)
+    def test_cheap_requests_are_not_fingerprinted(self):
+        with mock.patch.object(
+            QueryStats, "fingerprints", side_effect=AssertionError
+        ), self.assertNoLogs("shop_main.sql"):
+            response = self.run_request(3)
+        self.assertIn('desc="3 queries, most repeated x3"', response["Server-Timing"])
+
+    @override_settings(
+        SHOP_SQL_LOG_SAMPLE_RATE=0,
+        SHOP_SQL_LOG_THRESHOLDS={"*": {"queries": 100, "repeats": 5}},
+    )
+    def test_repeated_statement_is_logged(self):
+        with self.assertLogs("shop_main.sql", "WARNING") as logs:
+            self.run_request(6)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["exceeded"], ["repeats"])
+        self.assertEqual(record["repeated"][0]["count"], 6)
+        self.assertIn('"shop_main_product"', record["repeated"][0]["sql"])
+
+    @override_settings(
+        SHOP_SQL_LOG_SAMPLE_RATE=0,
+        SHOP_SQL_LOG_THRESHOLDS={"*": {"queries": 100}, "catalog": {"queries": 4}},
+    )
+    def test_view_threshold_logs_warning_with_server_timing(self):
+        with self.assertLogs("shop_main.sql", "INFO") as logs:
+            response = self.run_request(4, "catalog")
+        self.assertEqual(logs.records[0].levelno, logging.WARNING)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record["exceeded"], record["queries"]), (["queries"], 4))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^sql;dur=[\d.]+;desc="4 queries, most repeated x4", app;dur=[\d.]+$',
+        )
+
+    @override_settings(SHOP_SQL_LOG_SAMPLE_RATE=1)
+    def test_sampled_request_logs_info(self):
+        with self.assertLogs("shop_main.sql", "INFO") as logs:
+            self.run_request(1)
+        self.assertEqual(logs.records[0].levelno, logging.INFO)
+        self.assertEqual(json.loads(logs.records[0].getMessage())["exceeded"], [])
+
+
+def png_bytes(size=(600, 400), color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(SHOP_IMAGE_WIDTHS=(280, 560), SHOP_IMAGE_FORMATS=("webp",))
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = temporary_directory(self)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def upload(self, name="The Wall", data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product(
+                name, picture=ContentFile(data or png_bytes(), name="cover.png")
+            )
+        product.refresh_from_db()
+        return product
+
+    def test_upload_encodes_only_the_fallback(self):
+        product = self.upload()
+        self.assertEqual(list(product.picture_variants["variants"]), ["jpeg"])
+        self.assertIsNotNone(images.picture_sources(product))
+        self.assertTrue(images.needs_variants(product))
+
+    @override_settings(SHOP_IMAGE_INLINE_FORMATS=("webp",))
+    def test_inline_formats(self):
+        product = self.upload()
+        self.assertEqual(sorted(product.picture_variants["variants"]), ["jpeg", "webp"])
+        self.assertFalse(images.needs_variants(product))
+
+    def test_shared_file_reuses_variants(self):
+        first = self.upload()
+        with mock.patch.object(images, "encode", side_effect=AssertionError):
+            second = self.upload("Animals")
+        self.assertEqual(second.picture_variants, first.picture_variants)
+
+    def test_unchanged_picture_is_not_encoded_again(self):
+        product = self.upload()
+        product.price = Decimal("1")
+        with mock.patch.object(images, "build_variants", side_effect=AssertionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+
+    def test_command_adds_the_other_formats(self):
+        product = self.upload()
+        call_command("build_image_variants", workers=1, stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(sorted(product.picture_variants["variants"]), ["jpeg", "webp"])
+        self.assertFalse(images.needs_variants(product))
+
+    def derived_files(self):
+        storage = images.derived_storage()
+        return {
+            f"{images.DERIVED_DIR}{directory}/{name}"
+            for directory in storage.listdir(images.DERIVED_DIR)[0]
+            for name in storage.listdir(f"{images.DERIVED_DIR}{directory}")[1]
+        }
+
+    def test_sweep_deletes_widths_a_rebuild_replaced(self):
+        product = self.upload()
+        with override_settings(SHOP_IMAGE_WIDTHS=(200,)):
+            call_command(
+                "build_image_variants", workers=1, force=True, stdout=io.StringIO()
+            )
+        product.refresh_from_db()
+        referenced = images.referenced_derivatives()
+        self.assertEqual(len(referenced), 2)
+        self.assertGreater(self.derived_files(), referenced)
+        # Fresh files wait for the minimum age.
+        self.assertEqual(images.sweep_derivatives(), 0)
+        self.assertEqual(images.sweep_derivatives(min_age=timedelta(0)), 2)
+        self.assertEqual(self.derived_files(), referenced)
+
+    def test_sweep_deletes_directories_nothing_lists(self):
+        shared = self.upload()
+        self.upload("Animals")
+        storage = images.derived_storage()
+        stray = storage.save(
+            f"{images.DERIVED_DIR}gone-0123456789abcdef/280.jpeg", ContentFile(b"x")
+        )
+        stdout = io.StringIO()
+        call_command("sweep_image_variants", min_age=0, stdout=stdout)
+        self.assertIn("1 unused picture derivatives deleted", stdout.getvalue())
+        self.assertFalse(storage.exists(stray))
+        self.assertFalse(storage.exists(stray.rsplit("/", 1)[0]))
+        shared.refresh_from_db()
+        for _, name in shared.picture_variants["variants"]["jpeg"]:
+            self.assertTrue(storage.exists(name))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        artist = Artist.objects.create(artist_name="Pink Floyd")
+        # Repeated prices, so pages have to break ties on the id.
+        for i in range(7):
+            make_product(f"Album {i}", artist=artist, price=Decimal(i // 3))
+
+    def walk(self, query):
+        pages = []
+        cursor = None
+        while True:
+            query.cursor = cursor
+            page = query.page(page_size=3)
+            pages.append(page)
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_row_once(self):
+        for sort in ("price", "-price", "product_name", "-created_at"):
+            with self.subTest(sort=sort):
+                query = CatalogQuery(sort=sort)
+                pages = self.walk(query)
+                rows = [product.pk for page in pages for product in page]
+                tiebreak = "-pk" if sort.startswith("-") else "pk"
+                expected = Product.objects.order_by(sort, tiebreak)
+                self.assertEqual(rows, list(expected.values_list("pk", flat=True)))
+                self.assertEqual(len(pages), 3)
+
+    def test_previous_cursor_returns_the_same_page(self):
+        query = CatalogQuery(sort="price")
+        first, second, third = self.walk(query)
+        self.assertIsNone(first.previous_cursor)
+        query.cursor = third.previous_cursor
+        back = query.page(page_size=3)
+        self.assertEqual(list(back), list(second))
+        query.cursor = back.previous_cursor
+        self.assertEqual(list(query.page(page_size=3)), list(first))
+
+    def test_bad_cursor_starts_over(self):
+        first = CatalogQuery(sort="price").page(page_size=3)
+        for cursor in ("garbage", "eyJ2IjogIngiLCAicGsiOiAieCJ9"):
+            with self.subTest(cursor=cursor):
+                page = CatalogQuery(sort="price", cursor=cursor).page(page_size=3)
+                self.assertEqual(list(page), list(first))
+
+
+class SearchIndexTests(TestCase):
+    def found(self, query):
+        return list(
+            search.search_products(Product.objects.order_by("pk"), query, ranked=False)
+        )
+
+    def test_product_saves_and_deletes(self):
+        product = make_product("Animals")
+        self.assertEqual(self.found("anim"), [product])
+        product.product_name = "Meddle"
+        product.save()
+        self.assertEqual(self.found("animals"), [])
+        self.assertEqual(self.found("meddle"), [product])
+        product.delete()
+        self.assertEqual(self.found("meddle"), [])
+
+    def test_artist_and_genre_renames_reindex_products(self):
+        product = make_product()
+        artist = product.artist
+        artist.artist_name = "Roger Waters"
+        artist.save()
+        self.assertEqual(self.found("waters"), [product])
+        self.assertEqual(self.found("floyd"), [])
+        genre = product.genre
+        genre.genre_name = Genre.GenreChoices.JAZZ_BLUES
+        genre.save()
+        self.assertEqual(self.found("джаз"), [product])
+
+    def test_ranks_name_matches_first(self):
+        in_description = make_product("Meddle", description="echoes of animals")
+        in_name = make_product("Animals", artist=in_description.artist)
+        ranked = search.search_products(Product.objects.all(), "animals")
+        self.assertEqual(
+            list(ranked.order_by("-search_rank")), [in_name, in_description]
+        )
+
+    def test_rebuild(self):
+        backend = search.get_backend()
+        if not backend.table:
+            self.skipTest("no search index table on this database")
+        product = make_product("Animals")
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {backend.table}")
+        self.assertEqual(self.found("animals"), [])
+        backend.rebuild()
+        self.assertEqual(self.found("animals"), [product])
+
+
+class VersionedCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def cached(self, depends_on, value):
+        return shop_cache.get_or_set("test", {"key": 1}, depends_on, lambda: value)
+
+    def test_bump_after_commit_invalidates(self):
+        self.assertEqual(self.cached(["product"], "old"), "old")
+        self.assertEqual(self.cached(["product"], "new"), "old")
+        with self.captureOnCommitCallbacks(execute=True):
+            shop_cache.bump_version("product")
+        self.assertEqual(self.cached(["product"], "new"), "new")
+
+    def test_rolled_back_bump_keeps_entries(self):
+        self.cached(["product"], "old")
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                shop_cache.bump_version("product")
+                transaction.set_rollback(True)
+        self.assertEqual(self.cached(["product"], "new"), "old")
+
+    def test_other_versions_keep_entries(self):
+        self.cached(["product:1"], "old")
+        with self.captureOnCommitCallbacks(execute=True):
+            shop_cache.bump_version("product:2", "artist")
+        self.assertEqual(self.cached(["product:1"], "new"), "old")
+
+    def test_evicted_version_never_reuses_old_keys(self):
+        self.cached(["genre"], "old")
+        cache.delete("shop:version:genre")
+        self.assertEqual(self.cached(["genre"], "new"), "new")
+
+    def test_product_page_follows_product_saves(self):
+        self.client.force_login(User.objects.create_user("buyer"))
+        product = make_product("Animals")
+        other = make_product("Meddle", artist=product.artist)
+        url = reverse("product_detail", args=[product.pk])
+        self.assertContains(self.client.get(url), "Animals")
+        with self.captureOnCommitCallbacks(execute=True):
+            other.price = Decimal("1")
+            other.save()
+        # Saving another product leaves this page's entry in place.
+        shop_cache.get_or_set(
+            "product",
+            {"pk": product.pk},
+            (f"product:{product.pk}", "artist", "genre"),
+            lambda: self.fail("entry was dropped"),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            product.product_name = "Pigs"
+            product.save()
+        self.assertContains(self.client.get(url), "Pigs")
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer")
+        self.other = User.objects.create_user("other")
+        self.product = make_product(stock_quantity=3)
+
+    def reserved(self):
+        self.product.refresh_from_db()
+        return self.product.reserved_quantity
+
+    def test_reserve_holds_available_stock_only(self):
+        self.assertTrue(reservations.reserve(self.user, self.product.pk, 2))
+        self.assertFalse(reservations.reserve(self.other, self.product.pk, 2))
+        self.assertTrue(reservations.reserve(self.user, self.product.pk))
+        self.assertEqual(self.reserved(), 3)
+        self.assertEqual(self.product.available_quantity, 0)
+        self.assertEqual(StockReservation.objects.get(user=self.user).quantity, 3)
+
+    def test_release(self):
+        reservations.reserve(self.user, self.product.pk, 3)
+        reservations.release(self.user, self.product.pk, 1)
+        self.assertEqual(self.reserved(), 2)
+        reservations.release(self.user, self.product.pk)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        reservations.release(self.user, self.product.pk)
+        self.assertEqual(self.reserved(), 0)
+
+    def test_checkout_converts_holds(self):
+        reservations.reserve(self.other, self.product.pk, 1)
+        reservations.reserve(self.user, self.product.pk, 2)
+        result = place_order(self.user, {self.product.pk: 2}, partial=False)
+        self.assertEqual(result.placed, {self.product.pk: 2})
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(self.product.stock_quantity, 1)
+        self.assertFalse(StockReservation.objects.filter(user=self.user).exists())
+
+    def test_sweep_releases_expired_holds(self):
+        reservations.reserve(self.user, self.product.pk, 2)
+        reservations.reserve(self.other, self.product.pk, 1)
+        StockReservation.objects.filter(user=self.user).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(reservations.sweep(batch_size=1), 1)
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(
+            list(StockReservation.objects.values_list("user", flat=True)),
+            [self.other.pk],
+        )
+        later = timezone.now() + reservations.get_ttl() + timedelta(seconds=1)
+        self.assertEqual(reservations.sweep(now=later), 1)
+        self.assertEqual(self.reserved(), 0)
+
+    def test_sweep_command(self):
+        reservations.reserve(self.user, self.product.pk, 1)
+        StockReservation.objects.update(expires_at=timezone.now())
+        out = io.StringIO()
+        call_command("sweep_reservations", stdout=out)
+        self.assertIn("1 expired reservations released", out.getvalue())
+        self.assertEqual(self.reserved(), 0)
+
+    def test_add_to_cart_reserves(self):
+        self.client.force_login(self.user)
+        url = reverse("catalog")
+        for _ in range(4):
+            self.client.post(url, {"product_id": self.product.pk})
+        self.assertEqual(self.reserved(), 3)
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, 3)
+
+    def test_full_line_reserves_nothing(self):
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=200)
+        CartItem.objects.create(
+            user=self.user, product=self.product, quantity=cart.MAX_QUANTITY
+        )
+        self.client.force_login(self.user)
+        self.client.post(reverse("cart"), {"action": "inc", "item_id": self.product.pk})
+        self.client.post(
+            reverse("product_detail", kwargs={"pk": self.product.pk}),
+            {"add_to_cart": "1"},
+        )
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(
+            CartItem.objects.get(user=self.user).quantity, cart.MAX_QUANTITY
+        )
+
+    @override_settings(SHOP_CART_BACKEND="shop_main.cart.CacheCartBackend")
+    def test_full_cart_reserves_nothing(self):
+        key = f"shop:cart:user:{self.user.pk}"
+        full = {self.product.pk + 1 + i: 1 for i in range(cart.MAX_LINES)}
+        cache.set(key, full)
+        self.addCleanup(cache.delete, key)
+        self.client.force_login(self.user)
+        self.client.post(reverse("catalog"), {"product_id": self.product.pk})
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(cache.get(key), full)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        self.users = [User.objects.create_user(f"reviewer{i}") for i in range(3)]
+
+    def review(self, user, rating, product=None):
+        return Review.objects.create(
+            user=user, product=product or self.product, rating=rating, text="..."
+        )
+
+    def assertAggregates(self, product, count, total):
+        product.refresh_from_db()
+        self.assertEqual(product.review_count, count)
+        self.assertAlmostEqual(product.rating_sum, total)
+        self.assertAlmostEqual(product.rating_avg, total / count if count else 0)
+
+    def test_follow_review_changes(self):
+        first = self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+        self.assertAggregates(self.product, 2, 7)
+        first.rating = 4
+        first.save()
+        self.assertAggregates(self.product, 2, 6)
+        first.text = "changed my mind"
+        first.save()
+        self.assertAggregates(self.product, 2, 6)
+        first.delete()
+        self.assertAggregates(self.product, 1, 2)
+        Review.objects.get().delete()
+        self.assertAggregates(self.product, 0, 0)
+
+    def test_review_moved_to_another_product(self):
+        other = make_product("Animals", artist=self.product.artist)
+        review = self.review(self.users[0], 3)
+        self.review(self.users[1], 5, product=other)
+        review.product = other
+        review.save()
+        self.assertAggregates(self.product, 0, 0)
+        self.assertAggregates(other, 2, 8)
+
+    def test_catalog_filters_and_sorts_on_aggregates(self):
+        other = make_product("Animals", artist=self.product.artist)
+        self.review(self.users[0], 5)
+        self.review(self.users[1], 3)
+        self.review(self.users[0], 2, product=other)
+        self.assertEqual(list(CatalogQuery(min_rating=4).page()), [self.product])
+        self.assertEqual(
+            list(CatalogQuery(sort="rating_avg").page()), [other, self.product]
+        )
+
+
+class RowCountTests(TestCase):
+    def test_exact(self):
+        make_product()
+        count = counts.count_rows(Product, counts.EXACT)
+        self.assertEqual((int(count), count.mode), (1, counts.EXACT))
+
+    @override_settings(SHOP_ROW_COUNT_MODE=counts.COUNTER)
+    def test_counter_is_seeded_then_kept_by_signals(self):
+        make_product()
+        self.assertEqual(int(counts.count_rows(Product)), 1)
+        self.assertEqual(RowCount.objects.get(label="shop_main.product").rows, 1)
+        second = make_product("Animals")
+        self.assertEqual(int(counts.count_rows(Product)), 2)
+        second.delete()
+        count = counts.count_rows(Product)
+        self.assertEqual((int(count), count.mode), (1, counts.COUNTER))
+
+    @override_settings(SHOP_ROW_COUNT_MODE=counts.COUNTER)
+    def test_refresh_corrects_drift(self):
+        make_product()
+        counts.count_rows(Product)
+        RowCount.objects.update(rows=42)
+        self.assertEqual(int(counts.count_rows(Product)), 42)
+        call_command("refresh_row_counts", stdout=io.StringIO())
+        self.assertEqual(int(counts.count_rows(Product)), 1)
+
+    def test_estimated_falls_back_to_exact(self):
+        make_product()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        estimate = counts.count_rows(Product, counts.ESTIMATED)
+        self.assertEqual((int(estimate), estimate.mode), (1, counts.ESTIMATED))
+        # Models without planner statistics are counted exactly.
+        counted = counts.table_counts([Product, Coupon], counts.ESTIMATED)
+        self.assertEqual(
+            (int(counted[Coupon]), counted[Coupon].mode), (0, counts.EXACT)
+        )
+
+    def test_filtered_querysets_are_counted(self):
+        make_product(price=Decimal("1"))
+        make_product("Animals", price=Decimal("5"))
+        count = counts.count_queryset(
+            Product.objects.filter(price__gt=2), counts.COUNTER
+        )
+        self.assertEqual((int(count), count.mode), (1, counts.EXACT))
+
+    def test_unknown_mode(self):
+        with override_settings(SHOP_ROW_COUNT_MODE="guess"):
+            with self.assertRaises(ValueError):
+                counts.get_mode()
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("buyer", "buyer@example.com", "pw")
+        self.product = make_product(price=Decimal("100"))
+        self.order = Order.objects.create(user=self.user, status="Paid")
+        OrderItem.objects.create(
+            order=self.order,
+            product=self.product,
+            quantity=2,
+            price_at_order=Decimal("100"),
+        )
+        self.empty = Order.objects.create(user=self.user)
+
+    def export(self, name, fmt, chunk_size=None, **params):
+        filters = exports.parse_filters(params)
+        stats = exports.ExportStats()
+        text = "".join(exports.stream(EXPORTS[name], fmt, filters, chunk_size, stats))
+        return text, stats
+
+    def test_csv_has_one_row_per_item(self):
+        text, stats = self.export("orders", exports.CSV)
+        rows = list(csv.DictReader(io.StringIO(text)))
+        self.assertEqual((stats.records, stats.rows), (2, 2))
+        self.assertEqual(
+            [(row["order_id"], row["product_name"], row["quantity"]) for row in rows],
+            [(str(self.order.pk), "The Wall", "2"), (str(self.empty.pk), "", "")],
+        )
+
+    def test_ndjson_nests_items(self):
+        text, _ = self.export("orders", exports.NDJSON)
+        records = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(records[0]["username"], "buyer")
+        self.assertEqual(
+            records[0]["items"],
+            [
+                {
+                    "product_id": self.product.pk,
+                    "product_name": "The Wall",
+                    "quantity": 2,
+                    "price_at_order": "100.00",
+                }
+            ],
+        )
+        self.assertEqual(records[1]["items"], [])
+
+    def test_filters(self):
+        _, stats = self.export("orders", exports.CSV, status="Paid")
+        self.assertEqual(stats.records, 1)
+        _, stats = self.export(
+            "orders", exports.CSV, genre=Genre.GenreChoices.JAZZ_BLUES
+        )
+        self.assertEqual(stats.records, 0)
+        today = timezone.localdate().isoformat()
+        _, stats = self.export("orders", exports.CSV, date_from=today, date_to=today)
+        self.assertEqual(stats.records, 2)
+        _, stats = self.export("products", exports.CSV, date_to="2000-01-01")
+        self.assertEqual(stats.records, 0)
+        for params in ({"date_from": "yesterday"}, {"genre": "polka"}):
+            with self.assertRaises(exports.ExportError):
+                exports.parse_filters(params)
+
+    def test_prefetch_runs_per_chunk(self):
+        for _ in range(3):
+            OrderItem.objects.create(
+                order=Order.objects.create(user=self.user),
+                product=self.product,
+                quantity=1,
+                price_at_order=Decimal("100"),
+            )
+        with CaptureQueriesContext(connection) as queries:
+            _, stats = self.export("orders", exports.NDJSON, chunk_size=2)
+        self.assertEqual(stats.records, 5)
+        items = [
+            query
+            for query in queries.captured_queries
+            if 'FROM "shop_main_orderitem"' in query["sql"]
+        ]
+        self.assertEqual(len(items), 3)
+
+    def test_output_is_flushed_in_chunks(self):
+        make_product("Animals")
+        with mock.patch.object(exports, "FLUSH_ROWS", 1):
+            chunks = list(
+                exports.stream(
+                    EXPORTS["products"], exports.CSV, exports.parse_filters({})
+                )
+            )
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith("product_id,"))
+        self.assertIn("Animals", chunks[1])
+
+    def test_view_streams_with_permission(self):
+        url = reverse("export", kwargs={"name": "orders", "fmt": "csv"})
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(staff)
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], CONTENT_TYPES["csv"])
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 3)
+        self.assertEqual(self.client.get(url, {"date_to": "soon"}).status_code, 400)
+        missing = reverse("export", kwargs={"name": "orders", "fmt": "xml"})
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_command_writes_file(self):
+        path = temporary_directory(self) / "products.ndjson"
+        out = io.StringIO()
+        call_command(
+            "export_data", "products", "--format=ndjson", f"--output={path}", stdout=out
+        )
+        record = json.loads(path.read_text(encoding="utf-8"))
+        self.assertEqual(record["product_name"], "The Wall")
+        self.assertIn("products: 1 records, 1 rows", out.getvalue())
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rock = Genre.objects.create(
+            genre_name=Genre.GenreChoices.ROCK_METAL, description=""
+        )
+        self.jazz = Genre.objects.create(
+            genre_name=Genre.GenreChoices.JAZZ_BLUES, description=""
+        )
+        self.floyd = Artist.objects.create(artist_name="Pink Floyd")
+        self.davis = Artist.objects.create(artist_name="Miles Davis")
+        self.yes = Artist.objects.create(artist_name="Yes")
+        for name, price in (("The Wall", 500), ("Animals", 1500), ("Meddle", 6000)):
+            make_product(name, self.floyd, self.rock, price=Decimal(price))
+        for name, price in (("Kind of Blue", 2500), ("Bitches Brew", 2999.99)):
+            make_product(name, self.davis, self.jazz, price=Decimal(str(price)))
+        make_product("Fragile", self.yes, self.rock, price=Decimal("1000"))
+
+    def query(self, **params):
+        return CatalogQuery.from_params(
+            {key: str(value) for key, value in params.items()}
+        )
+
+    def test_genre_counts_ignore_the_genre_filter(self):
+        facet = facets.genre_facet(
+            self.query(genre=self.jazz.genre_name, artist=self.floyd.pk)
+        )
+        self.assertEqual(
+            [(entry["value"], entry["count"], entry["selected"]) for entry in facet],
+            [(self.rock.genre_name, 3, False), (self.jazz.genre_name, 0, True)],
+        )
+
+    def test_artists_by_count_with_paging(self):
+        entries, next_offset = facets.artist_facet(self.query(), limit=2)
+        self.assertEqual(
+            [(entry["label"], entry["count"]) for entry in entries],
+            [("Pink Floyd", 3), ("Miles Davis", 2)],
+        )
+        self.assertEqual(next_offset, 2)
+        entries, next_offset = facets.artist_facet(self.query(), limit=2, offset=2)
+        self.assertEqual([entry["label"] for entry in entries], ["Yes"])
+        self.assertIsNone(next_offset)
+
+    def test_selected_artist_is_pinned_to_the_first_page(self):
+        query = self.query(artist=self.yes.pk)
+        entries, next_offset = facets.artist_facet(query, limit=1)
+        self.assertEqual(
+            [(entry["label"], entry["count"], entry["selected"]) for entry in entries],
+            [("Pink Floyd", 3, False), ("Yes", 1, True)],
+        )
+        self.assertEqual(next_offset, 1)
+        entries, _ = facets.artist_facet(query, limit=1, offset=1)
+        self.assertEqual([entry["label"] for entry in entries], ["Miles Davis"])
+
+    def test_price_buckets(self):
+        facet = facets.price_facet(
+            self.query(min_price=1000, max_price="1999.99", genre=self.rock.genre_name)
+        )
+        self.assertEqual(
+            [
+                (entry["min_price"], entry["max_price"], entry["count"])
+                for entry in facet
+            ],
+            [
+                (Decimal(0), Decimal("999.99"), 1),
+                (Decimal(1000), Decimal("1999.99"), 2),
+                (Decimal(2000), Decimal("2999.99"), 0),
+                (Decimal(3000), Decimal("4999.99"), 0),
+                (Decimal(5000), None, 1),
+            ],
+        )
+        self.assertEqual(
+            [entry["selected"] for entry in facet], [False, True, False, False, False]
+        )
+        self.assertNotIn("max_price", facet[-1]["query"])
+        self.assertIn("genre=rock+and+metal", facet[-1]["query"])
+
+    def test_empty_catalog(self):
+        Product.objects.all().delete()
+        query = self.query()
+        self.assertEqual(facets.genre_facet(query), [])
+        self.assertEqual(facets.artist_facet(query), ([], None))
+        self.assertEqual(
+            [entry["count"] for entry in facets.price_facet(query)], [0] * 5
+        )
+
+    def test_artist_facet_view(self):
+        url = reverse("catalog-artist-facet")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user("buyer"))
+        response = self.client.get(
+            url, {"genre": self.rock.genre_name, "limit": 1, "offset": 1}
+        )
+        self.assertEqual(
+            response.json(),
+            {
+                "results": [
+                    {
+                        "value": self.yes.pk,
+                        "label": "Yes",
+                        "count": 1,
+                        "selected": False,
+                    }
+                ],
+                "next_offset": None,
+            },
+        )
+        self.assertEqual(self.client.get(url, {"limit": "all"}).status_code, 400)
+
+
+class CrudTableTests(TestCase):
+    def test_plan_follows_the_columns(self):
+        products = REGISTRY["product"]
+        self.assertEqual(
+            products.only,
+            [
+                "artist__artist_name",
+                "genre__genre_name",
+                "price",
+                "product_name",
+                "stock_quantity",
+            ],
+        )
+        self.assertEqual(products.select_related, ["artist", "genre"])
+        self.assertEqual(products.prefetch, [])
+        users = REGISTRY["user"]
+        self.assertEqual(users.select_related, [])
+        self.assertEqual(
+            [prefetch.prefetch_to for prefetch in users.prefetch], ["groups"]
+        )
+        self.assertEqual(
+            users.prefetch[0].queryset.query.deferred_loading, ({"name"}, False)
+        )
+
+    def test_rejects_bad_columns(self):
+        bad = {
+            "unknown field": [Column("title", "Название")],
+            "ends on a relation": [Column("artist", "Исполнитель")],
+            "only columns of Product are sortable": [
+                Column("artist__artist_name", "Исполнитель", sortable=True)
+            ],
+            "needs an index": [Column("description", "Описание", sortable=True)],
+        }
+        for message, columns in bad.items():
+            with self.subTest(message):
+                with self.assertRaisesMessage(ImproperlyConfigured, message):
+                    CrudTable("bad", Product, "Товары", columns)
+        with self.assertRaisesMessage(ImproperlyConfigured, "must be sortable"):
+            CrudTable(
+                "bad",
+                Product,
+                "Товары",
+                [Column("product_name", "Название")],
+                default_sort="product_name",
+            )
+
+    def test_only_whitelisted_sorts(self):
+        products = REGISTRY["product"]
+        self.assertEqual(products.get_sort("-price"), "-price")
+        self.assertEqual(products.get_sort("pk"), "pk")
+        for value in ("description", "-stock_quantity", "artist__artist_name", ""):
+            self.assertEqual(products.get_sort(value), "product_name")
+
+    def test_list_view_pages_by_keyset(self):
+        artist = Artist.objects.create(artist_name="Pink Floyd")
+        for i in range(crud.PAGE_SIZE + 2):
+            make_product(f"Album {i:02}", artist, price=Decimal(1000 + i))
+        self.client.force_login(User.objects.create_superuser("admin"))
+        # The API router reuses the name "product-list" for /api/products/.
+        url = reverse("product-list", urlconf="shop_main.urls")
+        # The session, the user and one query for the page.
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"sort": "-price"})
+        rows = response.context["rows"]
+        self.assertEqual(len(rows), crud.PAGE_SIZE)
+        self.assertEqual(rows[0]["cells"][0], f"Album {crud.PAGE_SIZE + 1:02}")
+        with self.assertNumQueries(3):
+            response = self.client.get(f"{url}?{response.context['next_page_query']}")
+        self.assertEqual(
+            [row["cells"][0] for row in response.context["rows"]],
+            ["Album 01", "Album 00"],
+        )
+        self.assertIsNone(response.context["next_page_query"])
+        response = self.client.get(url, {"sort": "description"})
+        self.assertEqual(response.context["current_sort"], "product_name")
+
+
+@override_settings(SHOP_ROW_COUNT_MODE=counts.COUNTER)
+class SeedShopTests(TestCase):
+    def test_tiny_seed(self):
+        out = io.StringIO()
+        call_command(
+            "seed_shop",
+            "--scale=0.005",
+            "--rows=coupons=3",
+            "--batch-size=7",
+            stdout=out,
+        )
+        self.assertIn("Done in", out.getvalue())
+        self.assertEqual(Genre.objects.count(), len(Genre.GenreChoices.values))
+        self.assertEqual(
+            [
+                model.objects.count()
+                for model in (Artist, Product, User, ShippingAddress, Coupon, Order)
+            ],
+            [2, 15, 10, 12, 3, 50],
+        )
+        self.assertTrue(OrderItem.objects.exists())
+        self.assertTrue(Review.objects.exists())
+
+        for order in Order.objects.select_related("coupon").prefetch_related(
+            "orderitem_set"
+        ):
+            items = order.orderitem_set.all()
+            subtotal = sum(item.price_at_order * item.quantity for item in items)
+            self.assertEqual(order.subtotal, subtotal)
+            self.assertEqual(order.item_count, sum(item.quantity for item in items))
+            self.assertEqual(order.total, order.subtotal - order.discount)
+            if order.coupon is None:
+                self.assertEqual(order.discount, 0)
+        for coupon in Coupon.objects.all():
+            self.assertEqual(
+                coupon.times_redeemed, Order.objects.filter(coupon=coupon).count()
+            )
+
+        for product in Product.objects.all():
+            ratings = list(product.review_set.values_list("rating", flat=True))
+            self.assertEqual(product.review_count, len(ratings))
+            self.assertAlmostEqual(product.rating_sum, sum(ratings))
+            average = sum(ratings) / len(ratings) if ratings else 0
+            self.assertAlmostEqual(product.rating_avg, average)
+
+        for model in counts.COUNTED_MODELS:
+            self.assertEqual(
+                RowCount.objects.get(label=model._meta.label_lower).rows,
+                model.objects.count(),
+                model.__name__,
+            )
+
+
+class BenchmarkShopTests(TestCase):
+    def test_tiny_run(self):
+        from .management.commands import benchmark_shop
+
+        # The command normally builds and drops its own database; here it
+        # runs inside the test database and transaction.
+        for name in ("setup_test_environment", "teardown_test_environment"):
+            patcher = mock.patch.object(benchmark_shop, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        creation = mock.patch.multiple(
+            connection.creation,
+            create_test_db=mock.DEFAULT,
+            destroy_test_db=mock.DEFAULT,
+        )
+        path = temporary_directory(self) / "bench.json"
+        out = io.StringIO()
+        with creation:
+            call_command(
+                "benchmark_shop",
+                "--scales=0.005",
+                "--requests=2",
+                "--warmup=0",
+                f"--output={path}",
+                stdout=out,
+            )
+        results = json.loads(path.read_text(encoding="utf-8"))
+        scenarios = results["scales"]["0.005"]["scenarios"]
+        self.assertIn("checkout", scenarios)
+        self.assertIn("api:product-detail", scenarios)
+        for name, stats in scenarios.items():
+            with self.subTest(name):
+                self.assertEqual((stats["requests"], stats["errors"]), (2, 0))
+        self.assertEqual(benchmark_shop.compare(results, results, 0.2, 1.0), [])
+
+    def test_compare(self):
+        from .management.commands.benchmark_shop import compare
+
+        def run(p50, p95, rps):
+            stats = {"p50_ms": p50, "p95_ms": p95, "p99_ms": p95, "rps": rps}
+            return {"scales": {"1": {"scenarios": {"catalog": stats}}}}
+
+        self.assertEqual(
+            compare(run(10.5, 30, 90), run(10, 20, 100), 0.2, 1.0),
+            [("1", "catalog", "p95_ms", 20, 30), ("1", "catalog", "p99_ms", 20, 30)],
+        )
+        # Under the min delta, or within the threshold, is not a regression.
+        self.assertEqual(compare(run(1.5, 2, 85), run(1, 1.5, 100), 0.2, 1.0), [])
+        self.assertEqual(
+            compare(run(1, 1, 70), run(1, 1, 100), 0.2, 1.0),
+            [("1", "catalog", "rps", 100, 70)],
+        )
@@ -4,6 +4,11 @@ from . import views
 urlpatterns = [
     path("", views.GenreList.as_view(), name="main"),
     path("catalog/", views.ProductList.as_view(), name="catalog"),
+    path(
+        "catalog/facets/artists/",
+        views.ArtistFacetView.as_view(),
+        name="catalog-artist-facet",
+    ),
     path("product/<int:pk>/", views.ProductDetailView.as_view(), name="product_detail"),
     path("cart/", views.CartView.as_view(), name="cart"),
     path("overview/<str:model>/", views.AdminOverviewView.as_view(), name="overview"),
@@ -64,4 +69,6 @@ urlpatterns = [
     path("coupons/<int:pk>/delete/", views.CouponDeleteView.as_view(), name="coupon-delete"),
     # DB overview
     path("db/", views.DatabaseOverviewView.as_view(), name="db-overview"),
+    # Streaming exports
+    path("export/<str:name>.<str:fmt>", views.ExportView.as_view(), name="export"),
 ]
@@ -24,14 +24,33 @@ from .forms import (
     CouponForm,
 )
 from django.contrib.auth.views import LoginView, LogoutView
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.static import serve
 from django.contrib.auth import login, authenticate, logout
+from django.contrib import messages
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.shortcuts import get_object_or_404
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.http import Http404
-import json
-from django.utils import timezone
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from .catalog import RATING_CHOICES, CatalogQuery
+from .checkout import CheckoutError, place_order
+from .reservations import release
+from .facets import ARTIST_FACET_SIZE, artist_facet, catalog_facets
+from . import cache as shop_cache
+from . import coupons
+from .conditional import conditional, fingerprint, make_etag, viewer_parts
+from .counts import table_counts
+from .crud import get_table
+from .exports import CONTENT_TYPES, EXPORTS, ExportError, parse_filters, stream
+from .pagination import KeysetPaginator, cursor_querystring
+from .storage import IMMUTABLE_MAX_AGE, is_immutable
 from .models import (
     Genre,
     Artist,
@@ -43,6 +62,25 @@ from .models import (
     Coupon,
 )
 
+CATALOG_DEPENDENCIES = ("product", "artist", "genre")
+ACCOUNT_ORDERS_PAGE_SIZE = 10
+REVIEWS_PAGE_SIZE = 10
+
+
+def catalog_validators(request, *args, **kwargs):
+    query = CatalogQuery.from_params(request.GET)
+    summary = fingerprint(
+        query.filter(), {"catalog": query.params(cursor=False)}, CATALOG_DEPENDENCIES
+    )
+    parts = {**query.params(), **viewer_parts(request), "fingerprint": summary}
+    return make_etag("catalog", parts, CATALOG_DEPENDENCIES), None
+
+
+def product_page_validators(request, pk, *args, **kwargs):
+    parts = {"pk": pk, "cursor": request.GET.get("cursor"), **viewer_parts(request)}
+    depends_on = (f"product:{pk}", "artist", "genre", f"reviews:product:{pk}")
+    return make_etag("product_page", parts, depends_on), None
+
 
 class GenreList(ListView):
     model = Genre
@@ -50,6 +88,7 @@ class GenreList(ListView):
     template_name = "main.html"
 
 
+@method_decorator(conditional(catalog_validators), name="get")
 class ProductList(LoginRequiredMixin, ListView):
     model = Product
     context_object_name = "products"
@@ -57,70 +96,64 @@ class ProductList(LoginRequiredMixin, ListView):
     login_url = reverse_lazy("login")
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-
-        genre_filter = self.request.GET.get("genre")
-        if genre_filter:
-            queryset = queryset.filter(genre__genre_name=genre_filter)
-
-        artist_filter = self.request.GET.get("artist")
-        if artist_filter:
-            queryset = queryset.filter(artist__id=artist_filter)
-
-        min_price = self.request.GET.get("min_price")
-        max_price = self.request.GET.get("max_price")
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-
-        search = self.request.GET.get("search")
-        if search:
-            queryset = queryset.filter(
-                Q(product_name__icontains=search)
-                | Q(artist__artist_name__icontains=search)
-            )
-
-        sort_by = self.request.GET.get("sort", "created_at")
-        if sort_by in [
-            "price",
-            "-price",
-            "product_name",
-            "-product_name",
-            "created_at",
-            "-created_at",
-        ]:
-            queryset = queryset.order_by(sort_by)
-
-        return queryset
+        self.catalog_query = CatalogQuery.from_params(self.request.GET)
+        return self.catalog_query.queryset()
 
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["genres"] = Genre.objects.all()
-        context["artists"] = Artist.objects.all()
+        query = self.catalog_query
+        page = shop_cache.get_or_set(
+            "catalog", query.params(), CATALOG_DEPENDENCIES, query.page
+        )
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context["page_obj"] = page
+        context["next_page_query"] = cursor_querystring(
+            self.request.GET, page.next_cursor
+        )
+        context["previous_page_query"] = cursor_querystring(
+            self.request.GET, page.previous_cursor
+        )
+        context.update(
+            shop_cache.get_or_set(
+                "catalog_facets",
+                query.params(cursor=False),
+                CATALOG_DEPENDENCIES,
+                lambda: catalog_facets(query),
+            )
+        )
         context["current_genre"] = self.request.GET.get("genre")
         context["current_artist"] = self.request.GET.get("artist")
         context["current_min_price"] = self.request.GET.get("min_price")
         context["current_max_price"] = self.request.GET.get("max_price")
-        context["current_sort"] = self.request.GET.get("sort", "created_at")
+        context["current_min_rating"] = self.catalog_query.min_rating
+        context["rating_choices"] = RATING_CHOICES
+        context["current_search"] = self.request.GET.get("search", "")
+        context["current_sort"] = self.catalog_query.sort
         return context
 
     def post(self, request, *args, **kwargs):
         product_id = request.POST.get("product_id")
         if not product_id:
             return redirect("catalog")
-        product = get_object_or_404(Product, pk=product_id)
-        if product.stock_quantity <= 0:
+        try:
+            product_id = int(product_id)
+        except ValueError:
             return redirect("catalog")
-        cart = {}
+        request.cart.reserve_and_add(product_id)
+        return redirect("catalog")
+
+
+class ArtistFacetView(LoginRequiredMixin, View):
+    login_url = reverse_lazy("login")
+
+    def get(self, request, *args, **kwargs):
+        query = CatalogQuery.from_params(request.GET)
         try:
-            cart = json.loads(request.COOKIES.get("cart", "{}"))
-        except json.JSONDecodeError:
-            cart = {}
-        cart[str(product.id)] = cart.get(str(product.id), 0) + 1
-        response = redirect("catalog")
-        response.set_cookie("cart", json.dumps(cart), samesite="Lax")
-        return response
+            offset = max(int(request.GET.get("offset", 0)), 0)
+            limit = int(request.GET.get("limit", ARTIST_FACET_SIZE))
+        except ValueError:
+            return JsonResponse({"error": "invalid offset or limit"}, status=400)
+        entries, next_offset = artist_facet(query, limit=limit, offset=offset)
+        return JsonResponse({"results": entries, "next_offset": next_offset})
 
 
 class ArtistList(ListView):
@@ -174,39 +207,20 @@ class AccountView(LoginRequiredMixin, TemplateView):
         context["group_names"] = group_names
         context["role_label"] = "Администратор" if is_admin else "Пользователь"
 
-        orders = (
-            Order.objects.filter(user=user)
-            .prefetch_related("orderitem_set__product")
-            .order_by("-date_order")
+        orders = Order.objects.filter(user=user).only(
+            "date_order", "status", "subtotal", "discount", "total", "item_count"
+        )
+        page = KeysetPaginator(orders, "-date_order", ACCOUNT_ORDERS_PAGE_SIZE).page(
+            self.request.GET.get("cursor")
+        )
+        context["orders"] = page.object_list
+        context["page_obj"] = page
+        context["next_page_query"] = cursor_querystring(
+            self.request.GET, page.next_cursor
+        )
+        context["previous_page_query"] = cursor_querystring(
+            self.request.GET, page.previous_cursor
         )
-        orders_data = []
-        for o in orders:
-            items = []
-            total = 0.0
-            for it in o.orderitem_set.all():
-                subtotal = float(it.price_at_order) * it.quantity
-                total += subtotal
-                items.append(
-                    {
-                        "product": it.product,
-                        "quantity": it.quantity,
-                        "price": it.price_at_order,
-                        "subtotal": subtotal,
-                    }
-                )
-            if o.coupon and o.coupon.active:
-                percent = o.coupon.discount_percent or 0
-                total = total * (1.0 - float(percent) / 100.0)
-            orders_data.append(
-                {
-                    "id": o.id,
-                    "status": o.status,
-                    "date": o.date_order,
-                    "items": items,
-                    "total": total,
-                }
-            )
-        context["orders"] = orders_data
         return context
 
 
@@ -214,54 +228,78 @@ class CustomLogoutView(LogoutView):
     next_page = reverse_lazy("main")
 
 
+@method_decorator(conditional(product_page_validators), name="get")
 class ProductDetailView(LoginRequiredMixin, DetailView):
     model = Product
     template_name = "product_detail.html"
     context_object_name = "product"
     login_url = reverse_lazy("login")
 
+    def get_object(self, queryset=None):
+        pk = self.kwargs["pk"]
+        product = shop_cache.get_or_set(
+            "product",
+            {"pk": pk},
+            (f"product:{pk}", "artist", "genre"),
+            lambda: Product.objects.select_related("artist", "genre")
+            .filter(pk=pk)
+            .first(),
+        )
+        if product is None:
+            raise Http404("No product found matching the query")
+        return product
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["reviews"] = (
-            Review.objects.filter(product=self.object)
+        pk = self.object.pk
+        user = self.request.user
+        cursor = self.request.GET.get("cursor")
+        reviews = (
+            Review.objects.filter(product_id=pk)
             .select_related("user")
-            .order_by("-created_at")
+            .only("rating", "text", "created_at", "user__username")
+        )
+        page = shop_cache.get_or_set(
+            "product_reviews",
+            {"pk": pk, "cursor": cursor, "user": user.pk},
+            (f"reviews:product:{pk}",),
+            lambda: KeysetPaginator(reviews, "-created_at", REVIEWS_PAGE_SIZE).page(
+                cursor, pinned=Q(user=user) if user.is_authenticated else None
+            ),
+        )
+        context["reviews"] = page.object_list
+        context["own_review"] = page.pinned[0] if page.pinned else None
+        context["has_review"] = context["own_review"] is not None
+        context["next_page_query"] = cursor_querystring(
+            self.request.GET, page.next_cursor
+        )
+        context["previous_page_query"] = cursor_querystring(
+            self.request.GET, page.previous_cursor
         )
         context["form"] = ReviewForm()
-        if self.request.user.is_authenticated:
-            context["has_review"] = Review.objects.filter(
-                user=self.request.user, product=self.object
-            ).exists()
-        else:
-            context["has_review"] = False
         return context
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         if "add_to_cart" in request.POST:
-            if self.object.stock_quantity <= 0:
-                return redirect("product_detail", pk=self.object.pk)
-            try:
-                cart = json.loads(request.COOKIES.get("cart", "{}"))
-            except json.JSONDecodeError:
-                cart = {}
-            cart[str(self.object.id)] = cart.get(str(self.object.id), 0) + 1
-            response = redirect("product_detail", pk=self.object.pk)
-            response.set_cookie("cart", json.dumps(cart), samesite="Lax")
-            return response
+            request.cart.reserve_and_add(self.object.pk)
+            return redirect("product_detail", pk=self.object.pk)
 
         if not request.user.is_authenticated:
             return redirect("login")
-        if Review.objects.filter(user=request.user, product=self.object).exists():
-            return redirect("product_detail", pk=self.object.pk)
         form = ReviewForm(request.POST)
         if form.is_valid():
-            Review.objects.create(
-                rating=form.cleaned_data["rating"],
-                text=form.cleaned_data["text"],
-                user=request.user,
-                product=self.object,
-            )
+            try:
+                with transaction.atomic():
+                    Review.objects.create(
+                        rating=form.cleaned_data["rating"],
+                        text=form.cleaned_data["text"],
+                        user=request.user,
+                        product=self.object,
+                    )
+            except IntegrityError:
+                # One review per user and product (review_user_product_uniq).
+                pass
             return redirect("product_detail", pk=self.object.pk)
         context = self.get_context_data(object=self.object)
         context["form"] = form
@@ -274,33 +312,7 @@ class CartView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        try:
-            cart = json.loads(self.request.COOKIES.get("cart", "{}"))
-        except json.JSONDecodeError:
-            cart = {}
-        product_ids = [int(pid) for pid in cart.keys()]
-        products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-        items = []
-        total = 0.0
-        for pid, qty in cart.items():
-            pid_int = int(pid)
-            product = products.get(pid_int)
-            if not product:
-                continue
-            price = float(product.price)
-            subtotal = price * qty
-            total += subtotal
-            items.append(
-                {
-                    "id": pid_int,
-                    "product": product,
-                    "quantity": qty,
-                    "price": price,
-                    "subtotal": subtotal,
-                }
-            )
-        context["items"] = items
-        context["total"] = total
+        context["items"], context["total"] = self.request.cart.priced()
         initial_address = None
         if self.request.user.is_authenticated:
             from .models import ShippingAddress
@@ -325,28 +337,22 @@ class CartView(LoginRequiredMixin, TemplateView):
     def post(self, request, *args, **kwargs):
         action = request.POST.get("action")
         item_id = request.POST.get("item_id")
-        try:
-            cart = json.loads(request.COOKIES.get("cart", "{}"))
-        except json.JSONDecodeError:
-            cart = {}
-        response = None
         if action and item_id:
-            pid = str(item_id)
-            qty = cart.get(pid, 0)
+            try:
+                pid = int(item_id)
+            except ValueError:
+                return redirect("cart")
             if action == "inc":
-                cart[pid] = qty + 1
+                request.cart.reserve_and_add(pid)
             elif action == "dec":
-                if qty > 1:
-                    cart[pid] = qty - 1
-                else:
-                    cart.pop(pid, None)
+                release(request.user, pid, 1)
+                request.cart.decrement(pid)
             elif action == "remove":
-                cart.pop(pid, None)
-            response = redirect("cart")
-            response.set_cookie("cart", json.dumps(cart), samesite="Lax")
-            return response
+                release(request.user, pid)
+                request.cart.remove(pid)
+            return redirect("cart")
         elif action == "checkout":
-
+            cart = request.cart.lines()
             if not cart:
                 return redirect("cart")
 
@@ -355,69 +361,44 @@ class CartView(LoginRequiredMixin, TemplateView):
 
             coupon_obj = None
             if coupon_form.is_valid():
-                code = coupon_form.cleaned_data.get("code", "").strip()
-                if code:
-                    from .models import Coupon
-
-                    try:
-                        coupon_candidate = Coupon.objects.get(
-                            code__iexact=code, active=True
-                        )
-                        now = timezone.now()
-                        if (
-                            coupon_candidate.valid_from
-                            and coupon_candidate.valid_from > now
-                        ) or (
-                            coupon_candidate.valid_to
-                            and coupon_candidate.valid_to < now
-                        ):
-                            coupon_obj = None
-                        else:
-                            coupon_obj = coupon_candidate
-                    except Coupon.DoesNotExist:
-                        coupon_obj = None
-
-            shipping_address = None
-            if address_form.is_valid():
-                shipping_address = address_form.save(commit=False)
-                shipping_address.user = request.user
-                shipping_address.save()
-            else:
+                coupon_obj = coupons.resolve(coupon_form.cleaned_data.get("code"))
+
+            if not address_form.is_valid():
                 context = self.get_context_data()
                 context["address_form"] = address_form
                 context["coupon_form"] = coupon_form
                 return self.render_to_response(context)
 
-            order, _ = Order.objects.get_or_create(user=request.user, status="Pending")
-
-            OrderItem.objects.filter(order=order).delete()
-            product_ids = [int(pid) for pid in cart.keys()]
-            products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-            for pid_str, qty in cart.items():
-                pid = int(pid_str)
-                product = products.get(pid)
-                if not product:
-                    continue
-                if product.stock_quantity < qty:
-                    qty = product.stock_quantity
-                if qty <= 0:
+            shipping_address = address_form.save(commit=False)
+            try:
+                result = place_order(request.user, cart, shipping_address, coupon_obj)
+            except CheckoutError as exc:
+                context = self.get_context_data()
+                context["address_form"] = address_form
+                context["coupon_form"] = coupon_form
+                context["checkout_error"] = str(exc)
+                return self.render_to_response(context)
+            # Only the ordered units leave the cart; the rest of a line that
+            # was short of stock stays for the shopper to see.
+            for pid, quantity in result.placed.items():
+                request.cart.decrement(pid, quantity)
+            if not result.trimmed:
+                return redirect("account")
+            names = dict(
+                Product.objects.filter(pk__in=result.rejected).values_list(
+                    "pk", "product_name"
+                )
+            )
+            for pid, (requested, _) in result.rejected.items():
+                if pid not in names:
+                    request.cart.remove(pid)
                     continue
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=qty,
-                    price_at_order=product.price,
+                messages.warning(
+                    request,
+                    f"«{names[pid]}»: заказано {result.placed.get(pid, 0)} "
+                    f"из {requested}, в наличии не хватило товара.",
                 )
-                product.stock_quantity -= qty
-                product.save()
-            order.shipping_address = shipping_address
-            if coupon_obj:
-                order.coupon = coupon_obj
-            order.status = "Placed"
-            order.save()
-            response = redirect("account")
-            response.delete_cookie("cart")
-            return response
+            return redirect("cart")
         return redirect("cart")
 
 
@@ -430,21 +411,12 @@ class AdminOverviewView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        model_key = self.kwargs.get("model")
-        models_map = {
-            "genre": Genre,
-            "artist": Artist,
-            "product": Product,
-            "order": Order,
-            "orderitem": OrderItem,
-            "review": Review,
-            "user": User,
-        }
-        model = models_map.get(model_key)
-        if not model:
+        table = get_table(self.kwargs.get("model"))
+        if table is None:
             raise Http404()
+        model = table.model
+        context.update(crud_list_context(self.request, table))
         context["model_name"] = model.__name__
-        context["records"] = model.objects.all()[:100]
         context["admin_add_url"] = reverse_lazy(
             "admin:%s_%s_add" % (model._meta.app_label, model._meta.model_name)
         )
@@ -458,11 +430,46 @@ class AdminOverviewView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
         return context
 
 
-class GenreListView(PermissionRequiredMixin, ListView):
+def crud_list_context(request, table):
+    sort = table.get_sort(request.GET.get("sort"))
+    page = table.page(sort, request.GET.get("cursor"), request.user)
+    headers = []
+    for column in table.columns:
+        header = {"label": column.label, "sort_query": None, "sorted": None}
+        if column.sortable:
+            query = request.GET.copy()
+            query.pop("cursor", None)
+            query["sort"] = "-" + column.path if sort == column.path else column.path
+            header["sort_query"] = query.urlencode()
+            if sort.lstrip("-") == column.path:
+                header["sorted"] = "desc" if sort.startswith("-") else "asc"
+        headers.append(header)
+    return {
+        "table": table,
+        "headers": headers,
+        "rows": table.rows(page.object_list),
+        "page_obj": page,
+        "current_sort": sort,
+        "next_page_query": cursor_querystring(request.GET, page.next_cursor),
+        "previous_page_query": cursor_querystring(request.GET, page.previous_cursor),
+    }
+
+
+class CrudListView(PermissionRequiredMixin, TemplateView):
+    """List page of a model registered in ``shop_main.crud``."""
+
+    template_name = "crud/list.html"
+    table_key = None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(crud_list_context(self.request, get_table(self.table_key)))
+        return context
+
+
+class GenreListView(CrudListView):
     permission_required = "shop_main.view_genre"
-    model = Genre
-    template_name = "genre/list.html"
-    context_object_name = "records"
+    table_key = "genre"
 
 
 class GenreDetailView(PermissionRequiredMixin, DetailView):
@@ -496,11 +503,9 @@ class GenreDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # Artist Views
-class ArtistListView(PermissionRequiredMixin, ListView):
+class ArtistListView(CrudListView):
     permission_required = "shop_main.view_artist"
-    model = Artist
-    template_name = "artist/list.html"
-    context_object_name = "records"
+    table_key = "artist"
 
 
 class ArtistDetailView(PermissionRequiredMixin, DetailView):
@@ -534,11 +539,9 @@ class ArtistDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # Product Views
-class ProductListView(PermissionRequiredMixin, ListView):
+class ProductListView(CrudListView):
     permission_required = "shop_main.view_product"
-    model = Product
-    template_name = "product/list.html"
-    context_object_name = "records"
+    table_key = "product"
 
 
 class ProductDetailCrudView(PermissionRequiredMixin, DetailView):
@@ -572,20 +575,9 @@ class ProductDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # Order Views
-class OrderListView(PermissionRequiredMixin, ListView):
+class OrderListView(CrudListView):
     permission_required = "shop_main.view_order"
-    model = Order
-    template_name = "order/list.html"
-    context_object_name = "records"
-
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return Order.objects.select_related(
-                "user", "shipping_address", "coupon"
-            ).all()
-        return Order.objects.filter(user=self.request.user).select_related(
-            "shipping_address", "coupon"
-        )
+    table_key = "order"
 
 
 class OrderDetailView(PermissionRequiredMixin, DetailView):
@@ -619,11 +611,9 @@ class OrderDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # OrderItem Views
-class OrderItemListView(PermissionRequiredMixin, ListView):
+class OrderItemListView(CrudListView):
     permission_required = "shop_main.view_orderitem"
-    model = OrderItem
-    template_name = "orderitem/list.html"
-    context_object_name = "records"
+    table_key = "orderitem"
 
 
 class OrderItemDetailView(PermissionRequiredMixin, DetailView):
@@ -657,11 +647,9 @@ class OrderItemDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # Review Views
-class ReviewListView(PermissionRequiredMixin, ListView):
+class ReviewListView(CrudListView):
     permission_required = "shop_main.view_review"
-    model = Review
-    template_name = "review/list.html"
-    context_object_name = "records"
+    table_key = "review"
 
 
 class ReviewDetailView(PermissionRequiredMixin, DetailView):
@@ -695,16 +683,9 @@ class ReviewDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # ShippingAddress Views
-class ShippingAddressListView(PermissionRequiredMixin, ListView):
+class ShippingAddressListView(CrudListView):
     permission_required = "shop_main.view_shippingaddress"
-    model = ShippingAddress
-    template_name = "shippingaddress/list.html"
-    context_object_name = "records"
-
-    def get_queryset(self):
-        if self.request.user.is_staff:
-            return ShippingAddress.objects.select_related("user").all()
-        return ShippingAddress.objects.filter(user=self.request.user)
+    table_key = "shippingaddress"
 
 
 class ShippingAddressDetailView(PermissionRequiredMixin, DetailView):
@@ -738,11 +719,9 @@ class ShippingAddressDeleteView(PermissionRequiredMixin, DeleteView):
 
 
 # Coupon Views
-class CouponListView(PermissionRequiredMixin, ListView):
+class CouponListView(CrudListView):
     permission_required = "shop_main.view_coupon"
-    model = Coupon
-    template_name = "coupon/list.html"
-    context_object_name = "records"
+    table_key = "coupon"
 
 
 class CouponDetailView(PermissionRequiredMixin, DetailView):
@@ -782,26 +761,61 @@ class DatabaseOverviewView(PermissionRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
+        tables = [
+            (Genre, "Жанры", "genre-list"),
+            (Artist, "Исполнители", "artist-list"),
+            (Product, "Товары", "product-list"),
+            (Order, "Заказы", "order-list"),
+            (OrderItem, "Позиции заказа", "orderitem-list"),
+            (Review, "Отзывы", "review-list"),
+            (ShippingAddress, "Адреса доставки", "shippingaddress-list"),
+            (Coupon, "Купоны", "coupon-list"),
+        ]
+        row_counts = table_counts([model for model, _, _ in tables])
         ctx["tables"] = [
-            {"name": "Жанры", "count": Genre.objects.count(), "url": "genre-list"},
-            {
-                "name": "Исполнители",
-                "count": Artist.objects.count(),
-                "url": "artist-list",
-            },
-            {"name": "Товары", "count": Product.objects.count(), "url": "product-list"},
-            {"name": "Заказы", "count": Order.objects.count(), "url": "order-list"},
-            {
-                "name": "Позиции заказа",
-                "count": OrderItem.objects.count(),
-                "url": "orderitem-list",
-            },
-            {"name": "Отзывы", "count": Review.objects.count(), "url": "review-list"},
             {
-                "name": "Адреса доставки",
-                "count": ShippingAddress.objects.count(),
-                "url": "shippingaddress-list",
-            },
-            {"name": "Купоны", "count": Coupon.objects.count(), "url": "coupon-list"},
+                "name": name,
+                "count": row_counts[model].rows,
+                "count_mode": row_counts[model].mode_label,
+                "url": url,
+            }
+            for model, name, url in tables
         ]
         return ctx
+
+
+class ExportView(PermissionRequiredMixin, View):
+    """Streams an export from ``shop_main.exports`` as CSV or NDJSON,
+    filtered by ``date_from``, ``date_to``, ``status`` and ``genre``."""
+
+    def get_export(self):
+        export = EXPORTS.get(self.kwargs["name"])
+        if export is None or self.kwargs["fmt"] not in CONTENT_TYPES:
+            raise Http404
+        return export
+
+    def get_permission_required(self):
+        return [self.get_export().permission]
+
+    def get(self, request, name, fmt):
+        try:
+            filters = parse_filters(request.GET)
+        except ExportError as exc:
+            return HttpResponseBadRequest(str(exc))
+        response = StreamingHttpResponse(
+            stream(self.get_export(), fmt, filters), content_type=CONTENT_TYPES[fmt]
+        )
+        response["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+        return response
+
+
+def serve_media(request, path, document_root=None):
+    """Development server for MEDIA_ROOT. Files named after their content
+    never change under the same URL, so they are cached for a year; the
+    production web server should send the same headers for them."""
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and is_immutable(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    return response